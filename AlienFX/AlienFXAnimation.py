@@ -0,0 +1,258 @@
+# -*- coding: UTF-8 -*-
+
+# This file is part of pyAlienFX.
+#
+#    pyAlienFX is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    pyAlienFX is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with pyAlienFX.  If not, see <http://www.gnu.org/licenses/>.
+#
+#    This work is licensed under the Creative Commons Attribution-NonCommercial-ShareAlike 3.0 Unported License.
+#    To view a copy of this license, visit http://creativecommons.org/licenses/by-nc-sa/3.0/ or send a letter
+#    to Creative Commons, 444 Castro Street, Suite 900, Mountain View, California, 94041, USA.
+#
+
+
+# Software animations
+# The effects compute the color of each region at a given time, AlienFX_Animator renders them at a target frame rate :
+#   animator = AlienFX_Animator(controller, Rainbow(Animation_Areas(driver.computer)), fps=30)
+#   animator.Run(duration=10)
+# A frame only carries the regions whose color changed, and frames are skipped rather than queued when the device lags.
+
+import math
+import time
+import colorsys
+import threading
+import collections
+
+from AlienFX.AlienFXEngine import AlienFX_Constructor
+from AlienFX import AlienFXColors
+
+# frames kept for the jitter and the lateness of Stats, an animation may run for days
+LATENESS_SAMPLES = 10000
+
+
+def Animation_Areas(computer):
+    """Areas of the regions that can light, power button excepted, in regionId order"""
+    regions = sorted(computer.regions.values(), key=lambda r: r.regionId)
+    return [r.regionId for r in regions if r.canLight and not r.power_button]
+
+
+def RGB(color):
+    """'FF8000' => (1.0, 0.5, 0.0)"""
+    return tuple([int(color[i:i + 2], 16) / 255.0 for i in [0, 2, 4]])
+
+
+def Mix(color1, color2, x):
+    return tuple([c1 + (c2 - c1) * x for c1, c2 in zip(color1, color2)])
+
+
+class Effect:
+    """Base of the effects : Colors(t) returns {area: (r, g, b)} at t seconds, the components between 0 and 1.
+    The effects override Colors, the base one is static : every area shows color, off by default."""
+
+    color = (0.0, 0.0, 0.0)
+
+    def __init__(self, areas, period=0.0):
+        self.areas = list(areas)
+        self.period = period
+
+    def Phase(self, t):
+        return (t / self.period) % 1.0
+
+    def Colors(self, t):
+        return dict([(area, self.color) for area in self.areas])
+
+
+class Breathing(Effect):
+    """All the areas fade in and out of color"""
+
+    def __init__(self, areas, color="0000FF", period=4.0):
+        Effect.__init__(self, areas, period)
+        self.color = RGB(color)
+
+    def Colors(self, t):
+        level = (1 - math.cos(2 * math.pi * self.Phase(t))) / 2
+        color = tuple([c * level for c in self.color])
+        return dict([(area, color) for area in self.areas])
+
+
+class Rainbow(Effect):
+    """The areas cycle through the hues, spread shifts the hue from one area to the next"""
+
+    def __init__(self, areas, period=6.0, spread=0.0):
+        Effect.__init__(self, areas, period)
+        self.spread = spread
+
+    def Colors(self, t):
+        phase = self.Phase(t)
+        return dict([(area, colorsys.hsv_to_rgb((phase + i * self.spread) % 1.0, 1.0, 1.0)) for i, area in enumerate(self.areas)])
+
+
+class Wave(Effect):
+    """A band of color running over the areas in their order, width is counted in areas"""
+
+    def __init__(self, areas, color="FF0000", background="000000", period=2.0, width=1.5):
+        Effect.__init__(self, areas, period)
+        self.color = RGB(color)
+        self.background = RGB(background)
+        self.width = width
+
+    def Colors(self, t):
+        n = len(self.areas)
+        position = self.Phase(t) * n
+        colors = {}
+        for i, area in enumerate(self.areas):
+            distance = abs(i - position)
+            distance = min(distance, n - distance)
+            colors[area] = Mix(self.background, self.color, max(0.0, 1 - distance / self.width))
+        return colors
+
+
+class Gradient(Effect):
+    """A gradient from color1 to color2 over the areas, turning around them when period is not 0"""
+
+    def __init__(self, areas, color1="FF0000", color2="0000FF", period=0.0):
+        Effect.__init__(self, areas, period)
+        self.color1 = RGB(color1)
+        self.color2 = RGB(color2)
+
+    def Colors(self, t):
+        n = len(self.areas)
+        phase = self.period and self.Phase(t) or 0.0
+        colors = {}
+        for i, area in enumerate(self.areas):
+            # 0 => color1 => color2 => color1 over the areas, so a turning gradient has no seam
+            x = ((float(i) / n + phase) % 1.0) * 2
+            if x > 1:
+                x = 2 - x
+            colors[area] = Mix(self.color1, self.color2, x)
+        return colors
+
+
+class AlienFX_Animator:
+    """Renders an effect on the controller at fps frames per second.
+    Frame k is due at start + k / fps : a frame is rendered for its due time, frames whose time has already passed
+    are dropped instead of being sent late, and with busy_skip a frame is skipped while the controller is busy.
+    Only the areas whose color changed since the last frame are sent (colors are compared as the controller gets them),
+    the changed areas sharing a color are sent as a single area mask."""
+
+    def __init__(self, controller, effect, fps=30.0, busy_skip=True):
+        self.controller = controller
+        self.driver = controller.driver
+        self.effect = effect
+        self.fps = fps
+        self.busy_skip = busy_skip
+        self.thread = None
+        self.running = False
+        self.Reset_Stats()
+
+    def Reset_Stats(self):
+        self.shown = {}
+        self.frames = 0
+        self.sent_frames = 0
+        self.sent_areas = 0
+        self.dropped = 0
+        self.busy_skips = 0
+        self.lateness = collections.deque(maxlen=LATENESS_SAMPLES)
+        self.elapsed = 0.0
+
+    def Device_Busy(self):
+        return self.driver.Read_Status() == self.driver.computer.STATE_BUSY
+
+    def Frame(self, t):
+        """Render the effect at t seconds and send the areas that changed, return the number of areas sent"""
+        request = AlienFX_Constructor(self.driver)
+        changed = []
+        masks = {}
+        colors = sorted(self.effect.Colors(t).items())
+        triples = [[max(0, min(255, int(round(c * 255)))) for c in color] for area, color in colors]
+        for (area, color), packed in zip(colors, AlienFXColors.Encode_Color(triples)):
+            if self.shown.get(area) != packed:
+                changed.append((area, packed))
+                masks[tuple(packed)] = masks.get(tuple(packed), 0) | area
+        self.frames += 1
+        if not changed:
+            return 0
+        for packed, mask in sorted(masks.items()):
+            request.Set_Color(request.Area(mask), list(packed))
+            request.End_Loop()
+        request.End_Transfert()
+        if self.controller.verified:
+            self.controller.Send(request)
+        else:
+            self.driver.WriteDevice(request)
+        # the loops sent are not known to the shadow of the diff apply
+        self.driver.shadow.Invalidate()
+        for area, packed in changed:
+            self.shown[area] = packed
+        self.sent_frames += 1
+        self.sent_areas += len(changed)
+        return len(changed)
+
+    def Run(self, duration=None):
+        """Render frames until Stop or for duration seconds"""
+        period = 1.0 / self.fps
+        self.running = True
+        start = time.time()
+        k = 0
+        while self.running:
+            deadline = start + k * period
+            if duration is not None and deadline - start >= duration:
+                break
+            now = time.time()
+            if now < deadline:
+                time.sleep(deadline - now)
+                now = time.time()
+            late = now - deadline
+            if late >= period:
+                missed = int(late / period)
+                self.dropped += missed
+                k += missed
+                continue
+            k += 1
+            self.lateness.append(late)
+            if self.busy_skip and self.Device_Busy():
+                self.busy_skips += 1
+                continue
+            self.Frame(deadline - start)
+        self.elapsed += time.time() - start
+        self.running = False
+
+    def Start(self, duration=None):
+        """Run in a thread"""
+        self.thread = threading.Thread(target=self.Run, args=(duration,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def Stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def Stats(self):
+        """Achieved frame rate, jitter (standard deviation of the frame start after its due time), p99 lateness (seconds)
+        of the last LATENESS_SAMPLES frames, dropped frames, frames skipped on a busy controller and areas sent per frame"""
+        lateness = sorted(self.lateness)
+        stats = {"fps": self.elapsed and self.frames / self.elapsed or 0.0,
+                 "frames": self.frames,
+                 "sent_frames": self.sent_frames,
+                 "dropped": self.dropped,
+                 "busy_skips": self.busy_skips,
+                 "areas_per_frame": self.sent_frames and float(self.sent_areas) / self.sent_frames or 0.0,
+                 "jitter": 0.0,
+                 "p99_lateness": 0.0}
+        if lateness:
+            mean = sum(lateness) / len(lateness)
+            stats["jitter"] = math.sqrt(sum([(l - mean) ** 2 for l in lateness]) / len(lateness))
+            stats["p99_lateness"] = lateness[min(len(lateness) - 1, int(len(lateness) * 0.99))]
+        return stats
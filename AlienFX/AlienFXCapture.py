@@ -0,0 +1,194 @@
+# -*- coding: UTF-8 -*-
+
+# This file is part of pyAlienFX.
+#
+#    pyAlienFX is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    pyAlienFX is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with pyAlienFX.  If not, see <http://www.gnu.org/licenses/>.
+#
+#    This work is licensed under the Creative Commons Attribution-NonCommercial-ShareAlike 3.0 Unported License.
+#    To view a copy of this license, visit http://creativecommons.org/licenses/by-nc-sa/3.0/ or send a letter
+#    to Creative Commons, 444 Castro Street, Suite 900, Mountain View, California, 94041, USA.
+#
+
+
+# Packet capture
+# Every USB control transfer of the driver is recorded as a fixed size binary record in a bounded ring buffer,
+# kept in memory or in a memory mapped file, the oldest records being overwritten :
+#   driver.Set_Capture(AlienFX_Capture(records=4096, path="/tmp/pyAlienFX.capture"))
+# The capture file starts with a header (magic, version, record size, capacity, records written) followed by the records.
+# A mapped capture can be read at any time, even while the driver writes it : python -m AlienFX.AlienFXCapture file
+
+import sys
+import mmap
+import time
+import struct
+import ctypes
+from collections import namedtuple
+
+MAGIC = "AFXC"
+VERSION = 1
+HEADER = struct.Struct("<4sBBHIQ")
+COUNT = struct.Struct("<Q")
+COUNT_OFFSET = HEADER.size - COUNT.size
+# time, direction, bmRequestType, bRequest, length, wValue, wIndex, result, latency, payload
+RECORD = struct.Struct("<dBBBBHHif16s")
+PAYLOAD_LENGTH = 16
+
+OUT = 0
+IN = 1
+DIRECTIONS = ["OUT", "IN"]
+
+# result of a transfer which raised an exception
+RESULT_ERROR = -1
+
+Capture_Record = namedtuple("Capture_Record", "time direction request_type request length value index result latency payload")
+
+
+class CaptureError(Exception):
+    pass
+
+
+def _Monotonic_Clock():
+    """Return a function reading CLOCK_MONOTONIC, time.time when it is not available"""
+    try:
+        try:
+            librt = ctypes.CDLL("librt.so.1", use_errno=True)
+        except OSError:
+            # find_library runs ldconfig, only ask it when the usual name is missing
+            from ctypes.util import find_library
+            librt = ctypes.CDLL(find_library("rt"), use_errno=True)
+        clock_gettime = librt.clock_gettime
+    except (OSError, AttributeError):
+        return time.time
+    # no argtypes : the checks would double the cost of the call
+    timespec = (ctypes.c_long * 2)()
+    if clock_gettime(1, timespec) != 0:
+        return time.time
+
+    def monotonic():
+        clock_gettime(1, timespec)  # CLOCK_MONOTONIC
+        return timespec[0] + timespec[1] * 1e-9
+    return monotonic
+
+Clock = _Monotonic_Clock()
+
+
+class AlienFX_Capture:
+    """Ring buffer of transfer records, in memory or mapped on the file path.
+    data is the content of a capture file to read back (see Open)"""
+
+    def __init__(self, records=4096, path=None, data=None):
+        self.driver = None
+        if data is not None:
+            self.Load(data)
+            return
+        if records < 1:
+            raise CaptureError("A capture needs at least one record")
+        self.capacity = records
+        self.path = path
+        self.count = 0
+        size = HEADER.size + records * RECORD.size
+        if path is None:
+            self.buffer = bytearray(size)
+        else:
+            f = open(path, "w+b")
+            f.truncate(size)
+            self.buffer = mmap.mmap(f.fileno(), size)
+            f.close()
+        HEADER.pack_into(self.buffer, 0, MAGIC, VERSION, 0, RECORD.size, records, 0)
+
+    def Load(self, data):
+        if len(data) < HEADER.size:
+            raise CaptureError("Not a capture file")
+        magic, version, pad, record_size, capacity, count = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise CaptureError("Not a capture file")
+        if version != VERSION or record_size != RECORD.size:
+            raise CaptureError("Unsupported capture version %d" % version)
+        if len(data) < HEADER.size + capacity * RECORD.size:
+            raise CaptureError("Truncated capture file")
+        self.capacity = capacity
+        self.path = None
+        self.count = count
+        self.buffer = data
+
+    def Record(self, start, request_type, request, value, index, data, result, latency):
+        """Record a transfer, data are the bytes sent (OUT) or read (IN), result the number of bytes transferred or RESULT_ERROR"""
+        payload = data is not None and str(bytearray(data[:PAYLOAD_LENGTH])) or ""
+        count = self.count
+        RECORD.pack_into(self.buffer, HEADER.size + (count % self.capacity) * RECORD.size,
+                         start, request_type >> 7, request_type, request, len(payload), value, index, result, latency, payload)
+        self.count = count + 1
+        COUNT.pack_into(self.buffer, COUNT_OFFSET, count + 1)
+
+    def Records(self):
+        """Yield the records kept in the buffer, oldest first"""
+        first = max(0, self.count - self.capacity)
+        for n in xrange(first, self.count):
+            record = Capture_Record(*RECORD.unpack_from(self.buffer, HEADER.size + (n % self.capacity) * RECORD.size))
+            yield record._replace(payload=record.payload[:record.length])
+
+    def Dropped(self):
+        """Number of records overwritten since the capture started"""
+        return max(0, self.count - self.capacity)
+
+    def Clear(self):
+        self.count = 0
+        COUNT.pack_into(self.buffer, COUNT_OFFSET, 0)
+
+    def Dump(self, path):
+        """Write the records kept, oldest first, in a capture file of the same format"""
+        records = list(self.Records())
+        f = open(path, "wb")
+        f.write(HEADER.pack(MAGIC, VERSION, 0, RECORD.size, max(1, len(records)), len(records)))
+        for r in records:
+            f.write(RECORD.pack(*r))
+        f.write("\0" * RECORD.size * (not records))
+        f.close()
+
+    def Close(self):
+        """Stop the capture of the driver it is set on, and unmap the file"""
+        if self.driver is not None and self.driver.capture is self:
+            self.driver.Set_Capture(None)
+        self.driver = None
+        if self.path is not None:
+            self.buffer.flush()
+            self.buffer.close()
+
+
+def Open(path):
+    """Read a capture file, written by a mapped capture or by Dump"""
+    f = open(path, "rb")
+    data = f.read()
+    f.close()
+    return AlienFX_Capture(data=data)
+
+
+def Format(record, start=0.0):
+    return "%12.6f %-3s %02x %02x %04x %04x %3d %9.1f us  %s" % (
+        record.time - start, DIRECTIONS[record.direction], record.request_type, record.request, record.value, record.index,
+        record.result, record.latency * 1e6, " ".join(["%02x" % ord(b) for b in record.payload]))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print "Usage : %s capture_file" % sys.argv[0]
+        sys.exit(1)
+    capture = Open(sys.argv[1])
+    start = None
+    for record in capture.Records():
+        if start is None:
+            start = record.time
+        print Format(record, start)
+    if capture.Dropped():
+        print "%d older records overwritten" % capture.Dropped()
@@ -0,0 +1,496 @@
+# -*- coding: UTF-8 -*-
+
+# This file is part of pyAlienFX.
+#
+#    pyAlienFX is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    pyAlienFX is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with pyAlienFX.  If not, see <http://www.gnu.org/licenses/>.
+#
+#    This work is licensed under the Creative Commons Attribution-NonCommercial-ShareAlike 3.0 Unported License.
+#    To view a copy of this license, visit http://creativecommons.org/licenses/by-nc-sa/3.0/ or send a letter
+#    to Creative Commons, 444 Castro Street, Suite 900, Mountain View, California, 94041, USA.
+#
+
+# Client of the pyAlienFX daemon
+# Daemon_Controller has the same methods as AlienFX_Controller and forwards them to the daemon,
+# it does not need GTK so headless tools can use it as well as the GUI.
+# The connection is kept open between commands and reopened with an exponential backoff when the daemon goes away,
+# the commands that can safely run twice are then sent again on the new connection.
+# A reply which is only late is not a lost connection : the daemon may be executing the request, so it is never sent again.
+
+import time
+import errno
+import threading
+import collections
+from socket import *
+
+from AlienFX import AlienFXProtocol
+
+# Commands that must not be sent again after a lost connection : they write raw packets
+NOT_IDEMPOTENT = ["Set_Loop", "Send_Request", "Try_Power", "RESTART"]
+# Commands recording a configuration on the daemon, which is lost with the connection until Write_Conf is answered
+CONF_CALLS = ["Set_Loop_Conf", "Add_Loop_Conf", "Add_Speed_Conf", "End_Loop_Conf", "End_Transfert_Conf"]
+# Errors after which the daemon is gone, with the requests it had not answered
+CONNECTION_LOST = [errno.ECONNRESET, errno.EPIPE, errno.ECONNREFUSED, errno.ECONNABORTED, errno.ENOENT]
+
+
+def Connection_Lost(e):
+    """True when the socket error e is a lost connection, False for a timeout or any other error"""
+    return not isinstance(e, timeout) and getattr(e, "errno", None) in CONNECTION_LOST
+
+
+class Daemon_Connection:
+    """Persistent connection to the daemon, opened on demand.
+    After a failure the next attempt waits backoff_min seconds, doubled at each failure up to backoff_max."""
+
+    def __init__(self, addr, timeout=None, retries=3, backoff_min=0.05, backoff_max=2.0):
+        self.addr = addr
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+        self.sock = None
+        self.lock = threading.RLock()
+        self.attempt = 0
+        self.next_attempt = 0
+        self.connects = 0
+        self.reconnects = 0
+        self.failures = 0
+        self.retried = 0
+        self.last_error = None
+        self.connected_since = None
+        self.down_since = None
+
+    def Connected(self):
+        return self.sock is not None
+
+    def Connect(self, wait=True):
+        """Open the connection if needed, after the backoff delay of the previous failures (or fail at once if not wait)"""
+        if self.sock is not None:
+            return
+        delay = self.next_attempt - time.time()
+        if delay > 0:
+            if not wait:
+                raise error("the Deamon is unreachable, next attempt in %.2fs" % delay)
+            time.sleep(delay)
+        if type(self.addr) == str:
+            sock = socket(AF_UNIX, SOCK_STREAM)
+        else:
+            sock = socket(AF_INET, SOCK_STREAM)
+        try:
+            sock.settimeout(self.timeout)
+            sock.connect(self.addr)
+        except error, e:
+            sock.close()
+            self.Failed(e)
+            raise
+        if type(self.addr) != str:
+            sock.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+        sock.setsockopt(SOL_SOCKET, SO_KEEPALIVE, 1)
+        self.sock = sock
+        if self.connects:
+            self.reconnects += 1
+        self.connects += 1
+        self.attempt = 0
+        self.next_attempt = 0
+        self.connected_since = time.time()
+        self.down_since = None
+
+    def Failed(self, e):
+        self.failures += 1
+        self.last_error = str(e)
+        if self.down_since is None:
+            self.down_since = time.time()
+        self.next_attempt = time.time() + min(self.backoff_max, self.backoff_min * 2 ** self.attempt)
+        self.attempt += 1
+
+    def Drop(self, e):
+        """Close a broken connection, the next Connect reopens it.
+        Without a connection e comes from Connect, which already counted the failure."""
+        if self.sock is None:
+            return
+        self.Close()
+        self.Failed(e)
+
+    def Close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+            self.connected_since = None
+
+    def Send(self, data):
+        self.Connect()
+        self.sock.sendall(data)
+
+    def Recv(self, size):
+        if self.sock is None:
+            raise error("not connected to the Deamon")
+        data = self.sock.recv(size)
+        if not data:
+            raise error(errno.ECONNRESET, "the Deamon closed the connection")
+        return data
+
+    def Health(self):
+        """State of the connection and its counters"""
+        now = time.time()
+        return {"connected": self.Connected(),
+                "connects": self.connects,
+                "reconnects": self.reconnects,
+                "failures": self.failures,
+                "retried": self.retried,
+                "last_error": self.last_error,
+                "up_for": self.connected_since and now - self.connected_since or 0.0,
+                "down_for": self.down_since and now - self.down_since or 0.0,
+                "next_attempt_in": max(0.0, self.next_attempt - now)}
+
+
+class Daemon_Controller:
+    """Client of the daemon, speaking the text protocol (default) or the binary one.
+    In binary mode up to window requests are sent before waiting for their replies.
+    With a path, the daemon is reached through that unix socket rather than TCP.
+    A reply taking more than timeout seconds (None : wait forever) raises socket.timeout, the request is not sent again.
+    The requests are only sent again after a lost connection (see Connection_Lost), at most retries times per call.
+    Without coalesce, the daemon never replaces these commands by newer ones for the same region or block."""
+
+    def __init__(self, protocol=AlienFXProtocol.TEXT, window=1, path=None, timeout=None, retries=3, coalesce=True):
+        self.HOST = 'localhost'
+        self.PORT = 25436
+        self.ADDR = (self.HOST, self.PORT)
+        self.PATH = path
+        self.timeout = timeout
+        self.retries = retries
+        self.coalesce = coalesce
+        self.coalesced = 0
+        self.connection = None
+        self.BUFSIZE = 4096
+        self.request = []
+        self.protocol = protocol
+        self.window = window
+        self.out = ""
+        self.request_id = 0
+        self.pending = {}
+        self.journal = []
+        self.decoder = AlienFXProtocol.Decoder()
+        self.replies = collections.deque()
+
+    def makeConnection(self):
+        if self.connection is None:
+            self.connection = Daemon_Connection(self.PATH or self.ADDR, self.timeout, self.retries)
+        try:
+            self.connection.Connect()
+            return True
+        except error, e:
+            if "[Errno 111]" in str(e) or "[Errno 2]" in str(e):
+                print "the Deamon is disconnected ... "
+            else:
+                print e
+            print "Trying to load the driver manually"
+            return False
+
+    def Health(self):
+        """Connection health, see Daemon_Connection.Health"""
+        health = self.connection.Health()
+        health["pending"] = len(self.pending)
+        health["coalesced"] = self.coalesced
+        return health
+
+    def sendCmd(self, cmd):
+        self.connection.Send(cmd)
+
+    def getResults(self):
+        return self.connection.Recv(self.BUFSIZE)
+
+    def Round_Trip(self, cmd, idempotent=True):
+        """Send a text message and return the reply, on a new connection if the current one is lost"""
+        with self.connection.lock:
+            for attempt in range(self.retries + 1):
+                try:
+                    self.sendCmd(cmd)
+                    return self.getResults()
+                except error, e:
+                    self.connection.Drop(e)
+                    if not idempotent or attempt == self.retries or not Connection_Lost(e):
+                        raise
+                    self.connection.retried += 1
+
+    def Binary(self):
+        return self.protocol == AlienFXProtocol.BINARY
+
+    def Call(self, name, *args):
+        """Queue the binary frame of a controller method, sent by the next Send_Packet"""
+        self.request_id = (self.request_id + 1) & 0xffffffff
+        frame = AlienFXProtocol.Encode_Call(name, self.request_id, *args)
+        if not self.coalesce:
+            frame = AlienFXProtocol.Set_Flags(frame, AlienFXProtocol.FLAG_NO_COALESCE)
+        self.out += frame
+        self.pending[self.request_id] = name
+        self.journal.append((self.request_id, name, frame))
+        return self.request_id
+
+    def Trim_Journal(self):
+        """Forget the answered requests, but keep the configuration calls until their Write_Conf is answered"""
+        journal = []
+        for entry in self.journal:
+            request_id, name, frame = entry
+            if name == "Set_Loop_Conf" or (name == "Write_Conf" and request_id not in self.pending):
+                journal = [e for e in journal if e[0] in self.pending]
+            if request_id in self.pending or name in CONF_CALLS:
+                journal.append(entry)
+        self.journal = journal
+
+    def Recover(self, e):
+        """The connection is lost : reconnect and send the journal again, if every request in it can run twice.
+        After any other error (a late reply for instance) the requests are forgotten and e is raised."""
+        self.connection.Drop(e)
+        self.decoder = AlienFXProtocol.Decoder()
+        self.replies.clear()
+        if not Connection_Lost(e) or [name for request_id, name, frame in self.journal if name in NOT_IDEMPOTENT]:
+            self.pending.clear()
+            self.journal = []
+            raise e
+        for attempt in range(self.retries):
+            self.pending = dict([(request_id, name) for request_id, name, frame in self.journal])
+            try:
+                self.sendCmd("".join([frame for request_id, name, frame in self.journal]))
+                self.connection.retried += 1
+                return
+            except error, e:
+                self.connection.Drop(e)
+                if not Connection_Lost(e):
+                    break
+        self.pending.clear()
+        self.journal = []
+        raise e
+
+    def Read_Reply(self):
+        """Read the next binary reply and return (request id, payload)"""
+        while not self.replies:
+            self.replies.extend(self.decoder.Feed(self.getResults()))
+        opcode, flags, request_id, payload = self.replies.popleft()
+        if opcode != AlienFXProtocol.OP_REPLY or request_id not in self.pending:
+            raise AlienFXProtocol.ProtocolError("Unexpected frame 0x%02x for request %d" % (opcode, request_id))
+        name = self.pending.pop(request_id)
+        if flags & AlienFXProtocol.FLAG_ERROR:
+            raise ValueError("Error while executing %s on the daemon !" % name)
+        if flags & AlienFXProtocol.FLAG_COALESCED:
+            self.coalesced += 1
+        return request_id, payload
+
+    def Collect(self, outstanding=0):
+        """Read binary replies until no more than outstanding requests are waiting, return {request id: payload}.
+        The connection is recovered at most retries times, then the error is raised."""
+        results = {}
+        recoveries = 0
+        with self.connection.lock:
+            while len(self.pending) > outstanding:
+                try:
+                    request_id, payload = self.Read_Reply()
+                except error, e:
+                    if recoveries == self.retries:
+                        self.connection.Drop(e)
+                        self.pending.clear()
+                        self.journal = []
+                        raise
+                    recoveries += 1
+                    self.Recover(e)
+                    continue
+                results[request_id] = payload
+            self.Trim_Journal()
+        return results
+
+    def Set_Loop(self, action):
+        if self.Binary():
+            self.Call("Set_Loop", action)
+            return
+        packet = ["Set_Loop", str(action)]
+        self.request.append(packet)
+
+    def Set_Loop_Conf(self, Save=False, block=0x01):
+        if self.Binary():
+            self.Call("Set_Loop_Conf", Save, block)
+            return
+        packet = ["Set_Loop_Conf", str(Save), str(block)]
+        self.request.append(packet)
+
+    def Add_Loop_Conf(self, area, mode, color1, color2=None):
+        if self.Binary():
+            self.Call("Add_Loop_Conf", area, mode, color1, color2)
+            return
+        packet = ["Add_Loop_Conf", str(hex(area)).replace('0x', ''), str(mode), str(color1), str(color2)]
+        self.request.append(packet)
+
+    def Add_Speed_Conf(self, speed=0xc800):
+        if self.Binary():
+            self.Call("Add_Speed_Conf", speed)
+            return
+        packet = ["Add_Speed_Conf", str(speed)]
+        self.request.append(packet)
+
+    def End_Loop_Conf(self):
+        if self.Binary():
+            self.Call("End_Loop_Conf")
+            return
+        packet = ["End_Loop_Conf", ""]
+        self.request.append(packet)
+
+    def End_Transfert_Conf(self):
+        if self.Binary():
+            self.Call("End_Transfert_Conf")
+            return
+        packet = ["End_Transfert_Conf", ""]
+        self.request.append(packet)
+
+    def Write_Conf(self):
+        if self.Binary():
+            self.Call("Write_Conf")
+        else:
+            packet = ["Write_Conf", ""]
+            self.request.append(packet)
+        self.Send_Packet()
+
+    def Set_Color(self, Area, Color, Save=False, Apply=False, block=0x01):
+        if self.Binary():
+            self.Call("Set_Color", Area, Color, Save, Apply, block)
+        else:
+            packet = ["Set_Color", str(hex(Area)).replace('0x', ''), str(Color), str(Save), str(Apply), str(block)]
+            self.request.append(packet)
+        self.Send_Packet()
+
+    def Set_Color_Blink(self, Area, Color, Save=False, Apply=False, block=0x01):
+        if self.Binary():
+            self.Call("Set_Color_Blink", Area, Color, Save, Apply, block)
+        else:
+            packet = ["Set_Color_Blink", str(hex(Area)).replace('0x', ''), str(Color), str(Save), str(Apply), str(block)]
+            self.request.append(packet)
+        self.Send_Packet()
+
+    def Set_Color_Morph(self, Area, Color1, Color2, Save=False, Apply=False, block=0x01):
+        if self.Binary():
+            self.Call("Set_Color_Morph", Area, Color1, Color2, Save, Apply, block)
+        else:
+            packet = ["Set_Color_Morph", str(hex(Area)).replace('0x', ''), str(Color1), str(Color2), str(Save), str(Apply), str(block)]
+            self.request.append(packet)
+        self.Send_Packet()
+
+    def WaitForOk(self):
+        if self.Binary():
+            self.Call("WaitForOk")
+            return
+        packet = ["WaitForOk", ""]
+        self.request.append(packet)
+
+    def Get_State(self):
+        if self.Binary():
+            self.Call("Get_State")
+            return
+        packet = ["Get_State", ""]
+        self.request.append(packet)
+
+    def Reset(self, res_cmd):
+        if self.Binary():
+            self.Call("Reset", res_cmd)
+            return
+        packet = ["Reset", str(res_cmd)]
+        self.request.append(packet)
+
+    def Send_Request(self, request):
+        """Only for testing purposes ! Binary protocol only"""
+        self.Need_Binary("Send_Request")
+        self.Call("Send_Request", request)
+        self.Send_Packet()
+
+    def Try_Power(self, block, color):
+        """Only for testing purposes ! Binary protocol only"""
+        self.Need_Binary("Try_Power")
+        self.Call("Try_Power", block, color)
+        self.Send_Packet()
+
+    def Need_Binary(self, name):
+        if not self.Binary():
+            raise ValueError("%s is only available with the binary protocol" % name)
+
+    def Send_Packet(self):
+        if self.Binary():
+            with self.connection.lock:
+                out, self.out = self.out, ""
+                try:
+                    self.sendCmd(out)
+                except error, e:
+                    self.Recover(e)
+                return self.Collect(max(self.window - 1, 0))
+        tmp = []
+        for el in self.request:
+            tmp.append(",".join(el))
+        cmd = "|".join(tmp)
+        if not self.coalesce:
+            cmd = AlienFXProtocol.TEXT_NO_MERGE + cmd
+        idempotent = not [el for el in self.request if el[0] in NOT_IDEMPOTENT]
+        self.RAZ()
+        resp = self.Round_Trip(cmd, idempotent)
+        print resp
+        if resp != "executed":
+            raise ValueError("Error while communicating with the daemon !")
+
+    def Ping(self):
+        print "Sending Ping"
+        try:
+            if self.Binary():
+                pong = self.Query(AlienFXProtocol.OP_PING)
+            else:
+                pong = self.Round_Trip("PING")
+        except error, e:
+            print "No answer : ", e
+            return False
+        print "Server Answer : ", pong
+        if pong != "PONG":
+            return False
+        return True
+
+    def Computer(self):
+        """(vendorId, productId) of the controller driven by the daemon"""
+        if self.Binary():
+            return AlienFXProtocol.COMPUTER.unpack(self.Query(AlienFXProtocol.OP_COMPUTER))
+        vendorId, productId = self.Round_Trip("COMPUTER").split(":")
+        return int(vendorId, 16), int(productId, 16)
+
+    def Query(self, opcode):
+        """Send a binary request answered by the daemon event loop and return its payload"""
+        with self.connection.lock:
+            self.request_id = (self.request_id + 1) & 0xffffffff
+            query = self.request_id
+            for attempt in range(self.retries + 1):
+                self.pending[query] = "QUERY"
+                try:
+                    self.sendCmd(AlienFXProtocol.Frame(opcode, query))
+                    while query in self.pending:
+                        request_id, payload = self.Read_Reply()
+                        if request_id == query:
+                            return payload
+                except error, e:
+                    self.pending.pop(query, None)
+                    if attempt == self.retries:
+                        self.connection.Drop(e)
+                        raise
+                    self.Recover(e)
+
+    def RAZ(self):
+        self.request = []
+
+    def Bye(self):
+        if self.connection is None or not self.connection.Connected():
+            return
+        if self.Binary():
+            self.Collect()
+            self.sendCmd(AlienFXProtocol.Frame(AlienFXProtocol.OP_BYE, 0))
+        else:
+            self.sendCmd("BYE")
+        self.connection.Close()
@@ -0,0 +1,139 @@
+# -*- coding: UTF-8 -*-
+
+# This file is part of pyAlienFX.
+#
+#    pyAlienFX is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    pyAlienFX is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with pyAlienFX.  If not, see <http://www.gnu.org/licenses/>.
+#
+#    This work is licensed under the Creative Commons Attribution-NonCommercial-ShareAlike 3.0 Unported License.
+#    To view a copy of this license, visit http://creativecommons.org/licenses/by-nc-sa/3.0/ or send a letter
+#    to Creative Commons, 444 Castro Street, Suite 900, Mountain View, California, 94041, USA.
+#
+
+
+# Color codec
+# The controller takes 4 bits per channel, packed in two layouts :
+#   Color  : [r << 4 | g, b << 4]
+#   Color2 : [r, g << 4 | b]
+# and a morph packs both colors in three bytes : [r1 << 4 | g1, b1 << 4 | r2, g2 << 4 | b2]
+# Colors are "RRGGBB" hex strings or (r, g, b) triples of 0-255 values.
+# The Encode_* functions convert whole lists in one call, vectorized with NumPy when it is installed and the list is
+# long enough to pay for it, they return lists of byte lists either way.
+# The vectorized path does not check the hex digits, an invalid one gives a wrong color rather than a ValueError.
+# NumPy takes longer to import than most programs spend packing colors, it is only imported for a list of
+# NUMPY_IMPORT_MIN colors or more, the shorter lists are vectorized once something else imported it.
+
+import sys
+
+numpy = None
+numpy_missing = False
+
+# Below this many colors the scalar code is faster than building the arrays
+VECTOR_MIN = 32
+NUMPY_IMPORT_MIN = 4096
+
+
+def Numpy():
+    """The numpy module, imported on the first call, None when it is not installed"""
+    global numpy, numpy_missing
+    if numpy is None and not numpy_missing:
+        try:
+            import numpy
+        except ImportError:
+            numpy_missing = True
+    return numpy
+
+
+def Nibbles(color):
+    """High nibble of each channel : 'FF8000' or (255, 128, 0) => (15, 8, 0)"""
+    if type(color) in [str, unicode]:
+        v = int(color[:6], 16)
+        return v >> 20, (v >> 12) & 0x0f, (v >> 4) & 0x0f
+    return color[0] >> 4, color[1] >> 4, color[2] >> 4
+
+
+def Color(color):
+    if type(color) == str:
+        v = int(color[:6], 16)
+        return [(v >> 16) & 0xf0 | (v >> 12) & 0x0f, v & 0xf0]
+    r, g, b = Nibbles(color)
+    return [r << 4 | g, b << 4]
+
+
+def Color2(color):
+    if type(color) == str:
+        v = int(color[:6], 16)
+        return [v >> 20, (v >> 8) & 0xf0 | (v >> 4) & 0x0f]
+    r, g, b = Nibbles(color)
+    return [r, g << 4 | b]
+
+
+def Morph(color1, color2):
+    r1, g1, b1 = Nibbles(color1)
+    r2, g2, b2 = Nibbles(color2)
+    return [r1 << 4 | g1, b1 << 4 | r2, g2 << 4 | b2]
+
+
+def Nibble_Array(colors):
+    """(n, 3) array of the channel high nibbles of a list of hex strings, of triples, or of an (n, 3) array"""
+    if isinstance(colors, numpy.ndarray):
+        return colors.astype(numpy.uint8) >> 4
+    if type(colors[0]) in [str, unicode]:
+        text = "".join([c[:6] for c in colors])
+        if len(text) != 6 * len(colors):
+            raise ValueError("Colors must be RRGGBB hex strings")
+        digits = numpy.frombuffer(str(text), dtype=numpy.uint8).reshape(len(colors), 6)[:, ::2]
+        # '0'-'9' => 0-9, 'A'-'F' and 'a'-'f' => 10-15
+        return (digits & 0x0f) + 9 * (digits >> 6)
+    return numpy.array(colors, dtype=numpy.uint8) >> 4
+
+
+def Vectorize(colors):
+    if "numpy" not in sys.modules and len(colors) < NUMPY_IMPORT_MIN:
+        return False
+    return Numpy() is not None and (isinstance(colors, numpy.ndarray) or len(colors) >= VECTOR_MIN)
+
+
+def Encode_Color(colors):
+    """[Color(c) for c in colors]"""
+    if not Vectorize(colors):
+        return [Color(c) for c in colors]
+    n = Nibble_Array(colors)
+    packed = numpy.empty((len(n), 2), dtype=numpy.uint8)
+    packed[:, 0] = n[:, 0] << 4 | n[:, 1]
+    packed[:, 1] = n[:, 2] << 4
+    return packed.tolist()
+
+
+def Encode_Color2(colors):
+    """[Color2(c) for c in colors]"""
+    if not Vectorize(colors):
+        return [Color2(c) for c in colors]
+    n = Nibble_Array(colors)
+    packed = numpy.empty((len(n), 2), dtype=numpy.uint8)
+    packed[:, 0] = n[:, 0]
+    packed[:, 1] = n[:, 1] << 4 | n[:, 2]
+    return packed.tolist()
+
+
+def Encode_Morph(colors1, colors2):
+    """[Morph(c1, c2) for c1, c2 in zip(colors1, colors2)]"""
+    if not Vectorize(colors1):
+        return [Morph(c1, c2) for c1, c2 in zip(colors1, colors2)]
+    n1 = Nibble_Array(colors1)
+    n2 = Nibble_Array(colors2)
+    packed = numpy.empty((len(n1), 3), dtype=numpy.uint8)
+    packed[:, 0] = n1[:, 0] << 4 | n1[:, 1]
+    packed[:, 1] = n1[:, 2] << 4 | n2[:, 0]
+    packed[:, 2] = n2[:, 1] << 4 | n2[:, 2]
+    return packed.tolist()
@@ -24,8 +24,14 @@
 from AlienFX.AlienFXProperties import *
 from AlienFX.AlienFXTexts import *
 
+# Constants shared by all the models, and everything else which needs them
+PROPERTIES = AlienFXProperties()
+TEXTS = AlienFXTexts()
 
-class AlienFXPowerMode:
+
+class AlienFXPowerMode(object):
+
+    __slots__ = ("name", "description")
 
     def __init__(self, name, description, block):
         self.description = description
@@ -33,7 +39,9 @@ class AlienFXPowerMode:
         self.name = name
 
 
-class AlienFXRegion:
+class AlienFXRegion(object):
+
+    __slots__ = ("name", "description", "regionId", "maxCommands", "canLight", "canBlink", "canMorph", "color1", "color2", "mode", "power_button", "supportedModes", "line")
 
     def __init__(self, name, description, regionId, maxCommands, canBlink, canMorph, canLight, default_color, supportedModes, default_mode="fixed", power_button=False):
         self.description = description
@@ -70,7 +78,9 @@ class AlienFXRegion:
         return False
 
 
-class AlienFXConfiguration:
+class AlienFXConfiguration(object):
+
+    __slots__ = ("mode", "color1", "color2")
 
     def __init__(self, mode, color1, color2=None):
         self.mode = mode
@@ -84,8 +94,8 @@ class AlienFXConfiguration:
 class M11XR3:
 
     def __init__(self):
-        self.AlienFXProperties = AlienFXProperties()
-        self.AlienFXTexts = AlienFXTexts()
+        self.AlienFXProperties = PROPERTIES
+        self.AlienFXTexts = TEXTS
         self.regions = {}
         self.suportedMode = {}
         self.default_color = '0000FF'
@@ -154,8 +164,8 @@ class M14XLight:
 
     def __init__(self):
 
-        self.AlienFXProperties = AlienFXProperties()
-        self.AlienFXTexts = AlienFXTexts()
+        self.AlienFXProperties = PROPERTIES
+        self.AlienFXTexts = TEXTS
         self.regions = {}
         self.suportedMode = {}
         self.default_color = '0000FF'
@@ -237,8 +247,8 @@ class M14XLight:
 class M15XArea51:
 
     def __init__(self):
-        self.AlienFXProperties = AlienFXProperties()
-        self.AlienFXTexts = AlienFXTexts()
+        self.AlienFXProperties = PROPERTIES
+        self.AlienFXTexts = TEXTS
         self.regions = {}
         self.suportedMode = {}
         self.default_color = '0000FF'
@@ -306,8 +316,8 @@ class M15XAllPowerfull:
 
     def __init__(self):
 
-        self.AlienFXProperties = AlienFXProperties()
-        self.AlienFXTexts = AlienFXTexts()
+        self.AlienFXProperties = PROPERTIES
+        self.AlienFXTexts = TEXTS
         self.regions = {}
         self.suportedMode = {}
         self.default_color = '0000FF'
@@ -390,8 +400,8 @@ class M17XR3:
 
     def __init__(self):
 
-        self.AlienFXProperties = AlienFXProperties()
-        self.AlienFXTexts = AlienFXTexts()
+        self.AlienFXProperties = PROPERTIES
+        self.AlienFXTexts = TEXTS
         self.regions = {}
         self.suportedMode = {}
         self.default_color = '0000FF'
@@ -476,8 +486,8 @@ class M18XR2:
 
     def __init__(self):
 
-        self.AlienFXProperties = AlienFXProperties()
-        self.AlienFXTexts = AlienFXTexts()
+        self.AlienFXProperties = PROPERTIES
+        self.AlienFXTexts = TEXTS
         self.regions = {}
         self.suportedMode = {}
         self.default_color = '0000FF'
@@ -559,12 +569,41 @@ class M18XR2:
 
 
 class AlienFXComputer:
+    """A supported computer. computer, the model instance, is only built when it is first used,
+    and the computers of the same model share it."""
+
+    models = {}
 
-    def __init__(self, name, vendorId, productId, computer):
+    def __init__(self, name, vendorId, productId, model):
         self.name = name
         self.vendorId = vendorId
         self.productId = productId
-        self.computer = computer
+        self.model = model
+
+    def __getattr__(self, name):
+        if name != "computer":
+            raise AttributeError(name)
+        if self.model not in self.models:
+            self.models[self.model] = self.model()
+        self.computer = self.models[self.model]
+        return self.computer
+
+
+# (vendorId, productId) => (name, model) of every supported computer
+MODELS = {
+    (0x187c, 0x0522): ("M11XR3", M11XR3),
+    (0x187c, 0x0516): ("M11XR25", M11XR3),
+    (0x187c, 0x0515): ("M11XR2", M11XR3),
+    (0x187c, 0x0514): ("M11XR1", M11XR3),
+    (0x187c, 0x0512): ("M15XAllPowerful", M15XAllPowerfull),
+    (0x187c, 0x0511): ("M15XArea51", M15XArea51),
+    # added by niai
+    (0x187c, 0x0520): ("M17XR3", M17XR3),
+    # LightHash
+    (0x187c, 0x0521): ("M14XR1", M14XLight),
+    # (0x187c, 0x0522): ("M14XR1", M14XLight),
+    # added by SuperTool
+    (0x187c, 0x0518): ("M18XR2", M18XR2)}
 
 
 class AllComputers():
@@ -591,24 +630,7 @@ class AllComputers():
     ALIENFX_BUSY = 0x11
     ALIENFX_UNKOWN_COMMAND = 0x12
 
-    computerList = {
-        "M11XR3": AlienFXComputer("M11XR3", 0x187c, 0x0522, M11XR3()),
-        "M11XR25": AlienFXComputer("M11XR25", 0x187c, 0x0516, M11XR3()),
-        "M11XR2": AlienFXComputer("M11XR2", 0x187c, 0x0515, M11XR3()),
-        "M11XR1": AlienFXComputer("M11XR1", 0x187c, 0x0514, M11XR3()),
-        "M15XAllPowerful": AlienFXComputer("M15XAllPowerful", 0x187c, 0x0512, M15XAllPowerfull()),
-        "M15XArea51": AlienFXComputer("M15XArea51", 0x187c, 0x0511, M15XArea51()),
-        # ############################################################################
-        # added by niai (start)
-        "M17XR3": AlienFXComputer("M17XR3", 0x187c, 0x0520, M17XR3()),
-        # added by niai (end)
-        # ###########################################################################
-        # LightHash [start]
-        "M14XR1": AlienFXComputer("M14XR1", 0x187c, 0x0521, M14XLight()),
-        # "M14XR1" : AlienFXComputer("M14XR1",0x187c,0x0522,M14XLight())}
-        # ############################################################################
-        # added by SuperTool (start)
-        "M18XR2": AlienFXComputer("M18XR2", 0x187c, 0x0518, M18XR2())}
-    # added by SuperTool (end)
-    # ###########################################################################
-    # LightHash [end]
+    # (vendorId, productId) => AlienFXComputer, used to match the devices while enumerating the bus
+    computerIndex = dict([(ids, AlienFXComputer(name, ids[0], ids[1], model)) for ids, (name, model) in MODELS.items()])
+    # name => AlienFXComputer
+    computerList = dict([(c.name, c) for c in computerIndex.values()])
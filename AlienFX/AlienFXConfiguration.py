@@ -1,15 +1,81 @@
 
+import os
+import re
+import sys
+import json
+import mmap
+import struct
+import hashlib
+import tempfile
+
 from AlienFX.AlienFXTexts import *
 from AlienFXComputers import *
 
+# Compiled profiles : the text profile (key=value lines) stored in fixed width records, loaded with struct only.
+#   header | string index | area records | element records | strings
+# Every string (name, computer, area names, modes, colors which are not RRGGBB) is stored once and referenced by its index,
+# RRGGBB colors are packed in the element records. Save and Load pick the format from COMPILED_EXTENSION and the magic.
+COMPILED_MAGIC = "AFXP"
+COMPILED_VERSION = 1
+COMPILED_EXTENSION = ".cfgb"
+# magic, version, strings, areas, elements, name string, computer string, speed
+COMPILED_HEADER = struct.Struct("<4sHxxIIIIIi")
+# offset and length in the strings
+COMPILED_STRING = struct.Struct("<II")
+# name string, first element, elements
+COMPILED_AREA = struct.Struct("<III")
+# mode string, flags, color1, color2 : the colors are packed RRGGBB or, with their COLOR*_STRING flag, string indexes
+COMPILED_ELEMENT = struct.Struct("<HBxII")
+COLOR1_STRING = 0x01
+COLOR2_STRING = 0x02
+PACKED_COLOR = re.compile("^[0-9A-F]{6}$")
+# read once : changing the umask to read it is not thread safe
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+
+def Replace_File(path, write, sync=True):
+    """Write path with write(f) in a temporary file of its own, renamed over path.
+    Concurrent writers never rename a file another one is still writing. The file keeps its permissions."""
+    try:
+        mode = os.stat(path).st_mode & 0o777
+    except OSError:
+        mode = 0o666 & ~UMASK
+    fd, tmp = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=os.path.dirname(path) or ".")
+    try:
+        f = os.fdopen(fd, 'wb')
+        try:
+            write(f)
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+        finally:
+            f.close()
+        os.chmod(tmp, mode)
+        os.rename(tmp, path)
+    except:
+        os.remove(tmp)
+        raise
+
+
+class CompiledProfileError(Exception):
+    pass
+
 
 class AlienFXConfiguration:
+    """A profile. The edits made through configuration (append, update_line, remove) and Add bump revision,
+    the content hash is only computed again after an edit. synced keeps the hash of the content of every file
+    loaded or saved, with the mtime and size the file had then, so Check and Save know without reading the file
+    whether it holds the same profile, unless the file changed outside this profile."""
 
     def __init__(self):
         self.name = "Default configuration"
         self.area = {}
         self.computer = ""
-        self.AlienFXTexts = AlienFXTexts()
+        self.AlienFXTexts = TEXTS
+        self.revision = 0
+        self.hashed = (None, None)
+        self.synced = {}
 
     def Create(self, name, computer, speed, path):
         self.name = name
@@ -19,7 +85,8 @@ class AlienFXConfiguration:
 
     def Add(self, area):
         if area.name not in self.area:
-            self.area[area.name] = configuration(area)
+            self.area[area.name] = configuration(area, self)
+            self.Changed()
         # else:
             # self.area[area.name].append(configuration(area))
 
@@ -37,10 +104,55 @@ class AlienFXConfiguration:
             for element in self.area[area]:
                 print element.text
 
+    def Changed(self):
+        self.revision += 1
+
+    def Hash(self):
+        """Hash of the content of the profile, computed again only after an edit"""
+        key = (self.revision, self.name, self.computer, getattr(self, "speed", None))
+        if self.hashed[0] != key:
+            content = [str(value) for value in key[1:]]
+            for area in sorted(self.area.keys()):
+                content.append(area)
+                for element in self.area[area]:
+                    content.extend([str(element.mode), str(element.color1), str(element.color2)])
+            self.hashed = (key, hashlib.sha1("\n".join(content)).hexdigest())
+        return self.hashed[1]
+
+    def Stamp(self, path):
+        """mtime and size of path, None when it does not exist"""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return (stat.st_mtime, stat.st_size)
+
+    def Synced(self, path):
+        """Hash of the content path held when it was last loaded or saved, None when the file changed since"""
+        if path not in self.synced:
+            return None
+        digest, stamp = self.synced[path]
+        if stamp is None or stamp != self.Stamp(path):
+            del self.synced[path]
+            return None
+        return digest
+
     def Save(self, path=None):
+        """Write the profile if the file does not hold it already, through a temporary file renamed over it.
+        Return False when the write was skipped."""
         if path:
             self.path = path
-        f = open(self.path, 'w')
+        digest = self.Hash()
+        if self.Synced(self.path) == digest:
+            return False
+        if self.path.endswith(COMPILED_EXTENSION):
+            Replace_File(self.path, lambda f: f.write(self.Compile()))
+        else:
+            Replace_File(self.path, self.Write_Text)
+        self.synced[self.path] = (digest, self.Stamp(self.path))
+        return True
+
+    def Write_Text(self, f):
         f.write("name=%s\n" % self.name)
         f.write("computer=%s\n" % self.computer)
         f.write("speed=%s\n" % self.speed)
@@ -50,13 +162,28 @@ class AlienFXConfiguration:
                 f.write("type=%s\n" % element.mode)
                 f.write("color=%s\n" % element.color1)
                 f.write("color2=%s\n" % element.color2)
-        f.close()
 
     def Load(self, path):
         if path:
             self.path = path
         f = open(path)
-        lines = f.readlines()
+        if f.read(len(COMPILED_MAGIC)) == COMPILED_MAGIC:
+            self.Load_Compiled(f)
+            f.close()
+        else:
+            f.seek(0)
+            self.Load_Text(f.readlines())
+            f.close()
+        self.synced[path] = (self.Hash(), self.Stamp(path))
+
+    def Load_Data(self, data):
+        """Load a text or compiled profile from the content of its file"""
+        if data.startswith(COMPILED_MAGIC):
+            self.Load_Compiled_Data(data)
+        else:
+            self.Load_Text(data.splitlines())
+
+    def Load_Text(self, lines):
         for line in lines:
             split = line.strip().split('=')
 
@@ -68,7 +195,7 @@ class AlienFXConfiguration:
                 self.computer = split[1]
             elif split[0] == "area":
                 area = split[1]
-                self.area[split[1]] = configuration(AllComputers.computerList[self.computer].computer.regions[area])
+                self.area[split[1]] = configuration(AllComputers.computerList[self.computer].computer.regions[area], self)
             elif split[0] == "type":
                 self.area[area].append(split[1])
             elif split[0] == "color":
@@ -76,7 +203,104 @@ class AlienFXConfiguration:
             elif split[0] == "color2":
                 self.area[area][-1].color2 = split[1]
 
+    def Compile(self):
+        """Return the compiled profile, the areas are sorted so the same profile always gives the same bytes"""
+        strings = []
+        index = {}
+
+        def String(value):
+            value = str(value)
+            if value not in index:
+                index[value] = len(strings)
+                strings.append(value)
+            return index[value]
+
+        def Color(value, flag):
+            value = str(value)
+            if PACKED_COLOR.match(value):
+                return int(value, 16), 0
+            return String(value), flag
+
+        name = String(self.name)
+        computer = String(self.computer)
+        areas = []
+        elements = []
+        for area in sorted(self.area.keys()):
+            areas.append(COMPILED_AREA.pack(String(area), len(elements), len(self.area[area])))
+            for element in self.area[area]:
+                color1, flag1 = Color(element.color1, COLOR1_STRING)
+                color2, flag2 = Color(element.color2, COLOR2_STRING)
+                elements.append(COMPILED_ELEMENT.pack(String(element.mode), flag1 | flag2, color1, color2))
+        offsets = []
+        offset = 0
+        for value in strings:
+            offsets.append(COMPILED_STRING.pack(offset, len(value)))
+            offset += len(value)
+        header = COMPILED_HEADER.pack(COMPILED_MAGIC, COMPILED_VERSION, len(strings), len(areas), len(elements), name, computer, self.speed)
+        return header + "".join(offsets) + "".join(areas) + "".join(elements) + "".join(strings)
+
+    def Load_Compiled(self, f):
+        """Load a compiled profile from the open file f"""
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, mmap.error):
+            raise CompiledProfileError("Empty compiled profile")
+        try:
+            self.Load_Compiled_Data(data)
+        finally:
+            data.close()
+
+    def Load_Compiled_Data(self, data):
+        """Load a compiled profile from data, a string or a mmap"""
+        try:
+            if len(data) < COMPILED_HEADER.size:
+                raise CompiledProfileError("Truncated compiled profile")
+            magic, version, n_strings, n_areas, n_elements, name, computer, speed = COMPILED_HEADER.unpack_from(data)
+            if version != COMPILED_VERSION:
+                raise CompiledProfileError("Unsupported compiled profile version %d" % version)
+            offset = COMPILED_HEADER.size
+            areas_offset = offset + n_strings * COMPILED_STRING.size
+            elements_offset = areas_offset + n_areas * COMPILED_AREA.size
+            strings_offset = elements_offset + n_elements * COMPILED_ELEMENT.size
+            index = struct.unpack_from("<%dI" % (2 * n_strings), data, offset)
+            blob = data[strings_offset:]
+            strings = [blob[index[i]:index[i] + index[i + 1]] for i in xrange(0, 2 * n_strings, 2)]
+            areas = struct.unpack_from("<" + COMPILED_AREA.format[1:] * n_areas, data, areas_offset)
+            elements = struct.unpack_from("<" + COMPILED_ELEMENT.format[1:] * n_elements, data, elements_offset)
+        except struct.error:
+            raise CompiledProfileError("Truncated compiled profile")
+        self.name = strings[name]
+        self.computer = strings[computer]
+        self.speed = speed
+        regions = AllComputers.computerList[self.computer].computer.regions
+        for i in xrange(0, 3 * n_areas, 3):
+            area = strings[areas[i]]
+            conf = self.area[area] = configuration(regions[area], self)
+            for j in xrange(areas[i + 1] * 4, (areas[i + 1] + areas[i + 2]) * 4, 4):
+                mode, flags, color1, color2 = elements[j:j + 4]
+                if flags & COLOR1_STRING:
+                    color1 = strings[color1]
+                else:
+                    color1 = "%06X" % color1
+                if flags & COLOR2_STRING:
+                    color2 = strings[color2]
+                else:
+                    color2 = "%06X" % color2
+                conf.append(strings[mode], color1, color2)
+
     def Check(self, path):
+        """True when the file path holds this profile. No disk access for the files loaded or saved by this profile."""
+        digest = self.Synced(path)
+        if digest is not None:
+            return digest == self.Hash()
+        f = open(path, 'rb')
+        if f.read(len(COMPILED_MAGIC)) == COMPILED_MAGIC:
+            # same profile, same compiled bytes
+            f.seek(0)
+            same = f.read() == self.Compile()
+            f.close()
+            return same
+        f.close()
         old = AlienFXConfiguration()
         old.Load(path)
         if self.name != old.name:
@@ -108,19 +332,160 @@ class AlienFXConfiguration:
             # return False
         return True
 
+    def Apply(self, controller, computer, speed=None, save=False):
+        """Write the profile through controller (an AlienFX_Controller or a Daemon_Controller) on computer (see AlienFXComputers).
+        The loops are padded with their last entry to the longest one. With save the profile is stored in the boot block,
+        the power button colors in the sleep and power blocks, then the profile is applied."""
+        if speed is None:
+            speed = self.speed
+        controller.Set_Loop_Conf(save, computer.BLOCK_LOAD_ON_BOOT)
+        controller.Add_Speed_Conf(speed)
+        max_conf = 1
+        for zone in computer.regions.keys():
+            if not computer.regions[zone].power_button:
+                max_conf = max(max_conf, len(self.area[zone]))
+        power = None
+        for zone in sorted(computer.regions.keys(), key=lambda zone: computer.regions[zone].regionId):
+            if computer.regions[zone].power_button:
+                power = zone
+                continue
+            regionId = computer.regions[zone].regionId
+            loop = self.area[zone]
+            for conf in loop:
+                controller.Add_Loop_Conf(regionId, conf.mode, conf.color1, conf.color2)
+            if len(loop) != 1:
+                for i in range(len(loop), max_conf):
+                    controller.Add_Loop_Conf(regionId, loop[-1].mode, loop[-1].color1, loop[-1].color2)
+            controller.End_Loop_Conf()
+        controller.End_Transfert_Conf()
+        controller.Write_Conf()
+        if save:
+            color1 = self.area[power][0].color1
+            color2 = self.area[power][0].color2
+            area = computer.regions[power].regionId
+            # (block, power button loop, other regions off), the blocks a model does not have are skipped
+            blocks = [
+                ("BLOCK_STANDBY", [("morph", color1, '000000'), ("morph", '000000', color1)], True),
+                ("BLOCK_AC_POWER", [("fixed", color1, None)], False),
+                ("BLOCK_CHARGING", [("morph", color1, color2), ("morph", color2, color1)], False),
+                ("BLOCK_BATT_SLEEPING", [("morph", color2, '000000'), ("morph", '000000', color2)], True),
+                ("BLOCK_BAT_POWER", [("fixed", color2, None)], False),
+                ("BLOCK_BATT_CRITICAL", [("blink", color2, None)], False)]
+            for block, loop, dark in blocks:
+                if not hasattr(computer, block):
+                    continue
+                controller.Set_Loop_Conf(save, getattr(computer, block))
+                for mode, c1, c2 in loop:
+                    controller.Add_Loop_Conf(area, mode, c1, c2)
+                controller.End_Loop_Conf()
+                if dark:
+                    controller.Add_Loop_Conf(computer.REGION_ALL_BUT_POWER, "fixed", '000000')
+                    controller.End_Loop_Conf()
+                controller.End_Transfert_Conf()
+                controller.Write_Conf()
+            # Applying after all the saving !
+            self.Apply(controller, computer, speed)
+
+
+class AlienFXProfileIndex:
+    """Name, mtime, size and content hash of every profile of a directory, kept in the INDEX_FILE of the directory.
+    Refresh only stats the profiles, the new and modified ones are read again, and loaded only when their hash changed."""
+
+    INDEX_FILE = ".profiles.index"
+    VERSION = 1
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, self.INDEX_FILE)
+        self.entries = {}
+        self.loads = 0
+        try:
+            f = open(self.path)
+            index = json.load(f)
+            f.close()
+            if index.get("version") == self.VERSION:
+                # json gives unicode back, the profile names and file names are utf-8 str everywhere else
+                for f, entry in index["profiles"].items():
+                    if entry["name"] is not None:
+                        entry["name"] = entry["name"].encode("utf-8")
+                    self.entries[f.encode("utf-8")] = entry
+        except (IOError, OSError, ValueError, KeyError, AttributeError, TypeError):
+            pass
+
+    def Refresh(self):
+        """Update the index, return the profile file names in the directory order"""
+        files = [f for f in os.listdir(self.directory) if f.endswith((".cfg", COMPILED_EXTENSION))]
+        changed = False
+        for f in files:
+            path = os.path.join(self.directory, f)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entry = self.entries.get(f)
+            if entry is not None and entry["mtime"] == stat.st_mtime and entry["size"] == stat.st_size:
+                continue
+            changed = True
+            data = open(path, 'rb').read()
+            digest = hashlib.sha1(data).hexdigest()
+            if entry is None or entry["hash"] != digest:
+                entry = {"name": None, "hash": digest}
+                try:
+                    # parsed from the bytes just hashed, the file is read once
+                    conf = AlienFXConfiguration()
+                    conf.Load_Data(data)
+                    entry["name"] = conf.name
+                except Exception:
+                    # not a profile
+                    pass
+                self.loads += 1
+            entry["mtime"] = stat.st_mtime
+            entry["size"] = stat.st_size
+            self.entries[f] = entry
+        for f in self.entries.keys():
+            if f not in files:
+                del self.entries[f]
+                changed = True
+        if changed:
+            self.Save()
+        return files
+
+    def Save(self):
+        try:
+            # a cache, rebuilt when it is lost : no fsync
+            Replace_File(self.path, lambda f: json.dump({"version": self.VERSION, "profiles": self.entries}, f), sync=False)
+        except (IOError, OSError):
+            # read only directory, the index is rebuilt next time
+            pass
+
+    def Profiles(self):
+        """name => file name of the profiles, the first file of a name wins"""
+        profiles = {}
+        for f in self.Refresh():
+            entry = self.entries.get(f)
+            if entry is not None and entry["name"] is not None and entry["name"] not in profiles:
+                profiles[entry["name"]] = f
+        return profiles
+
 
 class configuration(list, AlienFXTexts):
 
-    def __init__(self, area):
+    def __init__(self, area, owner=None):
         self.area = area.name
         self.description = area.description
         self.Id = 0x01
+        self.owner = owner
+
+    def Changed(self):
+        if self.owner is not None:
+            self.owner.Changed()
 
     def append(self, Type, color="", color2=""):
         el = element(Type, color, color2)
         el.Id = self.Id
         self += [el]
         self.Id += 1
+        self.Changed()
 
     def update_line(self, Id, mode=None, color1=None, color2=None):
         if len(self) > Id:
@@ -130,6 +495,7 @@ class configuration(list, AlienFXTexts):
                 self[Id].color1 = color1
             if color2:
                 self[Id].color2 = color2
+            self.Changed()
             return True
         return False
 
@@ -137,20 +503,38 @@ class configuration(list, AlienFXTexts):
         for i in range(Id, len(self) - 1):
             self[i].Id -= 1
         del self[Id]
+        self.Changed()
 
 
-class element():
+class element(object):
+
+    __slots__ = ("mode", "Id", "color1", "color2")
+
+    Text_Conf_Type = {
+        "fixed": "Setting fixed color to %s%s",
+        "blink": "Setting blinking color to %s%s",
+        "morph": "Setting morph color from %s to %s",
+        "speed": "Setting Speed to %s%s",
+        "endloop": "End of the loop%s%s"}
 
     def __init__(self, Type, color="", color2=""):
+        if Type not in self.Text_Conf_Type:
+            raise KeyError(Type)
         self.mode = Type
         self.Id = 0x00
         self.color1 = color
         self.color2 = color2
-        self.Text_Conf_Type = {
-            "fixed": "Setting fixed color to %s%s",
-            "blink": "Setting blinking color to %s%s",
-            "morph": "Setting morph color from %s to %s",
-            "speed": "Setting Speed to %s%s",
-            "endloop": "End of the loop%s%s"}
-        # print "-%s-"%self.mode
-        self.text = self.Text_Conf_Type[self.mode] % (self.color1, self.color2)
+
+    @property
+    def text(self):
+        return self.Text_Conf_Type[self.mode] % (self.color1, self.color2)
+
+
+if __name__ == "__main__":
+    # Convert a profile between the text and the compiled format : AlienFXConfiguration.py source destination
+    if len(sys.argv) != 3:
+        print "Usage : %s source.cfg|source%s destination.cfg|destination%s" % (sys.argv[0], COMPILED_EXTENSION, COMPILED_EXTENSION)
+        sys.exit(1)
+    conf = AlienFXConfiguration()
+    conf.Load(sys.argv[1])
+    conf.Save(sys.argv[2])
@@ -0,0 +1,214 @@
+# -*- coding: UTF-8 -*-
+
+# This file is part of pyAlienFX.
+#
+#    pyAlienFX is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    pyAlienFX is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with pyAlienFX.  If not, see <http://www.gnu.org/licenses/>.
+#
+#    This work is licensed under the Creative Commons Attribution-NonCommercial-ShareAlike 3.0 Unported License.
+#    To view a copy of this license, visit http://creativecommons.org/licenses/by-nc-sa/3.0/ or send a letter
+#    to Creative Commons, 444 Castro Street, Suite 900, Mountain View, California, 94041, USA.
+#
+
+
+# Protocol disassembler
+# Turns a stream of AlienFX packets back into commands, with the region names and colors of a model,
+# then into the loops and save blocks they program :
+#   disassembler = AlienFX_Disassembler(AllComputers.computerIndex[(0x187c, 0x0518)].computer)
+#   for item in disassembler.Program(packets):
+#       print Format(item)
+# Everything is a generator, so captures of any size are decoded with a bounded memory.
+# usbmonparser.py capture --request-type 0x21 | python -m AlienFX.AlienFXDisassembler - [product id]
+
+import sys
+from collections import namedtuple
+
+from AlienFX.AlienFXComputers import AllComputers
+
+# name is the COMMAND_* constant of the model without its prefix, colors are "RRGGBB" strings,
+# value is the speed, the reset mode (RESET_* name) or the save block of the command.
+# block is the storage block the command is saved in (None when it is executed at once),
+# loop the number of the loop it belongs to since the last execute, reset or save.
+Command = namedtuple("Command", "name area regions color1 color2 value block loop packet")
+# steps is the list of (mode, color1, color2) of the loop, speed the last speed set before it
+Loop = namedtuple("Loop", "block loop area regions speed steps")
+Save_Block = namedtuple("Save_Block", "block loops")
+
+MODES = {"SET_COLOR": "fixed", "SET_BLINK_COLOR": "blink", "SET_MORPH_COLOR": "morph"}
+CACHE_SIZE = 65536
+
+
+def Constants(computer, prefix):
+    """value => name of the constants of computer starting with prefix"""
+    return dict([(getattr(computer, name), name[len(prefix):]) for name in dir(computer) if name.startswith(prefix)])
+
+
+def RGB(high, low):
+    """Two 4 bits per channel bytes [r << 4 | g, b << 4] => 'RRGGBB'"""
+    return "%02X%02X%02X" % ((high >> 4) * 0x11, (high & 0x0f) * 0x11, (low >> 4) * 0x11)
+
+
+class AlienFX_Disassembler:
+    """Decoder of the packets of one model, computer is the model instance (AlienFXComputer.computer)"""
+
+    def __init__(self, computer):
+        self.computer = computer
+        self.commands = Constants(computer, "COMMAND_")
+        self.resets = Constants(computer, "RESET_")
+        self.blocks = Constants(computer, "BLOCK_")
+        self.regions = sorted([(r.regionId, name) for name, r in computer.regions.items()])
+        self.areas = {}
+        self.cache = {}
+
+    def Regions(self, area):
+        """Names of the regions lit by area, the bits of no region as a hex number"""
+        regions = self.areas.get(area)
+        if regions is None:
+            names = []
+            left = area
+            for regionId, name in self.regions:
+                if area & regionId == regionId:
+                    names.append(name)
+                    left &= ~regionId
+            if left:
+                names.append("0x%06x" % left)
+            regions = self.areas[area] = tuple(names)
+        return regions
+
+    def Decode(self, packet):
+        """(name, area, regions, color1, color2, value) of a single packet, packet is a list of bytes or a string"""
+        if type(packet) == str:
+            packet = bytearray(packet)
+        key = tuple(packet)
+        decoded = self.cache.get(key)
+        if decoded is not None:
+            return decoded
+        c = self.computer
+        if len(packet) < 3 or packet[0] != c.START_BYTE:
+            decoded = ("INVALID", None, None, None, None, None)
+        else:
+            name = self.commands.get(packet[1], "UNKNOWN_0x%02x" % packet[1])
+            area = regions = color1 = color2 = value = None
+            if name in MODES:
+                area = packet[3] << 16 | packet[4] << 8 | packet[5]
+                regions = self.Regions(area)
+                color1 = RGB(packet[6], packet[7])
+                if name == "SET_MORPH_COLOR":
+                    color2 = RGB((packet[7] & 0x0f) << 4 | packet[8] >> 4, (packet[8] & 0x0f) << 4)
+            elif name == "SET_SPEED":
+                value = packet[3] << 8 | packet[4]
+            elif name == "RESET":
+                value = self.resets.get(packet[2], packet[2])
+            elif name == "SAVE_NEXT":
+                value = packet[2]
+            decoded = (name, area, regions, color1, color2, value)
+        if len(self.cache) >= CACHE_SIZE:
+            self.cache.clear()
+        self.cache[key] = decoded
+        return decoded
+
+    def Commands(self, packets):
+        """Yield the Command of every packet, packets are lists of bytes, strings or Requests.
+        A SAVE_NEXT is not yielded : its block is set on the command it saves."""
+        block = None
+        loops = {}
+        for packet in packets:
+            packet = getattr(packet, "packet", packet)
+            name, area, regions, color1, color2, value = self.Decode(packet)
+            if name == "SAVE_NEXT":
+                block = value
+                continue
+            command = Command(name, area, regions, color1, color2, value, block, loops.get(block, 0), packet)
+            if name == "LOOP_BLOCK_END":
+                loops[block] = loops.get(block, 0) + 1
+            elif name in ["TRANSMIT_EXECUTE", "RESET", "SAVE"]:
+                loops = {}
+            block = None
+            yield command
+
+    def Program(self, packets):
+        """Yield a Loop for every loop programmed, a Save_Block for every block saved and the other Commands"""
+        steps = {}
+        speed = None
+        saved = {}
+        for command in self.Commands(packets):
+            name = command.name
+            if name in MODES:
+                steps.setdefault(command.block, []).append(command)
+            elif name == "LOOP_BLOCK_END":
+                loop = steps.pop(command.block, [])
+                area = 0
+                for step in loop:
+                    area |= step.area
+                item = Loop(command.block, command.loop, area, self.Regions(area), speed,
+                            [(MODES[step.name], step.color1, step.color2) for step in loop])
+                if command.block is not None:
+                    saved.setdefault(command.block, []).append(item)
+                yield item
+            elif name == "SAVE":
+                for block in sorted(saved.keys()):
+                    yield Save_Block(block, saved[block])
+                saved = {}
+                yield command
+            else:
+                if name == "SET_SPEED":
+                    speed = command.value
+                elif name in ["TRANSMIT_EXECUTE", "RESET"]:
+                    steps = {}
+                yield command
+
+    def Block_Name(self, block):
+        return self.blocks.get(block, block)
+
+
+def Format(item, disassembler=None):
+    if isinstance(item, Loop):
+        block = item.block is not None and " block %s" % (disassembler and disassembler.Block_Name(item.block) or item.block) or ""
+        steps = ", ".join(["%s %s%s" % (mode, color1, color2 and " " + color2 or "") for mode, color1, color2 in item.steps])
+        return "LOOP %d%s %s speed %s : %s" % (item.loop, block, "+".join(item.regions), item.speed, steps)
+    if isinstance(item, Save_Block):
+        return "SAVED block %s : %d loops" % (disassembler and disassembler.Block_Name(item.block) or item.block, len(item.loops))
+    text = item.name
+    if item.regions is not None:
+        text += " %s %s%s" % ("+".join(item.regions), item.color1, item.color2 and " " + item.color2 or "")
+    if item.value is not None:
+        text += " %s" % item.value
+    if item.block is not None:
+        text += " (block %s)" % (disassembler and disassembler.Block_Name(item.block) or item.block)
+    return text
+
+
+def Hex_Packets(lines):
+    """Packets of lines of hex bytes, as printed by usbmonparser.py"""
+    for line in lines:
+        try:
+            packet = bytearray(line.replace(" ", "").strip().decode("hex"))
+        except TypeError:
+            continue
+        if packet:
+            yield packet
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in [2, 3]:
+        print "Usage : %s capture_file|- [product id]" % sys.argv[0]
+        sys.exit(1)
+    productId = len(sys.argv) == 3 and int(sys.argv[2], 16) or 0x0518
+    disassembler = AlienFX_Disassembler(AllComputers.computerIndex[(0x187c, productId)].computer)
+    if sys.argv[1] == "-":
+        packets = Hex_Packets(sys.stdin)
+    else:
+        from AlienFX import AlienFXCapture
+        packets = (bytearray(r.payload) for r in AlienFXCapture.Open(sys.argv[1]).Records() if r.direction == AlienFXCapture.OUT)
+    for item in disassembler.Program(packets):
+        print Format(item, disassembler)
@@ -21,20 +21,51 @@
 #
 
 import usb
+import usb.core
 import platform
 import sys
 import os
 from copy import *
 import time
+import hashlib
+from collections import OrderedDict
 
 from AlienFX.AlienFXProperties import *
 from AlienFX.AlienFXTexts import *
-from AlienFX.AlienFXComputers import AllComputers
+from AlienFX.AlienFXComputers import AllComputers, PROPERTIES, TEXTS
+from AlienFX import AlienFXColors
+from AlienFX import AlienFXCapture
+
+
+def Get_Backend():
+    """Return the first available pyusb backend, in the same order as usb.core.find"""
+    import usb.backend.libusb10 as libusb10
+    import usb.backend.libusb01 as libusb01
+    import usb.backend.openusb as openusb
+    for m in (libusb10, openusb, libusb01):
+        backend = m.get_backend()
+        if backend is not None:
+            return backend
+    raise ValueError('No backend available')
+
+
+def Find_Controllers(backend=None):
+    """Enumerate the USB bus once and return a list of (AlienFXComputer, usb.core.Device) for every known AlienFX controller.
+    Only the device descriptor of each device is read, the Device object is built for the matching ones only."""
+    if backend is None:
+        backend = Get_Backend()
+    found = []
+    for dev in backend.enumerate_devices():
+        desc = backend.get_device_descriptor(dev)
+        computer = AllComputers.computerIndex.get((int(desc.idVendor), int(desc.idProduct)))
+        if computer is not None:
+            found.append((computer, usb.core.Device(dev, backend)))
+    return found
 
 
 class AlienFX_Driver(AllComputers):
 
-    def __init__(self):
+    def __init__(self, backend=None):
         # Define I/O Reqquest types
         self.SEND_REQUEST_TYPE = 0x21
         self.SEND_REQUEST = 0x09
@@ -45,60 +76,154 @@ class AlienFX_Driver(AllComputers):
         self.READ_VALUE = 0x101
         self.READ_INDEX = 0x0
 
-        self.log = open("packet.log", 'w')
-        self.debug = True
-
-        self.AlienFXProperties = AlienFXProperties()
-        self.AlienFXTexts = AlienFXTexts()
+        # debug prints every packet sent, the traces are called with every Request sent (see Add_Trace)
+        # and the capture records every transfer (see Set_Capture)
+        self.debug = False
+        self.capture = None
+        self.traces = []
+
+        # Packet pacing : "fixed" sleeps fixed_gap before every packet,
+        # "status" polls the controller and sends as soon as it is not busy
+        self.PACING_FIXED = "fixed"
+        self.PACING_STATUS = "status"
+        self.pacing = self.PACING_FIXED
+        self.fixed_gap = 0.02
+        self.min_gap = 0.002
+        self.deadline = 0.5
+        self.last_send = 0
+        self.Reset_Pacing_Stats()
+
+        self.AlienFXProperties = PROPERTIES
+        self.AlienFXTexts = TEXTS
+        self.backend = backend
 
         # Initializing !
         # find our device
         if not self.FindDevice():
             print "No AlienFX USB controler found ! Go see the list of supported computer on : https://code.google.com/p/pyalienfx/wiki/SupportedComputer "
             sys.exit(1)
-        self.Take_over()
+        self.shadow = AlienFX_Shadow()
+        self.session = AlienFX_Session(self)
+        self.session.Claim()
         # dev.claimInterface()
 
     def FindDevice(self):
-        """Look for all the devices listed in the AlienFXComputer file, if found return True, else return False.
-        If a computer is found, the device is loaded, as well as all the parameters for the computer (which are in the AlienFXComputer)"""
-        ok = False
-        for computer in self.computerList.keys():
-            dev = usb.core.find(idVendor=self.computerList[computer].vendorId, idProduct=self.computerList[computer].productId)
-            if dev is not None:
-                print "Comnputer %s found ! Loading the parameters ..." % self.computerList[computer].name
-                self.computer = self.computerList[computer].computer
-                self.vendorId = self.computerList[computer].vendorId
-                self.productId = self.computerList[computer].productId
-                self.dev = dev
-                return True
-        return False
+        """Look for all the devices listed in the AlienFXComputer file, return the list of the controllers found (empty if none).
+        The bus is enumerated only once, the first controller found is loaded, as well as all the parameters for the computer (which are in the AlienFXComputer)"""
+        self.controllers = Find_Controllers(self.backend)
+        if not self.controllers:
+            return self.controllers
+        computer, dev = self.controllers[0]
+        print "Comnputer %s found ! Loading the parameters ..." % computer.name
+        self.computer = computer.computer
+        self.vendorId = computer.vendorId
+        self.productId = computer.productId
+        self.dev = dev
+        return self.controllers
 
     def WriteDevice(self, MSG):
         if len(MSG[0].packet) == self.computer.DATA_LENGTH:
             for msg in MSG:
-                time.sleep(0.02)
-                if self.debug:
-                    nice_packet = ""
-                    for i in msg.packet:
-                        if i < 16:
-                            nice_packet += " 0%s" % hex(i).replace('0x', '')
-                        else:
-                            nice_packet += " %s" % hex(i).replace('0x', '')
-                    print "Sending : %s\nPacket : %s" % (msg.legend, nice_packet)
-                    log = ""
-                    for m in msg.packet:
-                        if m < 16:
-                            log += ("0%x " % m).replace('0x', '')
-                        else:
-                            log += ("%x " % m).replace('0x', '')
-                    self.log.write(log + "\n")
-                self.dev.ctrl_transfer(self.SEND_REQUEST_TYPE, self.SEND_REQUEST, self.SEND_VALUE, self.SEND_INDEX, msg.packet)
+                self.Pace(msg.packet)
+                if self.debug or self.traces:
+                    self.Trace(msg)
+                packet = msg.packet
+                if type(packet) is bytearray:
+                    # pyusb copies a string into its array much faster than a bytearray
+                    packet = str(packet)
+                start = time.time()
+                self.session.ctrl_transfer(self.SEND_REQUEST_TYPE, self.SEND_REQUEST, self.SEND_VALUE, self.SEND_INDEX, packet)
+                self.last_send = time.time()
+                self.send_time += self.last_send - start
+                self.packets_sent += 1
         else:
-            self.dev.ctrl_transfer(self.SEND_REQUEST_TYPE, self.SEND_REQUEST, self.SEND_VALUE, self.SEND_INDEX, MSG)
+            self.session.ctrl_transfer(self.SEND_REQUEST_TYPE, self.SEND_REQUEST, self.SEND_VALUE, self.SEND_INDEX, MSG)
+
+    def Add_Trace(self, trace):
+        """trace(request) is called before every packet is sent"""
+        self.traces.append(trace)
+
+    def Remove_Trace(self, trace):
+        self.traces.remove(trace)
+
+    def Trace(self, msg):
+        if self.debug:
+            print "Sending : %s\nPacket : %s" % (Legend(msg.packet, self.computer), Hex_Packet(msg.packet))
+        for trace in self.traces:
+            trace(msg)
+
+    def Set_Capture(self, capture):
+        """Record every transfer in capture (an AlienFXCapture.AlienFX_Capture), None stops the capture.
+        The session only goes through the recording transfer while a capture is set."""
+        self.capture = capture
+        if capture is None:
+            self.session.__dict__.pop("ctrl_transfer", None)
+        else:
+            # Close detaches the capture from the last driver it was set on
+            capture.driver = self
+            self.session.ctrl_transfer = self.session.Captured_Transfer
+
+    def Set_Pacing(self, mode, min_gap=None, deadline=None):
+        """Select how WriteDevice spaces the packets.
+        In "fixed" mode every packet waits fixed_gap seconds (the historical behaviour).
+        In "status" mode the controller status is polled and the packet is sent as soon as it is no longer busy,
+        never sooner than min_gap after the previous packet and never waiting more than deadline seconds."""
+        if mode not in [self.PACING_FIXED, self.PACING_STATUS]:
+            raise ValueError("Unknown pacing mode : %s" % mode)
+        self.pacing = mode
+        if min_gap is not None:
+            self.min_gap = min_gap
+        if deadline is not None:
+            self.deadline = deadline
+        self.Reset_Pacing_Stats()
+
+    def Reset_Pacing_Stats(self):
+        self.wait_time = 0.0
+        self.send_time = 0.0
+        self.packets_sent = 0
+        self.status_polls = 0
+        self.deadline_misses = 0
+
+    def Pacing_Stats(self):
+        """Return the pacing counters : seconds spent waiting and sending, packets sent, status polls and deadline misses"""
+        return {"mode": self.pacing,
+                "wait_time": self.wait_time,
+                "send_time": self.send_time,
+                "packets_sent": self.packets_sent,
+                "status_polls": self.status_polls,
+                "deadline_misses": self.deadline_misses}
+
+    def Pace(self, packet):
+        """Wait until packet can be sent, according to the pacing mode.
+        In "status" mode a status request is sent at once : polling the status before it would only double the round trips."""
+        start = time.time()
+        if self.pacing == self.PACING_STATUS:
+            if packet[1] == self.computer.COMMAND_GET_STATUS:
+                return
+            gap = self.min_gap - (start - self.last_send)
+            if gap > 0:
+                time.sleep(gap)
+            while self.Read_Status() == self.computer.STATE_BUSY:
+                if time.time() - start > self.deadline:
+                    self.deadline_misses += 1
+                    break
+                time.sleep(self.min_gap)
+        else:
+            time.sleep(self.fixed_gap)
+        self.wait_time += time.time() - start
+
+    def Read_Status(self):
+        """Ask the controller for its status and return the status byte (STATE_READY, STATE_BUSY, ...)"""
+        packet = [self.computer.FILL_BYTE] * self.computer.DATA_LENGTH
+        packet[0] = self.computer.START_BYTE
+        packet[1] = self.computer.COMMAND_GET_STATUS
+        self.session.ctrl_transfer(self.SEND_REQUEST_TYPE, self.SEND_REQUEST, self.SEND_VALUE, self.SEND_INDEX, packet)
+        msg = self.session.ctrl_transfer(self.READ_REQUEST_TYPE, self.READ_REQUEST, self.READ_VALUE, self.READ_INDEX, self.computer.DATA_LENGTH)
+        self.status_polls += 1
+        return msg[0]
 
     def ReadDevice(self, msg):
-        msg = self.dev.ctrl_transfer(self.READ_REQUEST_TYPE, self.READ_REQUEST, self.READ_VALUE, self.READ_INDEX, len(msg[0].packet))
+        msg = self.session.ctrl_transfer(self.READ_REQUEST_TYPE, self.READ_REQUEST, self.READ_VALUE, self.READ_INDEX, len(msg[0].packet))
         if self.debug:
             print msg
         return msg
@@ -126,10 +251,181 @@ class AlienFX_Driver(AllComputers):
                 sys.exit(1)
 
 
+class AlienFX_Session:
+    """Keeps the AlienFX device claimed between transfers.
+    The device is taken over once, and again only when a transfer fails because the claim was lost
+    (kernel driver re-attached, permission or busy errors)."""
+
+    LOST_CLAIM_ERRORS = ["Access denied", "Resource busy", "Entity not found", "Operation not permitted", "could not claim interface", "detach"]
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.claimed = False
+        self.claims = 0
+        self.reclaims = 0
+
+    def Claim(self):
+        if not self.claimed:
+            self.driver.Take_over()
+            self.claimed = True
+            self.claims += 1
+
+    def Release(self):
+        """Forget the claim, the next transfer will take over the device again"""
+        self.claimed = False
+
+    def Lost_Claim(self, error):
+        for e in self.LOST_CLAIM_ERRORS:
+            if e.lower() in str(error).lower():
+                return True
+        return False
+
+    def ctrl_transfer(self, *args):
+        self.Claim()
+        try:
+            return self.driver.dev.ctrl_transfer(*args)
+        except usb.core.USBError, e:
+            if not self.Lost_Claim(e):
+                raise
+            print "Lost the device claim (%s), taking over again" % e
+            self.claimed = False
+            self.driver.shadow.Invalidate()
+            self.reclaims += 1
+            self.Claim()
+            return self.driver.dev.ctrl_transfer(*args)
+
+    def Captured_Transfer(self, request_type, request, value, index, data, *args):
+        """ctrl_transfer recording the transfer in the driver capture"""
+        capture = self.driver.capture
+        clock = AlienFXCapture.Clock
+        start = clock()
+        try:
+            result = AlienFX_Session.ctrl_transfer(self, request_type, request, value, index, data, *args)
+        except Exception:
+            capture.Record(start, request_type, request, value, index, type(data) != int and data or None, AlienFXCapture.RESULT_ERROR, clock() - start)
+            raise
+        if type(data) == int:
+            capture.Record(start, request_type, request, value, index, result, len(result), clock() - start)
+        else:
+            capture.Record(start, request_type, request, value, index, data, result, clock() - start)
+        return result
+
+    def Session_Stats(self):
+        return {"claims": self.claims, "reclaims": self.reclaims}
+
+
+class AlienFX_Shadow:
+    """Copy of what each area of the device is showing : the speed and, for every area, the loop of packets last executed for it.
+    It lets the controller send only the loops that changed. It is invalidated whenever the device state becomes uncertain
+    (reset, re-claim of the device, status error), so a stale copy never hides a needed write."""
+
+    def __init__(self):
+        self.invalidations = 0
+        self.sent_loops = 0
+        self.skipped_loops = 0
+        self.Invalidate()
+
+    def Invalidate(self):
+        self.speed = None
+        self.loops = {}
+        self.invalidations += 1
+
+    def Key(self, packet):
+        """Packet without the loop Id, which depends on the position of the loop in the request"""
+        return tuple(packet[:2]) + (0,) + tuple(packet[3:])
+
+    def Split(self, request, computer):
+        """Split a request into its speed packet and its loops [(area, [Request, ...]), ...].
+        Return None if the request holds commands that cannot be compared (reset, save ...)"""
+        speed = None
+        loops = []
+        loop = []
+        area = 0
+        for r in request:
+            command = r.packet[1]
+            if command == computer.COMMAND_SET_SPEED:
+                speed = r
+            elif command in [computer.COMMAND_SET_COLOR, computer.COMMAND_SET_BLINK_COLOR, computer.COMMAND_SET_MORPH_COLOR]:
+                area |= r.packet[3] * 65536 + r.packet[4] * 256 + r.packet[5]
+                loop.append(r)
+            elif command == computer.COMMAND_LOOP_BLOCK_END:
+                loop.append(r)
+                loops.append((area, loop))
+                loop = []
+                area = 0
+            elif command != computer.COMMAND_TRANSMIT_EXECUTE:
+                return None
+        if loop:
+            return None
+        return speed, loops
+
+    def Same_Loop(self, area, loop):
+        return self.loops.get(area) == [self.Key(r.packet) for r in loop]
+
+    def Update(self, speed, loops):
+        if speed is not None:
+            self.speed = self.Key(speed.packet)
+        for area, loop in loops:
+            for a in self.loops.keys():
+                if a & area and a != area:
+                    del self.loops[a]
+            self.loops[area] = [self.Key(r.packet) for r in loop]
+
+    def Shadow_Stats(self):
+        return {"sent_loops": self.sent_loops, "skipped_loops": self.skipped_loops, "invalidations": self.invalidations}
+
+
+class AlienFX_Compiled_Cache:
+    """LRU cache of compiled configurations.
+    The key is a hash of the computer name and of the recorded configuration calls, so re-applying a known configuration reuses its packets.
+    The cached requests are shared, they must not be modified."""
+
+    def __init__(self, size=32):
+        self.size = size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def Key(self, computer, conf):
+        return hashlib.sha1(repr((computer, conf))).hexdigest()
+
+    def Get(self, key):
+        request = self.entries.pop(key, None)
+        if request is None:
+            self.misses += 1
+            return None
+        self.entries[key] = request
+        self.hits += 1
+        return request
+
+    def Put(self, key, request):
+        self.entries[key] = request
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def Clear(self):
+        self.entries.clear()
+
+    def Cache_Stats(self):
+        return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
 class AlienFX_Controller:
 
     def __init__(self, driver):
         self.driver = driver
+        # Verified mode : send each request once and check it through Get_State instead of sending it twice
+        self.verified = False
+        self.max_resends = 2
+        self.verify_timeout = 1.0
+        self.sends = 0
+        self.resends = 0
+        # Diff apply : only send the loops that differ from what the device shows (see AlienFX_Shadow)
+        self.diff_apply = False
+        self.conf = []
+        self.compiled = AlienFX_Compiled_Cache()
 
     def Bye(self):
         sys.exit(0)
@@ -139,42 +435,81 @@ class AlienFX_Controller:
 
     def Set_Loop(self, action):
         self.WaitForOk()
-        self.driver.WriteDevice(action)
-        time.sleep(0.1)
-        self.driver.WriteDevice(action)
+        self.Send(action)
 
+    # The *_Conf calls are only recorded, the configuration is compiled into packets by Write_Conf
+    # unless the same configuration was already compiled for this computer (see AlienFX_Compiled_Cache)
     def Set_Loop_Conf(self, Save=False, block=0x01):
-        self.request = AlienFX_Constructor(self.driver, Save, block)
+        self.conf = [("conf", Save, block)]
 
     def Add_Loop_Conf(self, area, mode, color1, color2=None):
-        if type(area) != list:
-            area = self.request.Area(area)
-        if type(color1) != list:
-            color1 = self.request.Color(color1)
-        if type(color2) != list and color2:
-            color2 = self.request.Color2(color2)
-        if mode == "fixed":
-            self.request.Set_Color(area, color1)
-        elif mode == "blink":
-            self.request.Set_Blink_Color(area, color1)
-        elif mode == "morph" and color2:
-            self.request.Set_Morph_Color(area, color1, color2)
+        self.conf.append(("loop", area, mode, color1, color2))
 
     def Add_Speed_Conf(self, speed=0xc800):
-        self.request.Set_Speed(speed)
+        self.conf.append(("speed", speed))
 
     def End_Loop_Conf(self):
-        self.request.End_Loop()
+        self.conf.append(("end_loop",))
 
     def End_Transfert_Conf(self):
-        self.request.End_Transfert()
+        self.conf.append(("end_transfert",))
+
+    def Compile_Conf(self, conf):
+        """Build the AlienFX_Constructor request of a recorded configuration"""
+        request = AlienFX_Constructor(self.driver, conf[0][1], conf[0][2])
+        packed = self.Encode_Loop_Colors([call for call in conf[1:] if call[0] == "loop"])
+        for call in conf[1:]:
+            if call[0] == "loop":
+                area, mode, color1, color2 = call[1:]
+                if packed:
+                    color1, color2 = packed.pop()
+                self.Compile_Loop(request, area, mode, color1, color2)
+            elif call[0] == "speed":
+                request.Set_Speed(call[1])
+            elif call[0] == "end_loop":
+                request.End_Loop()
+            elif call[0] == "end_transfert":
+                request.End_Transfert()
+        return request
+
+    def Encode_Loop_Colors(self, loops):
+        """Pack the colors of all the loop entries in one call, returned in reverse order (None if some colors are not hex strings)"""
+        if [loop for loop in loops if type(loop[3]) != str or (loop[4] and type(loop[4]) != str)]:
+            return None
+        colors1 = AlienFXColors.Encode_Color([loop[3] for loop in loops])
+        colors2 = AlienFXColors.Encode_Color2([loop[4] or "000000" for loop in loops])
+        packed = [(c1, loop[4] and c2) for loop, c1, c2 in zip(loops, colors1, colors2)]
+        packed.reverse()
+        return packed
+
+    def Compile_Loop(self, request, area, mode, color1, color2=None):
+        if type(area) != list:
+            area = request.Area(area)
+        if type(color1) != list:
+            color1 = request.Color(color1)
+        if type(color2) != list and color2:
+            color2 = request.Color2(color2)
+        if mode == "fixed":
+            request.Set_Color(area, color1)
+        elif mode == "blink":
+            request.Set_Blink_Color(area, color1)
+        elif mode == "morph" and color2:
+            request.Set_Morph_Color(area, color1, color2)
 
     def Write_Conf(self):
-        self.WaitForOk()
-        self.driver.WriteDevice(self.request)
+        key = self.compiled.Key(self.driver.computer.name, self.conf)
+        self.request = self.compiled.Get(key)
+        if self.request is None:
+            self.request = self.Compile_Conf(self.conf)
+            self.compiled.Put(key, self.request)
         if not self.request.save:
-            time.sleep(0.1)
+            self.Apply_Request(self.request)
+            return
+        self.WaitForOk()
+        if not self.verified:
             self.driver.WriteDevice(self.request)
+        else:
+            self.Send(self.request)
 
     def Set_Color(self, Area, Color, Save=False, Apply=False, block=0x01):
         """Set the Color of an Area """
@@ -183,25 +518,18 @@ class AlienFX_Controller:
             Area = request.Area(Area)
         if type(Color) != list:
             Color = request.Color(Color)
-        self.WaitForOk()
         request.Set_Color(Area, Color)
         request.End_Loop()
         request.End_Transfert()
-        self.driver.WriteDevice(request)
-        time.sleep(0.1)
-        self.driver.WriteDevice(request)
+        self.Apply_Request(request)
         if Apply:
-            self.WaitForOk()
             request = AlienFX_Constructor(self.driver, False, block)
             request.Set_Color(Area, Color)
             request.End_Loop()
             request.End_Transfert()
-            self.driver.WriteDevice(request)
-            time.sleep(0.1)
-            self.driver.WriteDevice(request)
+            self.Apply_Request(request)
 
     def Set_Color_Blink(self, Area, Color, Save=False, Apply=False, block=0x01):
-        self.WaitForOk()
         request = AlienFX_Constructor(self.driver, Save, block)
         if type(Area) != list:
             Area = request.Area(Area)
@@ -211,53 +539,40 @@ class AlienFX_Controller:
         request.Set_Blink_Color(Area, Color)
         request.End_Loop()
         request.End_Transfert()
-        self.driver.WriteDevice(request)
-        time.sleep(0.1)
-        self.driver.WriteDevice(request)
+        self.Apply_Request(request)
         if Apply:
-            self.WaitForOk()
             request = AlienFX_Constructor(self.driver)
             request.Set_Speed()
             request.Set_Blink_Color(Area, Color)
             request.End_Loop()
             request.End_Transfert()
-            self.driver.WriteDevice(request)
-            time.sleep(0.1)
-            self.driver.WriteDevice(request)
+            self.Apply_Request(request)
 
     def Set_Color_Morph(self, Area, Color1, Color2, Save=False, Apply=False, block=0x01):
-        self.WaitForOk()
         request = AlienFX_Constructor(self.driver, Save, block)
         if type(Area) != list:
             Area = request.Area(Area)
         if type(Color1) != list:
             Color1 = request.Color(Color1)
         if type(Color2) != list:
-            Color2 = request.Color(Color2)
+            Color2 = request.Color2(Color2)
         request.Set_Speed()
         request.Set_Morph_Color(Area, Color1, Color2)
         request.End_Loop()
         request.End_Transfert()
-        self.driver.WriteDevice(request)
-        time.sleep(0.1)
-        self.driver.WriteDevice(request)
+        self.Apply_Request(request)
         if Apply:
-            self.WaitForOk()
             request = AlienFX_Constructor(self.driver, Save, block)
             request.Set_Speed()
             request.Set_Morph_Color(Area, Color1, Color2)
             request.End_Loop()
             request.End_Transfert()
-            self.driver.WriteDevice(request)
-            time.sleep(0.1)
-            self.driver.WriteDevice(request)
+            self.Apply_Request(request)
 
     def Send_Request(self, request):
         """Only for testing purposes !"""
         self.WaitForOk()
-        self.driver.WriteDevice(request)
-        time.sleep(0.1)
-        self.driver.WriteDevice(request)
+        self.Send(request)
 
     def Try_Power(self, block, color):
         """Only for testing purposes !"""
@@ -268,16 +583,105 @@ class AlienFX_Controller:
         request.Set_Save_Block(block)
         request.Set_Save()
         request.End_Transfert()
-        self.driver.WriteDevice(request)
-        time.sleep(0.1)
-        self.driver.WriteDevice(request)
+        self.Send(request)
+
+    def Set_Diff_Apply(self, diff_apply=True):
+        """Enable or disable the diff apply, the shadow starts empty so the next apply is always complete"""
+        self.diff_apply = diff_apply
+        self.driver.shadow.Invalidate()
+
+    def Apply_Request(self, request):
+        """WaitForOk then send a request.
+        With diff apply, a request that is not saved only carries the loops that differ from the shadow, and is not sent at all if nothing changed."""
+        shadow = self.driver.shadow
+        if request.save or not self.diff_apply:
+            self.WaitForOk()
+            return self.Send(request)
+        split = shadow.Split(request, self.driver.computer)
+        if split is None:
+            self.WaitForOk()
+            return self.Send(request)
+        speed, loops = split
+        if speed is not None and shadow.Key(speed.packet) != shadow.speed:
+            changed = loops
+        else:
+            changed = [(area, loop) for area, loop in loops if not shadow.Same_Loop(area, loop)]
+        shadow.skipped_loops += len(loops) - len(changed)
+        if not changed:
+            return True
+        # no Reset_all here, it would drop the loops the shadow holds as programmed
+        if self.Wait_State() != self.driver.computer.STATE_READY:
+            self.WaitForOk()
+            changed = loops
+        diff = AlienFX_Constructor(self.driver)
+        if speed is not None:
+            diff.append(speed)
+        for area, loop in changed:
+            for r in loop:
+                packet = r.packet[:]
+                if packet[1] != self.driver.computer.COMMAND_LOOP_BLOCK_END:
+                    packet[2] = diff.Id
+                diff.append(Request(None, packet))
+            diff.Id += 0x01
+        diff.End_Transfert()
+        if self.Send(diff):
+            shadow.sent_loops += len(changed)
+            shadow.Update(speed, changed)
+            return True
+        shadow.Invalidate()
+        return False
+
+    def Set_Verified(self, verified=True, max_resends=None, timeout=None):
+        """Enable or disable the verified single send mode"""
+        self.verified = verified
+        if max_resends is not None:
+            self.max_resends = max_resends
+        if timeout is not None:
+            self.verify_timeout = timeout
+        self.sends = 0
+        self.resends = 0
+
+    def Verify_Stats(self):
+        """Return how many requests were sent in verified mode and how many of them needed a resend"""
+        ratio = 0.0
+        if self.sends:
+            ratio = float(self.resends) / self.sends
+        return {"sends": self.sends, "resends": self.resends, "resend_ratio": ratio}
+
+    def Send(self, request):
+        """Write a request to the device.
+        By default the request is written twice with a 0.1s pause, as the controller sometimes misses the first one.
+        In verified mode it is written once, then resent only if the controller answers STATE_UNKNOWN_COMMAND or does not come back ready."""
+        if not self.verified:
+            self.driver.WriteDevice(request)
+            time.sleep(0.1)
+            self.driver.WriteDevice(request)
+            return True
+        self.sends += 1
+        for attempt in range(self.max_resends + 1):
+            if attempt:
+                self.resends += 1
+            self.driver.WriteDevice(request)
+            if self.Wait_State() == self.driver.computer.STATE_READY:
+                return True
+        return False
+
+    def Wait_State(self):
+        """Poll the controller while it is busy, up to verify_timeout seconds, and return the last status byte"""
+        start = time.time()
+        state = self.Read_State()
+        while state == self.driver.computer.STATE_BUSY and time.time() - start < self.verify_timeout:
+            time.sleep(0.005)
+            state = self.Read_State()
+        return state
 
     def WaitForOk(self):
-        self.driver.Take_over()
+        """Reset the controller until it is ready. The reset clears what is displayed, so the shadow is invalidated"""
         self.Get_State()
         request = AlienFX_Constructor(self.driver)
         request.Reset_all()
         self.driver.WriteDevice(request)
+        self.driver.shadow.Invalidate()
         while not self.Get_State():
             request.raz()
             request.Get_Status()
@@ -286,15 +690,19 @@ class AlienFX_Controller:
         return True
 
     def Get_State(self):
-        self.driver.Take_over()
+        return self.Read_State() == self.driver.computer.STATE_READY
+
+    def Read_State(self):
         request = AlienFX_Constructor(self.driver)
         request.Get_Status()
         self.driver.WriteDevice(request)
         msg = self.driver.ReadDevice(request)
-        return msg[0] == self.driver.computer.STATE_READY
+        if msg[0] == self.driver.computer.STATE_UNKNOWN_COMMAND:
+            self.driver.shadow.Invalidate()
+        return msg[0]
 
     def Reset(self, res_cmd):
-        self.driver.Take_over()
+        self.driver.shadow.Invalidate()
         request = AlienFX_Constructor(self.driver)
         while True:
             request.Get_Status()
@@ -319,7 +727,8 @@ class AlienFX_Constructor(list):
     def __init__(self, driver, save=False, block=0x01):
         self.raz()
         self.computer = driver.computer
-        self.void = [self.computer.FILL_BYTE] * self.computer.DATA_LENGTH
+        # the packets are bytearrays, copies of void
+        self.void = bytearray([self.computer.FILL_BYTE] * self.computer.DATA_LENGTH)
         self.Id = 0x01
         self.save = save
         self.block = block
@@ -333,25 +742,20 @@ class AlienFX_Constructor(list):
 
     def Show_Request(self):
         for i in self:
-            packet = ""
-            for j in i.packet:
-                packet += hex(j) + " "
-            print "%s\t:\t%s" % (i.legend, packet)
+            print "%s\t:\t%s" % (Legend(i.packet, self.computer), Hex_Packet(i.packet))
 
     def Set_Speed(self, Speed=0xc800):
         self.Save()
-        cmd = copy(self.void)
-        legend = "Set Speed : %s" % Speed
+        cmd = self.void[:]
         cmd[0] = self.computer.START_BYTE
         cmd[1] = self.computer.COMMAND_SET_SPEED
         cmd[3] = Speed / 256
         cmd[4] = Speed - (Speed / 256) * 256
-        self.append(Request(legend, cmd))
+        self.append(Request(None, cmd))
 
     def Set_Blink_Color(self, Area, Color):
         self.Save()
-        cmd = copy(self.void)
-        legend = "Set Blink Color, Area : %s, Color : r = %s, g = %s, b = %s" % (hex(Area[0] * 65536 + Area[1] * 256 + Area[2]), hex((Color[0] / 16)), hex(Color[0] - (Color[0] / 16) * 16), hex(Color[1] / 16))
+        cmd = self.void[:]
         cmd[0] = self.computer.START_BYTE
         cmd[1] = self.computer.COMMAND_SET_BLINK_COLOR
         cmd[2] = self.Id
@@ -361,15 +765,11 @@ class AlienFX_Constructor(list):
         cmd[6] = Color[0]
         cmd[7] = Color[1]
         # print "constructor : ",cmd
-        self.append(Request(legend, cmd))
+        self.append(Request(None, cmd))
 
     def Set_Morph_Color(self, Area, Color1, Color2):
         self.Save()
-        cmd = copy(self.void)
-        print "Color2 ==== >>> ", Color2
-        legend = "Set Morph Color, Area : %s , Color1 : r = %s, g = %s, b = %s, Color2 : r = %s, g = %s, b = %s" % (hex(Area[0] * 65536 + Area[1] * 256 + Area[2]), hex((Color1[0] / 16)), hex(Color1[0] - (Color1[0] / 16) * 16), hex(Color1[1] / 16), hex(Color2[0] / 16), hex(Color2[0] - (Color2[0] / 16) * 16), hex(Color2[1] / 16))
-        # Color2[1] = Color2[1] / 16 + (Color2[0] - (Color2[0] / 16) * 16)
-        print "Color2after ==== >>> ", Color2
+        cmd = self.void[:]
         Color12 = Color1[1] + Color2[0]
         cmd[0] = self.computer.START_BYTE
         cmd[1] = self.computer.COMMAND_SET_MORPH_COLOR
@@ -381,7 +781,7 @@ class AlienFX_Constructor(list):
         cmd[7] = Color12
         cmd[8] = Color2[1]
         # print "constructor : ",cmd
-        self.append(Request(legend, cmd))
+        self.append(Request(None, cmd))
 
     def Area(self, areas):  # gotta check the power button to understand it ...
         area = 0x000000
@@ -400,8 +800,7 @@ class AlienFX_Constructor(list):
 
     def Set_Color(self, Area, Color, Id=0x01):
         self.Save()
-        cmd = copy(self.void)
-        legend = "Set Fixed Color, Area : %s, Color : r = %s, g = %s, b = %s" % (hex(Area[0] * 65536 + Area[1] * 256 + Area[2]), hex((Color[0] / 16)), hex(Color[0] - (Color[0] - (Color[0] / 16) * 16)), hex(Color[1] + 16))
+        cmd = self.void[:]
         cmd[0] = self.computer.START_BYTE
         cmd[1] = self.computer.COMMAND_SET_COLOR
         cmd[2] = self.Id
@@ -411,102 +810,132 @@ class AlienFX_Constructor(list):
         cmd[6] = Color[0]
         cmd[7] = Color[1]
         # print "constructor : ",cmd
-        self.append(Request(legend, cmd))
+        self.append(Request(None, cmd))
 
     def Set_Save_Block(self, block):
-        cmd = copy(self.void)
-        legend = "Save block : %s" % block
+        cmd = self.void[:]
         cmd[0] = self.computer.START_BYTE
         cmd[1] = self.computer.COMMAND_SAVE_NEXT
         cmd[2] = block
         # print "constructor : ",cmd
-        self.append(Request(legend, cmd))
+        self.append(Request(None, cmd))
 
     def Set_Save(self):
-        cmd = copy(self.void)
-        legend = "Save"
+        cmd = self.void[:]
         cmd[0] = self.computer.START_BYTE
         cmd[1] = self.computer.COMMAND_SAVE
         # print "constructor : ",cmd
-        self.append(Request(legend, cmd))
+        self.append(Request(None, cmd))
 
     def Color(self, color):
-        r = int(color[0:2], 16) / 16
-        g = int(color[2:4], 16) / 16
-        b = int(color[4:6], 16) / 16
-        c = [0x00, 0x00]
-        c[0] = r * 16 + g  # if r = 0xf > r * 16 = 0xf0 > and b = 0xc r * 16 + b 0xfc
-        c[1] = b * 16
-        return c
+        """'RRGGBB' => [r << 4 | g, b << 4] (see AlienFXColors)"""
+        return AlienFXColors.Color(color)
 
     def Color2(self, color):
-        r = int(color[0:2], 16) / 16
-        g = int(color[2:4], 16) / 16
-        b = int(color[4:6], 16) / 16
-        c = [0x00, 0x00]
-        c[0] = r  # if r = 0xf > r * 16 = 0xf0 > and b = 0xc r * 16 + b 0xfc
-        c[1] = g * 16 + b
-        return c
+        """'RRGGBB' => [r, g << 4 | b] (see AlienFXColors)"""
+        return AlienFXColors.Color2(color)
 
     def Get_Status(self):
-        cmd = copy(self.void)
-        legend = "Get Status"
+        cmd = self.void[:]
         cmd[0] = self.computer.START_BYTE
         cmd[1] = self.computer.COMMAND_GET_STATUS
         # print "constructor : ",cmd
-        self.append(Request(legend, cmd))
+        self.append(Request(None, cmd))
 
     def Reset_all(self):
         self.Save()
-        cmd = copy(self.void)
-        legend = "Reset All Lights On"
+        cmd = self.void[:]
         cmd[0] = self.computer.START_BYTE
         cmd[1] = self.computer.COMMAND_RESET
         cmd[2] = self.computer.RESET_ALL_LIGHTS_ON
         # print "constructor : ",cmd
-        self.append(Request(legend, cmd))
+        self.append(Request(None, cmd))
 
     def Reset(self, command):
         if command in [self.computer.RESET_ALL_LIGHTS_ON, self.computer.RESET_ALL_LIGHTS_OFF, self.computer.RESET_TOUCH_CONTROLS, self.computer.RESET_SLEEP_LIGHTS_ON]:
             self.Save()
-            cmd = copy(self.void)
-            legend = "Reset All Lights On"
+            cmd = self.void[:]
             cmd[0] = self.computer.START_BYTE
             cmd[1] = self.computer.COMMAND_RESET
             cmd[2] = command
             # print "constructor : ",cmd
-            self.append(Request(legend, cmd))
+            self.append(Request(None, cmd))
         else:
             print "ERROR : WRONG RESET COMMAND"
 
     def End_Loop(self):
         self.Save()
-        cmd = copy(self.void)
-        legend = "End Loop"
+        cmd = self.void[:]
         cmd[0] = self.computer.START_BYTE
         cmd[1] = self.computer.COMMAND_LOOP_BLOCK_END
         # print "constructor : ",cmd
         # if self.save:
         self.Id += 0x01
-        self.append(Request(legend, cmd))
+        self.append(Request(None, cmd))
 
     def End_Transfert(self):
         self.Save(end=True)
         if not self.save:
-            cmd = copy(self.void)
-            legend = "End Transfert"
+            cmd = self.void[:]
             cmd[0] = self.computer.START_BYTE
             cmd[1] = self.computer.COMMAND_TRANSMIT_EXECUTE
             # print "constructor : ",cmd
-            self.append(Request(legend, cmd))
+            self.append(Request(None, cmd))
 
     def raz(self):
         while len(self) != 0:
             self.pop()
 
 
-class Request:
+def Hex_Packet(packet):
+    return " ".join(["%02x" % b for b in packet])
+
+
+def Nibbles(high, low):
+    return "r = %s, g = %s, b = %s" % (hex(high >> 4), hex(high & 0x0f), hex(low >> 4))
+
+
+def Legend(packet, computer=None):
+    """Human readable description of a packet, only built for the traces.
+    All the models share the command codes, the first one is used when computer is None."""
+    c = computer or AllComputers.computerList.values()[0].computer
+    command = packet[1]
+    area = hex(packet[3] * 65536 + packet[4] * 256 + packet[5])
+    if command == c.COMMAND_SET_COLOR:
+        return "Set Fixed Color, Area : %s, Color : %s" % (area, Nibbles(packet[6], packet[7]))
+    if command == c.COMMAND_SET_BLINK_COLOR:
+        return "Set Blink Color, Area : %s, Color : %s" % (area, Nibbles(packet[6], packet[7]))
+    if command == c.COMMAND_SET_MORPH_COLOR:
+        return "Set Morph Color, Area : %s , Color1 : %s, Color2 : %s" % (area, Nibbles(packet[6], packet[7]), Nibbles(packet[7] << 4 & 0xff | packet[8] >> 4, packet[8] << 4 & 0xff))
+    if command == c.COMMAND_SET_SPEED:
+        return "Set Speed : %s" % (packet[3] * 256 + packet[4])
+    if command == c.COMMAND_SAVE_NEXT:
+        return "Save block : %s" % packet[2]
+    if command == c.COMMAND_SAVE:
+        return "Save"
+    if command == c.COMMAND_GET_STATUS:
+        return "Get Status"
+    if command == c.COMMAND_RESET:
+        resets = dict([(getattr(c, name), name) for name in dir(c) if name.startswith("RESET_")])
+        return "Reset : %s" % resets.get(packet[2], hex(packet[2]))
+    if command == c.COMMAND_LOOP_BLOCK_END:
+        return "End Loop"
+    if command == c.COMMAND_TRANSMIT_EXECUTE:
+        return "End Transfert"
+    return "Unknown command %s" % hex(command)
+
+
+class Request(object):
+    """A packet and its legend, the legend is only built when it is read (see Legend)"""
+
+    __slots__ = ("legend", "packet")
 
     def __init__(self, legend, packet):
-        self.legend = legend
+        if legend is not None:
+            self.legend = legend
         self.packet = packet
+
+    def __getattr__(self, name):
+        if name == "legend":
+            return Legend(self.packet)
+        raise AttributeError(name)
@@ -0,0 +1,207 @@
+# -*- coding: UTF-8 -*-
+
+# This file is part of pyAlienFX.
+#
+#    pyAlienFX is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    pyAlienFX is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with pyAlienFX.  If not, see <http://www.gnu.org/licenses/>.
+#
+#    This work is licensed under the Creative Commons Attribution-NonCommercial-ShareAlike 3.0 Unported License.
+#    To view a copy of this license, visit http://creativecommons.org/licenses/by-nc-sa/3.0/ or send a letter
+#    to Creative Commons, 444 Castro Street, Suite 900, Mountain View, California, 94041, USA.
+#
+
+# Binary protocol of the daemon
+# Every frame is a 12 bytes header followed by the payload :
+#   magic (0xAF) | version | opcode | flags | request id (32 bits) | payload length (32 bits)
+# The daemon answers every request with an OP_REPLY frame carrying the same request id, so a client can send many
+# requests before reading the replies. Device commands are answered in the order they were sent, a request replaced
+# by a newer one included, PING is answered at once.
+# A connection whose first byte is not the magic byte speaks the text protocol (Command,arg,arg|Command,...).
+# A text message starting with TEXT_NO_MERGE is never replaced by a newer one.
+
+import struct
+
+MAGIC = 0xAF
+VERSION = 1
+HEADER = struct.Struct("!BBBBII")
+MAX_PAYLOAD = 1 << 20
+
+FLAG_OK = 0x00
+FLAG_ERROR = 0x01
+FLAG_COALESCED = 0x02  # reply : the request was replaced by a newer one for the same region or block
+FLAG_NO_COALESCE = 0x04  # request : never replace it by a newer one
+TEXT_NO_MERGE = "NOMERGE|"
+
+OP_REPLY = 0x00
+OP_PING = 0x01
+OP_BYE = 0x02
+OP_EXIT = 0x03
+OP_RESTART = 0x04
+OP_COMPUTER = 0x05
+OP_SET_LOOP_CONF = 0x10
+OP_ADD_LOOP_CONF = 0x11
+OP_ADD_SPEED_CONF = 0x12
+OP_END_LOOP_CONF = 0x13
+OP_END_TRANSFERT_CONF = 0x14
+OP_WRITE_CONF = 0x15
+OP_SET_COLOR = 0x20
+OP_SET_COLOR_BLINK = 0x21
+OP_SET_COLOR_MORPH = 0x22
+OP_WAIT_FOR_OK = 0x30
+OP_GET_STATE = 0x31
+OP_RESET = 0x32
+OP_SET_LOOP = 0x40
+OP_SEND_REQUEST = 0x41
+OP_TRY_POWER = 0x42
+
+MODES = ["fixed", "blink", "morph"]
+COMPUTER = struct.Struct("!HH")
+
+# opcode => (controller method, argument struct)
+# Colors travel as 3 bytes (r, g, b) except the packed color of Try_Power, areas as 32 bits integers, Set_Loop and Send_Request carry raw packets
+# Get_State and WaitForOk reply a single boolean byte, COMPUTER replies the vendor and product ids, the other replies are empty
+CALLS = {
+    OP_SET_LOOP_CONF: ("Set_Loop_Conf", struct.Struct("!?B")),
+    OP_ADD_LOOP_CONF: ("Add_Loop_Conf", struct.Struct("!IB3s?3s")),
+    OP_ADD_SPEED_CONF: ("Add_Speed_Conf", struct.Struct("!H")),
+    OP_END_LOOP_CONF: ("End_Loop_Conf", None),
+    OP_END_TRANSFERT_CONF: ("End_Transfert_Conf", None),
+    OP_WRITE_CONF: ("Write_Conf", None),
+    OP_SET_COLOR: ("Set_Color", struct.Struct("!I3s??B")),
+    OP_SET_COLOR_BLINK: ("Set_Color_Blink", struct.Struct("!I3s??B")),
+    OP_SET_COLOR_MORPH: ("Set_Color_Morph", struct.Struct("!I3s3s??B")),
+    OP_WAIT_FOR_OK: ("WaitForOk", None),
+    OP_GET_STATE: ("Get_State", None),
+    OP_RESET: ("Reset", struct.Struct("!B")),
+    OP_SET_LOOP: ("Set_Loop", None),
+    OP_SEND_REQUEST: ("Send_Request", None),
+    OP_TRY_POWER: ("Try_Power", struct.Struct("!BBB"))}
+
+OPCODES = dict([(name, op) for op, (name, fmt) in CALLS.items()])
+CONF_OPCODES = [OP_SET_LOOP_CONF, OP_ADD_LOOP_CONF, OP_ADD_SPEED_CONF, OP_END_LOOP_CONF, OP_END_TRANSFERT_CONF, OP_WRITE_CONF]
+
+
+TEXT = "text"
+BINARY = "binary"
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def Pack_Color(color):
+    """'FF8000' => '\\xff\\x80\\x00'"""
+    return chr(int(color[0:2], 16)) + chr(int(color[2:4], 16)) + chr(int(color[4:6], 16))
+
+
+def Unpack_Color(color):
+    return "%02X%02X%02X" % (ord(color[0]), ord(color[1]), ord(color[2]))
+
+
+def Area(area):
+    if type(area) == str:
+        return int(area, 16)
+    return area
+
+
+def Frame(opcode, request_id, payload="", flags=FLAG_OK):
+    return HEADER.pack(MAGIC, VERSION, opcode, flags, request_id, len(payload)) + payload
+
+
+def Encode_Call(name, request_id, *args):
+    """Build the frame calling the controller method name with args"""
+    op = OPCODES[name]
+    fmt = CALLS[op][1]
+    if op == OP_ADD_LOOP_CONF:
+        area, mode, color1 = args[0], args[1], args[2]
+        color2 = len(args) > 3 and args[3] or None
+        payload = fmt.pack(Area(area), MODES.index(mode), Pack_Color(color1), color2 is not None, Pack_Color(color2 or "000000"))
+    elif op in [OP_SET_COLOR, OP_SET_COLOR_BLINK]:
+        payload = fmt.pack(Area(args[0]), Pack_Color(args[1]), *Defaults(args[2:], [False, False, 0x01]))
+    elif op == OP_SET_COLOR_MORPH:
+        payload = fmt.pack(Area(args[0]), Pack_Color(args[1]), Pack_Color(args[2]), *Defaults(args[3:], [False, False, 0x01]))
+    elif op == OP_SET_LOOP_CONF:
+        payload = fmt.pack(*Defaults(args, [False, 0x01]))
+    elif op == OP_ADD_SPEED_CONF:
+        payload = fmt.pack(*Defaults(args, [0xc800]))
+    elif op == OP_TRY_POWER:
+        payload = fmt.pack(args[0], args[1][0], args[1][1])
+    elif op in [OP_SET_LOOP, OP_SEND_REQUEST]:
+        # an AlienFX_Constructor or a plain list of packets
+        payload = "".join(["".join([chr(b) for b in getattr(packet, "packet", packet)]) for packet in args[0]])
+    elif fmt is not None:
+        payload = fmt.pack(*args)
+    else:
+        payload = ""
+    return Frame(op, request_id, payload)
+
+
+def Set_Flags(frame, flags):
+    return frame[:3] + chr(flags) + frame[4:]
+
+
+def Defaults(args, defaults):
+    return list(args) + defaults[len(args):]
+
+
+def Decode_Call(op, payload, packet_length=9):
+    """Return (controller method, args) of a request frame, colors are returned as hex strings"""
+    if op not in CALLS:
+        raise ProtocolError("Unknown opcode 0x%02x" % op)
+    name, fmt = CALLS[op]
+    if op == OP_ADD_LOOP_CONF:
+        area, mode, color1, has_color2, color2 = fmt.unpack(payload)
+        args = [area, MODES[mode], Unpack_Color(color1), has_color2 and Unpack_Color(color2) or None]
+    elif op in [OP_SET_COLOR, OP_SET_COLOR_BLINK]:
+        area, color, save, apply, block = fmt.unpack(payload)
+        args = [area, Unpack_Color(color), save, apply, block]
+    elif op == OP_SET_COLOR_MORPH:
+        area, color1, color2, save, apply, block = fmt.unpack(payload)
+        args = [area, Unpack_Color(color1), Unpack_Color(color2), save, apply, block]
+    elif op == OP_TRY_POWER:
+        block, c0, c1 = fmt.unpack(payload)
+        args = [block, [c0, c1]]
+    elif op in [OP_SET_LOOP, OP_SEND_REQUEST]:
+        if len(payload) % packet_length:
+            raise ProtocolError("Packets payload of %d bytes" % len(payload))
+        args = [[bytearray(payload[i:i + packet_length]) for i in range(0, len(payload), packet_length)]]
+    elif fmt is not None:
+        args = list(fmt.unpack(payload))
+    else:
+        args = []
+    return name, args
+
+
+class Decoder:
+    """Split a byte stream into frames, whatever the way it was cut by recv"""
+
+    def __init__(self):
+        self.buffer = ""
+
+    def Feed(self, data):
+        """Return the list of complete frames (opcode, flags, request_id, payload) received so far"""
+        self.buffer += data
+        frames = []
+        while len(self.buffer) >= HEADER.size:
+            magic, version, opcode, flags, request_id, length = HEADER.unpack_from(self.buffer)
+            if magic != MAGIC:
+                raise ProtocolError("Bad magic byte 0x%02x" % magic)
+            if version != VERSION:
+                raise ProtocolError("Unsupported protocol version %d" % version)
+            if length > MAX_PAYLOAD:
+                raise ProtocolError("Frame of %d bytes" % length)
+            if len(self.buffer) < HEADER.size + length:
+                break
+            frames.append((opcode, flags, request_id, self.buffer[HEADER.size:HEADER.size + length]))
+            self.buffer = self.buffer[HEADER.size + length:]
+        return frames
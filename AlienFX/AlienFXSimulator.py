@@ -0,0 +1,257 @@
+# -*- coding: UTF-8 -*-
+
+# This file is part of pyAlienFX.
+#
+#    pyAlienFX is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    pyAlienFX is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with pyAlienFX.  If not, see <http://www.gnu.org/licenses/>.
+#
+#    This work is licensed under the Creative Commons Attribution-NonCommercial-ShareAlike 3.0 Unported License.
+#    To view a copy of this license, visit http://creativecommons.org/licenses/by-nc-sa/3.0/ or send a letter
+#    to Creative Commons, 444 Castro Street, Suite 900, Mountain View, California, 94041, USA.
+#
+
+# Software AlienFX controller
+# AlienFX_Simulator is a pyusb backend emulating a 187c:05xx controller, so the engine can run without the hardware :
+#   sim = AlienFX_Simulator(productId=0x0518)
+#   driver = AlienFX_Driver(backend=sim)
+
+import time
+from array import array
+
+import usb.backend
+from usb.core import USBError
+from AlienFX.AlienFXComputers import AllComputers
+
+
+class SimulatedDeviceDescriptor:
+
+    def __init__(self, vendorId, productId):
+        self.bLength = 18
+        self.bDescriptorType = 1
+        self.bcdUSB = 0x0200
+        self.bDeviceClass = 0
+        self.bDeviceSubClass = 0
+        self.bDeviceProtocol = 0
+        self.bMaxPacketSize0 = 8
+        self.idVendor = vendorId
+        self.idProduct = productId
+        self.bcdDevice = 0
+        self.iManufacturer = 0
+        self.iProduct = 0
+        self.iSerialNumber = 0
+        self.bNumConfigurations = 1
+
+
+class SimulatedConfigurationDescriptor:
+
+    def __init__(self):
+        self.bLength = 9
+        self.bDescriptorType = 2
+        self.wTotalLength = 34
+        self.bNumInterfaces = 1
+        self.bConfigurationValue = 1
+        self.iConfiguration = 0
+        self.bmAttributes = 0xa0
+        self.bMaxPower = 50
+
+
+class AlienFX_Simulator(usb.backend.IBackend):
+    """pyusb backend emulating an AlienFX controller.
+    Packets written with the SEND request are parsed with the constants of the emulated model,
+    the status report returned by the READ request follows STATE_READY / STATE_BUSY / STATE_UNKNOWN_COMMAND.
+    latency is added to every transfer, the *_time parameters are how long the controller stays busy after each command,
+    decoys adds other devices on the bus, each descriptor read costing descriptor_cost seconds."""
+
+    SEND_REQUEST_TYPE = 0x21
+    SEND_REQUEST = 0x09
+    READ_REQUEST_TYPE = 0xa1
+    READ_REQUEST = 0x01
+
+    def __init__(self, productId=0x0518, vendorId=0x187c, latency=0.0, command_time=0.0, execute_time=0.0, reset_time=0.0, save_time=0.0, drop_when_busy=True, decoys=0, descriptor_cost=0.0):
+        self.controller = AllComputers.computerIndex[(vendorId, productId)]
+        self.computer = self.controller.computer
+        self.latency = latency
+        self.command_time = command_time
+        self.execute_time = execute_time
+        self.reset_time = reset_time
+        self.save_time = save_time
+        self.drop_when_busy = drop_when_busy
+        self.decoys = decoys
+        self.descriptor_cost = descriptor_cost
+        self.descriptors = [SimulatedDeviceDescriptor(0x1000 + i, i) for i in range(decoys)]
+        self.descriptors.append(SimulatedDeviceDescriptor(vendorId, productId))
+        self.Power_On()
+
+    def Power_On(self):
+        """Put the controller back in its power on state, the saved storage blocks are kept"""
+        c = self.computer
+        self.kernel_driver_active = True
+        self.configuration = 0
+        self.busy_until = 0
+        self.error = False
+        self.report = [c.STATE_READY] + [c.FILL_BYTE] * (c.DATA_LENGTH - 1)
+        self.speed = None
+        self.loop = []
+        self.loops = []
+        self.showing = {}
+        self.lights = c.RESET_ALL_LIGHTS_ON
+        self.save_next = None
+        self.storage = {}
+        if not hasattr(self, "saved"):
+            self.saved = {}
+        self.writes = 0
+        self.reads = 0
+        self.dropped = 0
+        self.unknown_commands = 0
+        self.descriptor_reads = 0
+
+    def Busy(self, duration):
+        if duration:
+            self.busy_until = max(self.busy_until, time.time() + duration)
+
+    def Status(self):
+        if self.error:
+            return self.computer.STATE_UNKNOWN_COMMAND
+        if time.time() < self.busy_until:
+            return self.computer.STATE_BUSY
+        return self.computer.STATE_READY
+
+    def Receive(self, packet):
+        """Parse one packet sent to the controller"""
+        c = self.computer
+        self.writes += 1
+        if len(packet) != c.DATA_LENGTH or packet[0] != c.START_BYTE:
+            self.unknown_commands += 1
+            self.error = True
+            return
+        command = packet[1]
+        if command == c.COMMAND_GET_STATUS:
+            self.report = [self.Status()] + [c.FILL_BYTE] * (c.DATA_LENGTH - 1)
+            self.error = False
+            return
+        if self.drop_when_busy and time.time() < self.busy_until:
+            self.dropped += 1
+            return
+        if self.save_next is not None:
+            self.storage.setdefault(self.save_next, []).append(packet)
+            self.save_next = None
+            return
+        if command in [c.COMMAND_SET_COLOR, c.COMMAND_SET_BLINK_COLOR, c.COMMAND_SET_MORPH_COLOR]:
+            self.loop.append(packet)
+        elif command == c.COMMAND_SET_SPEED:
+            self.speed = packet[3] * 256 + packet[4]
+        elif command == c.COMMAND_LOOP_BLOCK_END:
+            self.loops.append(self.loop)
+            self.loop = []
+        elif command == c.COMMAND_TRANSMIT_EXECUTE:
+            for loop in self.loops:
+                area = 0
+                for p in loop:
+                    area |= p[3] * 65536 + p[4] * 256 + p[5]
+                self.showing[area] = loop
+            self.loops = []
+            self.loop = []
+            self.Busy(self.execute_time)
+        elif command == c.COMMAND_RESET:
+            self.lights = packet[2]
+            self.loops = []
+            self.loop = []
+            self.showing = {}
+            self.Busy(self.reset_time)
+        elif command == c.COMMAND_SAVE_NEXT:
+            self.save_next = packet[2]
+        elif command == c.COMMAND_SAVE:
+            self.saved.update(self.storage)
+            self.storage = {}
+            self.Busy(self.save_time)
+        elif command not in [c.COMMAND_END_STORAGE, c.COMMAND_BATTERY_STATE]:
+            self.unknown_commands += 1
+            self.error = True
+            return
+        self.Busy(self.command_time)
+
+    def Stats(self):
+        return {"writes": self.writes,
+                "reads": self.reads,
+                "dropped": self.dropped,
+                "unknown_commands": self.unknown_commands,
+                "descriptor_reads": self.descriptor_reads}
+
+    # ================================
+    # usb.backend.IBackend
+    # ================================
+    def enumerate_devices(self):
+        return range(len(self.descriptors))
+
+    def get_device_descriptor(self, dev):
+        self.descriptor_reads += 1
+        if self.descriptor_cost:
+            time.sleep(self.descriptor_cost)
+        return self.descriptors[dev]
+
+    def get_configuration_descriptor(self, dev, config):
+        if config != 0:
+            raise IndexError('Invalid configuration index ' + str(config))
+        return SimulatedConfigurationDescriptor()
+
+    def open_device(self, dev):
+        return dev
+
+    def close_device(self, dev_handle):
+        pass
+
+    def set_configuration(self, dev_handle, config_value):
+        if self.kernel_driver_active:
+            raise USBError('Resource busy')
+        self.configuration = config_value
+
+    def get_configuration(self, dev_handle):
+        return self.configuration
+
+    def claim_interface(self, dev_handle, intf):
+        pass
+
+    def release_interface(self, dev_handle, intf):
+        pass
+
+    def is_kernel_driver_active(self, dev_handle, intf):
+        return self.kernel_driver_active
+
+    def detach_kernel_driver(self, dev_handle, intf):
+        if not self.kernel_driver_active:
+            raise USBError('Entity not found')
+        self.kernel_driver_active = False
+
+    def attach_kernel_driver(self, dev_handle, intf):
+        if self.kernel_driver_active:
+            raise USBError('Resource busy')
+        self.kernel_driver_active = True
+
+    def ctrl_transfer(self, dev_handle, bmRequestType, bRequest, wValue, wIndex, data_or_wLength, timeout):
+        if dev_handle != self.decoys:
+            raise USBError('Pipe error')
+        if self.kernel_driver_active:
+            raise USBError('Resource busy')
+        if self.latency:
+            time.sleep(self.latency)
+        if bmRequestType == self.SEND_REQUEST_TYPE and bRequest == self.SEND_REQUEST:
+            self.Receive(list(data_or_wLength))
+            return len(data_or_wLength)
+        elif bmRequestType == self.READ_REQUEST_TYPE and bRequest == self.READ_REQUEST:
+            self.reads += 1
+            return array('B', self.report[:data_or_wLength])
+        raise USBError('Pipe error')
+
+
+def get_backend():
+    return AlienFX_Simulator()
@@ -23,6 +23,7 @@
 
 from AlienFX.AlienFXEngine import *
 from AlienFX.AlienFXConfiguration import *
+from AlienFX.AlienFXClient import Daemon_Controller
 import pygtk
 # pygtk.require("2.0")
 import gtk
@@ -43,15 +44,19 @@ gobject.threads_init()
 class pyAlienFX_GUI():
 
     def __init__(self):
-        print "Initializing Driver  ..."
-        self.driver = AlienFX_Driver()
         print "Initializing Controller ..."
         Deamon = Daemon_Controller()
         conn = Deamon.makeConnection()
         if not conn:
+            # The daemon owns the device when it runs, only load a driver without it
+            print "Initializing Driver  ..."
+            self.driver = AlienFX_Driver()
             self.controller = AlienFX_Controller(self.driver)
+            self.computer = self.driver.computer
         else:
+            self.driver = None
             self.controller = Deamon
+            self.computer = AllComputers.computerIndex[Deamon.Computer()].computer
         self.configuration = AlienFXConfiguration()
         try:
             f = open(os.path.join('.', 'Profiles', "last"), 'r')
@@ -60,7 +65,6 @@ class pyAlienFX_GUI():
             profile = "Default.cfg"
             # self.New_Conf(path=os.path.join('.','Profiles',profile))
         self.actual_conf_file = os.path.join('.', 'Profiles', profile)
-        self.computer = self.driver.computer
         self.selected_area = None
         self.selected_mode = None
         self.selected_color1 = None
@@ -101,23 +105,8 @@ class pyAlienFX_GUI():
         gtk.gdk.threads_leave()
 
     def Check_profiles(self):
-        DB_profiles = {}
-        profiles = os.listdir('./Profiles/')
-        # print profiles
-        for profile in profiles:
-            if ".cfg" not in profile:
-                # print "REMOVED : ",profile
-                profiles.remove(profile)
-        for profile in profiles:
-            try:
-                conf = AlienFXConfiguration()
-                conf.Load(os.path.join('.', 'Profiles', profile))
-                if conf.name not in DB_profiles.keys():
-                    DB_profiles[conf.name] = profile
-            except:
-                # print "REMOVED : ",profile
-                profiles.remove(profile)
-        return DB_profiles
+        """name => file name of the profiles in ./Profiles/, only the new or modified profiles are read (see AlienFXProfileIndex)"""
+        return AlienFXProfileIndex(os.path.join('.', 'Profiles')).Profiles()
 
     # ================================
     # GTK functions!
@@ -670,99 +659,7 @@ class pyAlienFX_GUI():
             self.AlienFX_Configurator_Table.attach(AddConf, int(conf) + 2, int(conf) + 3, l - 1, l, xoptions=gtk.SHRINK, yoptions=gtk.SHRINK)
 
     def Set_Conf(self, Save=False):
-        Id = 0x00
-        self.controller.Set_Loop_Conf(Save, self.computer.BLOCK_LOAD_ON_BOOT)
-        self.controller.Add_Speed_Conf(self.selected_speed)
-        max_conf = 1
-        for zone in self.computer.regions.keys():
-            if not self.computer.regions[zone].power_button:
-                max_conf = max(max_conf, len(self.configuration.area[zone]))
-        tmp = {}
-        sorted_regions = []
-        for r in self.computer.regions.keys():
-            tmp[self.computer.regions[r].regionId] = r
-        stmp = tmp.keys()
-        stmp.sort()
-        for k in stmp:
-            sorted_regions.append(tmp[k])
-        for zone in sorted_regions:
-            if self.computer.regions[zone].power_button:
-                power = zone
-            Id += 0x01
-            if not self.computer.regions[zone].power_button:
-                nb_conf = 0
-                for conf in range(len(self.configuration.area[zone])):
-                    nb_conf += 1
-                    self.controller.Add_Loop_Conf(self.computer.regions[zone].regionId, self.configuration.area[zone][conf].mode, self.configuration.area[zone][conf].color1, self.configuration.area[zone][conf].color2)
-                if len(self.configuration.area[zone]) != 1:
-                    while nb_conf != max_conf:
-                        nb_conf += 1
-                        conf = -1
-                        self.controller.Add_Loop_Conf(self.computer.regions[zone].regionId, self.configuration.area[zone][conf].mode, self.configuration.area[zone][conf].color1, self.configuration.area[zone][conf].color2)
-                self.controller.End_Loop_Conf()
-            # self.controller.Add_Loop_Conf(0x0f869e,"fixed",'000000','000000')
-            # self.controller.End_Loop_Conf()
-        # if not Save:
-            # self.controller.Add_Loop_Conf(self.computer.REGION_ALL_BUT_POWER,"fixed","FF0000","00FF00")
-            # self.controller.End_Loop_Conf()
-        self.controller.End_Transfert_Conf()
-        self.controller.Write_Conf()
-        if Save:
-            color1 = self.configuration.area[power][0].color1
-            color2 = self.configuration.area[power][0].color2
-            area = self.computer.regions[power].regionId
-            # Block = 0x02 ! Sleeping Mode !!!!!
-
-            self.controller.Set_Loop_Conf(Save, self.computer.BLOCK_STANDBY)
-            self.controller.Add_Loop_Conf(area, "morph", color1, '000000')
-            self.controller.Add_Loop_Conf(area, "morph", '000000', color1)
-            self.controller.End_Loop_Conf()
-            self.controller.Add_Loop_Conf(self.computer.REGION_ALL_BUT_POWER, "fixed", '000000')
-            self.controller.End_Loop_Conf()
-            self.controller.End_Transfert_Conf()
-            self.controller.Write_Conf()
-
-            # Block = 0x05 ! A/C powered !
-            self.controller.Set_Loop_Conf(Save, self.computer.BLOCK_AC_POWER)
-            self.controller.Add_Loop_Conf(area, "fixed", color1)
-            self.controller.End_Loop_Conf()
-            self.controller.End_Transfert_Conf()
-            self.controller.Write_Conf()
-
-            # Block = 0x06 ! Charging !
-            self.controller.Set_Loop_Conf(Save, self.computer.BLOCK_CHARGING)
-            self.controller.Add_Loop_Conf(area, "morph", color1, color2)
-            self.controller.Add_Loop_Conf(area, "morph", color2, color1)
-            self.controller.End_Loop_Conf()
-            self.controller.End_Transfert_Conf()
-            self.controller.Write_Conf()
-
-            # Block 0x07 ! Battery Sleeping !
-            self.controller.Set_Loop_Conf(Save, self.computer.BLOCK_BATT_SLEEPING)
-            self.controller.Add_Loop_Conf(area, "morph", color2, '000000')
-            self.controller.Add_Loop_Conf(area, "morph", '000000', color2)
-            self.controller.End_Loop_Conf()
-            self.controller.Add_Loop_Conf(self.computer.REGION_ALL_BUT_POWER, "fixed", '000000')
-            self.controller.End_Loop_Conf()
-            self.controller.End_Transfert_Conf()
-            self.controller.Write_Conf()
-
-            # Block 0x08 ! On Battery !
-            self.controller.Set_Loop_Conf(Save, self.computer.BLOCK_BAT_POWER)
-            self.controller.Add_Loop_Conf(area, "fixed", color2)
-            self.controller.End_Loop_Conf()
-            self.controller.End_Transfert_Conf()
-            self.controller.Write_Conf()
-
-            # Block 0x09 ! Critical When Sleeping ...
-            self.controller.Set_Loop_Conf(Save, self.computer.BLOCK_BATT_CRITICAL)
-            self.controller.Add_Loop_Conf(area, "blink", color2)
-            self.controller.End_Loop_Conf()
-            self.controller.End_Transfert_Conf()
-            self.controller.Write_Conf()
-
-            # Applying after all the saving !
-            self.Set_Conf()
+        self.configuration.Apply(self.controller, self.computer, self.selected_speed, Save)
         self.configuration.Save(path="default.cfg")
 
     def Select_Zone(self, zone):
@@ -1161,120 +1058,6 @@ class Image_DB:
         self.AlienFX_Cadre_0_Bottom_Right = './images/carde0_bottom_right.png'
 
 
-class Daemon_Controller:
-    def __init__(self):
-        self.HOST = 'localhost'
-        self.PORT = 25436
-        self.ADDR = (self.HOST, self.PORT)
-        self.sock = None
-        self.BUFSIZE = 4096
-        self.request = []
-
-    def makeConnection(self):
-        self.sock = socket(AF_INET, SOCK_STREAM)
-        try:
-            self.sock.connect(self.ADDR)
-            self.sock.settimeout(1)
-            return True
-        except error, e:
-            if "[Errno 111]" in str(e):
-                print "the Deamon is disconnected ... "
-            else:
-                print e
-            print "Trying to load the driver manually"
-            return False
-
-    def sendCmd(self, cmd):
-        self.sock.send(cmd)
-
-    def getResults(self):
-        data = self.sock.recv(self.BUFSIZE)
-        return data
-
-    def Set_Loop(self, action):
-        packet = ["Set_Loop", str(action)]
-        self.request.append(packet)
-
-    def Set_Loop_Conf(self, Save=False, block=0x01):
-        packet = ["Set_Loop_Conf", str(Save), str(block)]
-        self.request.append(packet)
-
-    def Add_Loop_Conf(self, area, mode, color1, color2=None):
-        packet = ["Add_Loop_Conf", str(hex(area)).replace('0x', ''), str(mode), str(color1), str(color2)]
-        self.request.append(packet)
-
-    def Add_Speed_Conf(self, speed=0xc800):
-        packet = ["Add_Speed_Conf", str(speed)]
-        self.request.append(packet)
-
-    def End_Loop_Conf(self):
-        packet = ["End_Loop_Conf", ""]
-        self.request.append(packet)
-
-    def End_Transfert_Conf(self):
-        packet = ["End_Transfert_Conf", ""]
-        self.request.append(packet)
-
-    def Write_Conf(self):
-        packet = ["Write_Conf", ""]
-        self.request.append(packet)
-        self.Send_Packet()
-
-    def Set_Color(self, Area, Color, Save=False, Apply=False, block=0x01):
-        packet = ["Set_Color", str(hex(Area)).replace('0x', ''), str(Color), str(Save), str(Apply), str(block)]
-        self.request.append(packet)
-        self.Send_Packet()
-
-    def Set_Color_Blink(self, Area, Color, Save=False, Apply=False, block=0x01):
-        packet = ["Set_Color_Blink", str(hex(Area)).replace('0x', ''), str(Color), str(Save), str(Apply), str(block)]
-        self.request.append(packet)
-        self.Send_Packet()
-
-    def Set_Color_Morph(self, Area, Color1, Color2, Save=False, Apply=False, block=0x01):
-        packet = ["Set_Color_Morph", str(hex(Area)).replace('0x', ''), str(Color1), str(Color2), str(Save), str(Apply), str(block)]
-        self.request.append(packet)
-        self.Send_Packet()
-
-    def WaitForOk(self):
-        packet = ["WaitForOk", ""]
-        self.request.append(packet)
-
-    def Get_State(self):
-        packet = ["Get_State", ""]
-        self.request.append(packet)
-
-    def Reset(self, res_cmd):
-        packet = ["Reset", str(res_cmd)]
-        self.request.append(packet)
-
-    def Send_Packet(self):
-        tmp = []
-        for el in self.request:
-            tmp.append(",".join(el))
-        cmd = "|".join(tmp)
-        self.sendCmd(cmd)
-        self.RAZ()
-        resp = self.getResults()
-        print resp
-        if resp != "executed":
-            raise ValueError("Error while communicating with the daemon !")
-
-    def Ping(self):
-        print "Sending Ping"
-        self.sendCmd("PING")
-        print "Sent ..."
-        pong = self.getResults()
-        print "Server Answer : ", pong
-        if pong != "PONG":
-            return False
-        return True
-
-    def RAZ(self):
-        self.request = []
-
-    def Bye(self):
-        self.sendCmd("BYE")
-
 if __name__ == "__main__":
     gui = pyAlienFX_GUI()
     gui.main()
@@ -0,0 +1,788 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+
+# This file is part of pyAlienFX.
+#
+#    pyAlienFX is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    pyAlienFX is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with pyAlienFX.  If not, see <http://www.gnu.org/licenses/>.
+#
+#    This work is licensed under the Creative Commons Attribution-NonCommercial-ShareAlike 3.0 Unported License.
+#    To view a copy of this license, visit http://creativecommons.org/licenses/by-nc-sa/3.0/ or send a letter
+#    to Creative Commons, 444 Castro Street, Suite 900, Mountain View, California, 94041, USA.
+#
+
+# PyAlienFX benchmarks
+# Every benchmark runs without any AlienFX hardware
+# Usage : pyAlienFX_bench.py [benchmark] [options]
+
+import os
+import sys
+import time
+import argparse
+
+import usb.core
+from AlienFX.AlienFXEngine import *
+from AlienFX.AlienFXSimulator import AlienFX_Simulator
+
+
+def timeit(func, repeat):
+    """Run func repeat times and return the best time in seconds"""
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        func()
+        t = time.time() - start
+        if best is None or t < best:
+            best = t
+    return best
+
+
+def simulated_driver(sim):
+    """Build a quiet driver and controller on top of a simulated backend"""
+    driver = AlienFX_Driver(backend=sim)
+    driver.debug = False
+    return driver, AlienFX_Controller(driver)
+
+
+def bench_discovery(args):
+    """Compare one usb.core.find per known computer with the single pass Find_Controllers"""
+    bus = AlienFX_Simulator(decoys=args.devices, descriptor_cost=args.read_cost)
+
+    def old():
+        for computer in AllComputers.computerList.values():
+            usb.core.find(idVendor=computer.vendorId, idProduct=computer.productId, backend=bus)
+
+    def new():
+        Find_Controllers(bus)
+
+    bus.descriptor_reads = 0
+    t_old = timeit(old, args.repeat)
+    reads_old = bus.descriptor_reads / args.repeat
+    bus.descriptor_reads = 0
+    t_new = timeit(new, args.repeat)
+    reads_new = bus.descriptor_reads / args.repeat
+    print "Discovery on a bus of %d devices (%d known computers)" % (args.devices + 1, len(AllComputers.computerList))
+    print "  usb.core.find per computer : %8.2f ms, %d descriptor reads" % (t_old * 1000, reads_old)
+    print "  Find_Controllers           : %8.2f ms, %d descriptor reads" % (t_new * 1000, reads_new)
+    print "  speedup                    : %8.1fx" % (t_old / t_new)
+
+
+def bench_apply(args):
+    """Apply a color on a simulated controller with each pacing and send mode"""
+    print "Set_Color on a simulated controller (%.1f ms per transfer, %.1f ms busy after execute)" % (args.latency * 1000, args.busy * 1000)
+    for pacing in ["fixed", "status"]:
+        for verified in [False, True]:
+            sim = AlienFX_Simulator(latency=args.latency, execute_time=args.busy)
+            driver, controller = simulated_driver(sim)
+            driver.Set_Pacing(pacing)
+            controller.Set_Verified(verified)
+            t = timeit(lambda: controller.Set_Color(0x0001, "FF0000"), args.repeat)
+            stats = driver.Pacing_Stats()
+            print "  pacing %-6s verified %-5s : %8.2f ms, waiting %6.1f%% of the time, %d packets dropped by the controller" % (
+                pacing, verified, t * 1000, 100 * stats["wait_time"] / (stats["wait_time"] + stats["send_time"]), sim.dropped)
+
+
+def bench_diff(args):
+    """Re-apply a full configuration after changing a single region, with and without the diff apply"""
+    for diff_apply in [False, True]:
+        sim = AlienFX_Simulator(latency=args.latency)
+        driver, controller = simulated_driver(sim)
+        driver.Set_Pacing("status")
+        controller.Set_Verified(True)
+        controller.Set_Diff_Apply(diff_apply)
+        regions = sorted(driver.computer.regions.values(), key=lambda r: r.regionId)
+        colors = dict([(r.name, "0000FF") for r in regions])
+
+        def apply():
+            controller.Set_Loop_Conf(False, driver.computer.BLOCK_LOAD_ON_BOOT)
+            controller.Add_Speed_Conf(0xc800)
+            for r in regions:
+                controller.Add_Loop_Conf(r.regionId, "fixed", colors[r.name])
+                controller.End_Loop_Conf()
+            controller.End_Transfert_Conf()
+            controller.Write_Conf()
+
+        apply()
+        colors[regions[0].name] = "FF0000"
+        before = sim.writes
+        start = time.time()
+        apply()
+        t = time.time() - start
+        print "  diff apply %-5s : %d regions, one changed, %3d packets written in %7.2f ms" % (diff_apply, len(regions), sim.writes - before, t * 1000)
+        # a reset clears the display : the next diff must send every area again
+        controller.WaitForOk()
+        colors[regions[0].name] = "00FF00"
+        apply()
+        shown = set()
+        for area in sim.showing:
+            shown.update([r.regionId for r in regions if r.regionId & area])
+        assert shown == set([r.regionId for r in regions]), "areas lost after a reset : %s" % sorted(set([r.regionId for r in regions]) - shown)
+        print "  diff apply %-5s : reset then one changed, %d regions shown" % (diff_apply, len(shown))
+
+
+def record_profile(controller, computer, steps):
+    """Record a profile with steps loop entries per region, like pyAlienFX_GUI.Set_Conf does"""
+    colors = ["FF0000", "00FF00", "0000FF", "FFFFFF"]
+    controller.Set_Loop_Conf(False, computer.BLOCK_LOAD_ON_BOOT)
+    controller.Add_Speed_Conf(0xc800)
+    for region in sorted(computer.regions.values(), key=lambda r: r.regionId):
+        for i in range(steps):
+            controller.Add_Loop_Conf(region.regionId, "morph", colors[i % 4], colors[(i + 1) % 4])
+        controller.End_Loop_Conf()
+    controller.End_Transfert_Conf()
+
+
+def bench_compile(args):
+    """Compile the same profile again, without and with the compiled configuration cache"""
+    sim = AlienFX_Simulator()
+    driver, controller = simulated_driver(sim)
+    record_profile(controller, driver.computer, args.steps)
+    conf = controller.conf
+    n = 100
+    t_compile = timeit(lambda: [controller.Compile_Conf(conf) for i in range(n)], args.repeat) / n
+    key = controller.compiled.Key(driver.computer.name, conf)
+    controller.compiled.Put(key, controller.Compile_Conf(conf))
+    t_cached = timeit(lambda: [controller.compiled.Get(controller.compiled.Key(driver.computer.name, conf)) for i in range(n)], args.repeat) / n
+    print "Profile of %d regions x %d steps (%d packets)" % (len(driver.computer.regions), args.steps, len(controller.Compile_Conf(conf)))
+    print "  compile      : %8.3f ms" % (t_compile * 1000)
+    print "  cache lookup : %8.3f ms" % (t_cached * 1000)
+
+
+def start_daemon(args, addr=("localhost", 0), coalesce=True, pacing="status", verified=True):
+    """Run a daemon in a thread, on a free port or a unix socket path, with a simulated controller"""
+    import threading
+    import pyAlienFX_daemon
+    sim = AlienFX_Simulator(latency=args.latency)
+    driver = AlienFX_Driver(backend=sim)
+    driver.debug = False
+    driver.Set_Pacing(pacing)
+    server = pyAlienFX_daemon.ServCmd(driver, addr, coalesce=coalesce)
+    server.controller.Set_Verified(verified)
+    loop = threading.Thread(target=server.run)
+    loop.daemon = True
+    loop.start()
+    return server, loop
+
+
+def stop_daemon(server, loop):
+    import socket
+    if type(server.addr) == str:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(server.addr)
+    else:
+        sock = socket.create_connection(server.addr)
+    sock.send("EXIT")
+    loop.join()
+    server.owner.join()
+
+
+def bench_daemon(args):
+    """Commands per second and latency of the daemon with many concurrent clients on a simulated controller"""
+    import socket
+    import threading
+    server, loop = start_daemon(args)
+    latencies = []
+
+    def client(n):
+        sock = socket.create_connection(server.addr)
+        for i in range(args.commands):
+            start = time.time()
+            sock.send("Set_Color,%x,%02x00FF,False,False,1" % (0x0001 << (n % 8), i % 256))
+            sock.recv(4096)
+            latencies.append(time.time() - start)
+        sock.send("BYE")
+        sock.close()
+
+    clients = [threading.Thread(target=client, args=(n,)) for n in range(args.clients)]
+    start = time.time()
+    for c in clients:
+        c.start()
+    for c in clients:
+        c.join()
+    elapsed = time.time() - start
+    stop_daemon(server, loop)
+    latencies.sort()
+    print "%d clients x %d Set_Color on a simulated controller (%.1f ms per transfer)" % (args.clients, args.commands, args.latency * 1000)
+    print "  commands per second : %8.1f" % (len(latencies) / elapsed)
+    print "  p50 latency         : %8.2f ms" % (latencies[len(latencies) / 2] * 1000)
+    print "  p99 latency         : %8.2f ms" % (latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000)
+
+
+def bench_protocol(args):
+    """Profiles and colors written through Daemon_Controller with the text protocol and the binary one, with and without pipelining"""
+    from AlienFX.AlienFXClient import Daemon_Controller
+    from AlienFX import AlienFXProtocol
+    server, loop = start_daemon(args)
+    # no pacing gap, so the time left is the wire and the daemon rather than the controller
+    server.driver.Set_Pacing("status", min_gap=0)
+    print "%d profiles of %d regions x %d steps, then %d Set_Color, written through the daemon" % (args.commands, len(server.computer.regions), args.steps, args.commands)
+    for protocol, window in [(AlienFXProtocol.TEXT, 1), (AlienFXProtocol.BINARY, 1), (AlienFXProtocol.BINARY, args.commands)]:
+        client = Daemon_Controller(protocol, window, timeout=None)
+        client.ADDR = server.addr
+        client.makeConnection()
+
+        def profiles():
+            for i in range(args.commands):
+                record_profile(client, server.computer, args.steps)
+                client.Write_Conf()
+            if client.Binary():
+                client.Collect()
+
+        def colors():
+            for i in range(args.commands):
+                client.Set_Color(0x0001 << (i % 8), "%02x00FF" % (i % 256))
+            if client.Binary():
+                client.Collect()
+        stdout, sys.stdout = sys.stdout, open(os.devnull, "w")
+        try:
+            t_profiles = timeit(profiles, args.repeat)
+            t_colors = timeit(colors, args.repeat)
+        finally:
+            sys.stdout = stdout
+        client.Bye()
+        print "  %-6s window %3d : %8.2f ms per profile, %8.2f ms per Set_Color" % (protocol, window, t_profiles * 1000 / args.commands, t_colors * 1000 / args.commands)
+    stop_daemon(server, loop)
+
+
+def bench_transport(args):
+    """Round trip latency of the daemon over TCP and over a unix socket"""
+    import tempfile
+    from AlienFX.AlienFXClient import Daemon_Controller
+    from AlienFX import AlienFXProtocol
+    n = args.commands * 100
+    path = os.path.join(tempfile.mkdtemp(), "pyAlienFX.sock")
+    print "%d round trips per transport, PING answered by the event loop, Get_State by the controller" % n
+    for transport, addr in [("tcp", ("localhost", 0)), ("unix", path)]:
+        server, loop = start_daemon(args, addr)
+        server.driver.Set_Pacing("status", min_gap=0)
+        for protocol in [AlienFXProtocol.TEXT, AlienFXProtocol.BINARY]:
+            if transport == "unix":
+                client = Daemon_Controller(protocol, path=server.addr)
+            else:
+                client = Daemon_Controller(protocol)
+                client.ADDR = server.addr
+            client.makeConnection()
+            stdout, sys.stdout = sys.stdout, open(os.devnull, "w")
+            try:
+                pings = []
+                for i in range(n):
+                    start = time.time()
+                    client.Ping()
+                    pings.append(time.time() - start)
+                states = []
+                for i in range(n / 10):
+                    start = time.time()
+                    client.Get_State()
+                    client.Send_Packet()
+                    states.append(time.time() - start)
+            finally:
+                sys.stdout = stdout
+            client.Bye()
+            pings.sort()
+            states.sort()
+            print "  %-4s %-6s : PING p50 %7.1f us p99 %7.1f us, Get_State p50 %7.1f us" % (
+                transport, protocol, pings[n / 2] * 1e6, pings[int(n * 0.99)] * 1e6, states[len(states) / 2] * 1e6)
+        stop_daemon(server, loop)
+    os.rmdir(os.path.dirname(path))
+
+
+def bench_coalesce(args):
+    """A burst of Set_Color on a few regions, pipelined through the daemon, with and without coalescing"""
+    import socket
+    from AlienFX.AlienFXClient import Daemon_Controller
+    from AlienFX import AlienFXProtocol
+    n = args.commands * 20
+    regions = [0x0001, 0x0002, 0x0004, 0x0008]
+    print "%d Set_Color on %d regions sent at once (%.1f ms per transfer)" % (n, len(regions), args.latency * 1000)
+    for coalesce in [False, True]:
+        server, loop = start_daemon(args, coalesce=coalesce)
+        client = Daemon_Controller(AlienFXProtocol.BINARY, n, timeout=None)
+        client.ADDR = server.addr
+        client.makeConnection()
+        stdout, sys.stdout = sys.stdout, open(os.devnull, "w")
+        try:
+            start = time.time()
+            for i in range(n):
+                client.Set_Color(regions[i % len(regions)], "%02x00FF" % (i % 256))
+            client.Collect()
+            t = time.time() - start
+        finally:
+            sys.stdout = stdout
+        client.Bye()
+        stats = server.Stats()
+        stop_daemon(server, loop)
+        print "  coalesce %-5s : last color shown after %8.1f ms, %4d commands dropped" % (coalesce, t * 1000, stats["dropped"])
+    # the replaced requests are answered in the order they were sent, with the others
+    server, loop = start_daemon(args)
+    sock = socket.create_connection(server.addr)
+    calls = [(0x0001, "FF0000"), (0x0002, "00FF00"), (0x0001, "0000FF")] * 4
+    sock.sendall("".join([AlienFXProtocol.Encode_Call("Set_Color", i + 1, area, color, False, False, 0x01) for i, (area, color) in enumerate(calls)]))
+    decoder = AlienFXProtocol.Decoder()
+    replies = []
+    while len(replies) < len(calls):
+        replies.extend(decoder.Feed(sock.recv(4096)))
+    sock.close()
+    stop_daemon(server, loop)
+    order = [request_id for opcode, flags, request_id, payload in replies]
+    coalesced = len([f for o, f, r, p in replies if f & AlienFXProtocol.FLAG_COALESCED])
+    assert order == range(1, len(calls) + 1), "replies out of order : %s" % order
+    print "  pipelined       : %d replies in order, %d of them coalesced" % (len(order), coalesced)
+
+
+def bench_animation(args):
+    """Software effects rendered on a simulated controller at the target frame rate"""
+    from AlienFX import AlienFXAnimation
+    print "Effects at %.0f fps for %.1f s (%.1f ms per transfer, %.1f ms busy after execute)" % (args.fps, args.duration, args.latency * 1000, args.busy * 1000)
+    for name in ["Breathing", "Rainbow", "Wave", "Gradient"]:
+        sim = AlienFX_Simulator(latency=args.latency, execute_time=args.busy)
+        driver, controller = simulated_driver(sim)
+        driver.Set_Pacing("status")
+        areas = AlienFXAnimation.Animation_Areas(driver.computer)
+        if name == "Gradient":
+            effect = AlienFXAnimation.Gradient(areas, period=2.0)
+        else:
+            effect = getattr(AlienFXAnimation, name)(areas)
+        animator = AlienFXAnimation.AlienFX_Animator(controller, effect, args.fps)
+        animator.Run(args.duration)
+        stats = animator.Stats()
+        print "  %-9s : %5.1f fps, jitter %5.2f ms, p99 late %5.2f ms, %3d dropped, %3d busy skips, %4.1f of %d areas per sent frame" % (
+            name, stats["fps"], stats["jitter"] * 1000, stats["p99_lateness"] * 1000, stats["dropped"], stats["busy_skips"], stats["areas_per_frame"], len(areas))
+
+
+def legacy_color(color):
+    """AlienFX_Constructor.Color before AlienFXColors"""
+    r = int(color[0:2], 16) / 16
+    g = int(color[2:4], 16) / 16
+    b = int(color[4:6], 16) / 16
+    return [r * 16 + g, b * 16]
+
+
+def bench_colors(args):
+    """Pack lists of hex colors with the former AlienFX_Constructor.Color, the scalar codec and Encode_Color"""
+    import random
+    from AlienFX import AlienFXColors
+    numpy = AlienFXColors.Numpy()
+    print "Color packing, NumPy %s" % (numpy is not None and numpy.__version__ or "not installed")
+    for n in [12, 100, 1000, 10000]:
+        colors = ["%06X" % random.randint(0, 0xffffff) for i in range(n)]
+        assert AlienFXColors.Encode_Color(colors) == [legacy_color(c) for c in colors]
+        t_legacy = timeit(lambda: [legacy_color(c) for c in colors], args.repeat)
+        t_scalar = timeit(lambda: [AlienFXColors.Color(c) for c in colors], args.repeat)
+        t_encode = timeit(lambda: AlienFXColors.Encode_Color(colors), args.repeat)
+        print "  %5d colors : legacy %8.1f us, scalar %8.1f us, Encode_Color %8.1f us (%.1fx)" % (
+            n, t_legacy * 1e6, t_scalar * 1e6, t_encode * 1e6, t_legacy / t_encode)
+
+
+def bench_legend(args):
+    """Build and send Set_Color commands with the driver defaults, stdout going to /dev/null"""
+    n = args.commands * 100
+    sim = AlienFX_Simulator()
+    driver = AlienFX_Driver(backend=sim)
+    driver.fixed_gap = 0
+    constructor = AlienFX_Constructor(driver)
+    area = constructor.Area(0x0001)
+    color = constructor.Color("FF8000")
+
+    def build():
+        constructor.raz()
+        for i in range(n):
+            constructor.Set_Color(area, color)
+
+    def send():
+        build()
+        driver.WriteDevice(constructor)
+
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    try:
+        t_build = timeit(build, args.repeat)
+        t_send = timeit(send, args.repeat)
+    finally:
+        sys.stdout = stdout
+    print "%d Set_Color, driver debug %s" % (n, driver.debug)
+    print "  build          : %9.0f commands/s" % (n / t_build)
+    print "  build and send : %9.0f commands/s" % (n / t_send)
+
+
+def bench_capture(args):
+    """Send Set_Color commands on the simulator without capture, with an in memory and with a mapped capture"""
+    from AlienFX import AlienFXCapture
+    n = args.commands * 100
+    sim = AlienFX_Simulator()
+    driver, controller = simulated_driver(sim)
+    driver.fixed_gap = 0
+    constructor = AlienFX_Constructor(driver)
+    for i in range(n):
+        constructor.Set_Color(constructor.Area(0x0001), constructor.Color("FF8000"))
+    path = "/tmp/pyAlienFX_bench.capture"
+    print "%d Set_Color sent on the simulator" % n
+    for name, capture in [("none", None), ("memory", AlienFXCapture.AlienFX_Capture(4096)), ("mmap", AlienFXCapture.AlienFX_Capture(4096, path))]:
+        driver.Set_Capture(capture)
+        t = timeit(lambda: driver.WriteDevice(constructor), args.repeat)
+        print "  capture %-6s : %6.2f us per packet" % (name, t * 1e6 / n)
+    # closing the capture stops it, the transfers go on without it
+    capture.Close()
+    driver.WriteDevice(constructor)
+    assert driver.capture is None
+    os.remove(path)
+
+
+def bench_disassemble(args):
+    """Decode a long stream of recorded profiles back into commands and loops"""
+    from AlienFX.AlienFXDisassembler import AlienFX_Disassembler
+    sim = AlienFX_Simulator()
+    driver, controller = simulated_driver(sim)
+    record_profile(controller, driver.computer, args.steps)
+    profile = [r.packet for r in controller.Compile_Conf(controller.conf)]
+    packets = profile * max(1, args.commands * 100000 / len(profile))
+    disassembler = AlienFX_Disassembler(driver.computer)
+
+    def commands():
+        for c in disassembler.Commands(packets):
+            pass
+
+    def program():
+        for c in disassembler.Program(packets):
+            pass
+
+    print "%d packets decoded" % len(packets)
+    for name, func in [("Commands", commands), ("Program", program)]:
+        t = timeit(func, args.repeat)
+        print "  %-8s : %8.0f packets/s" % (name, len(packets) / t)
+
+
+def profile_library(directory, count, steps, model="M17XR3"):
+    """Write count text profiles of steps entries per region in directory, return their paths"""
+    from AlienFX.AlienFXConfiguration import AlienFXConfiguration
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    computer = AllComputers.computerList[model]
+    colors = ["FF0000", "00FF00", "0000FF", "FFFFFF"]
+    paths = []
+    for n in range(count):
+        conf = AlienFXConfiguration()
+        conf.Create("Profile %d" % n, computer.name, 0xc800, os.path.join(directory, "profile%d.cfg" % n))
+        for region in computer.computer.regions.values():
+            conf.Add(region)
+            for i in range(steps):
+                conf.area[region.name].append("morph", colors[(n + i) % 4], colors[(n + i + 1) % 4])
+        conf.Save()
+        paths.append(conf.path)
+    return paths
+
+
+def bench_profiles(args):
+    """Load and compare a library of profiles in the text and in the compiled format"""
+    import shutil
+    import tempfile
+    from AlienFX.AlienFXConfiguration import AlienFXConfiguration, COMPILED_EXTENSION
+    directory = tempfile.mkdtemp()
+    try:
+        texts = profile_library(directory, args.profiles, args.steps)
+        compiled = []
+        for path in texts:
+            conf = AlienFXConfiguration()
+            conf.Load(path)
+            conf.Save(path.replace(".cfg", COMPILED_EXTENSION))
+            compiled.append(conf.path)
+        print "%d profiles, %d regions x %d steps" % (len(texts), len(AllComputers.computerList["M17XR3"].computer.regions), args.steps)
+        for name, paths in [("text", texts), ("compiled", compiled)]:
+            confs = []
+
+            def load():
+                del confs[:]
+                for path in paths:
+                    conf = AlienFXConfiguration()
+                    conf.Load(path)
+                    confs.append(conf)
+
+            t_load = timeit(load, args.repeat)
+            t_check = timeit(lambda: [conf.Check(path) for conf, path in zip(confs, paths)], args.repeat)
+            assert all([conf.Check(path) for conf, path in zip(confs, paths)])
+            size = sum([os.path.getsize(path) for path in paths])
+            print "  %-8s : load %8.2f ms, compare %8.2f ms, %8d bytes" % (name, t_load * 1000, t_check * 1000, size)
+    finally:
+        shutil.rmtree(directory)
+
+
+def bench_index(args):
+    """List a profile library like pyAlienFX_GUI.Check_profiles, loading every profile and with the profile index"""
+    import shutil
+    import tempfile
+    from AlienFX.AlienFXConfiguration import AlienFXConfiguration, AlienFXProfileIndex, COMPILED_EXTENSION
+    directory = tempfile.mkdtemp()
+    try:
+        paths = profile_library(directory, args.profiles, args.steps)
+
+        def load_all():
+            profiles = {}
+            for f in os.listdir(directory):
+                if not f.endswith((".cfg", COMPILED_EXTENSION)):
+                    continue
+                conf = AlienFXConfiguration()
+                conf.Load(os.path.join(directory, f))
+                profiles.setdefault(conf.name, f)
+            return profiles
+
+        t_load = timeit(load_all, args.repeat)
+        start = time.time()
+        index = AlienFXProfileIndex(directory)
+        assert index.Profiles() == load_all()
+        t_cold = time.time() - start
+        t_warm = timeit(lambda: AlienFXProfileIndex(directory).Profiles(), args.repeat)
+        os.utime(paths[0], (time.time() + 10, time.time() + 10))
+        index = AlienFXProfileIndex(directory)
+        start = time.time()
+        index.Profiles()
+        t_touched = time.time() - start
+        print "%d profiles" % len(paths)
+        print "  load every profile    : %8.2f ms" % (t_load * 1000)
+        print "  index, first run      : %8.2f ms" % (t_cold * 1000)
+        print "  index, nothing new    : %8.2f ms" % (t_warm * 1000)
+        print "  index, 1 file touched : %8.2f ms, %d profiles loaded" % (t_touched * 1000, index.loads)
+    finally:
+        shutil.rmtree(directory)
+
+
+def bench_dirty(args):
+    """Unsaved changes check and save of an unchanged and of an edited profile"""
+    import shutil
+    import tempfile
+    from AlienFX.AlienFXConfiguration import AlienFXConfiguration
+    directory = tempfile.mkdtemp()
+    try:
+        path = profile_library(directory, 1, args.steps)[0]
+        conf = AlienFXConfiguration()
+        conf.Load(path)
+        area = sorted(conf.area.keys())[0]
+        n = 1000
+        t_check = timeit(lambda: [conf.Check(path) for i in range(n)], args.repeat) / n
+        t_save = timeit(lambda: [conf.Save(path) for i in range(n)], args.repeat) / n
+
+        def edit_check():
+            for i in range(n):
+                conf.area[area].update_line(0, color1="%06X" % i)
+                conf.Check(path)
+
+        def edit_save():
+            for i in range(n / 10):
+                conf.area[area].update_line(0, color1="%06X" % i)
+                conf.Save(path)
+
+        t_edit_check = timeit(edit_check, args.repeat) / n
+        t_edit_save = timeit(edit_save, args.repeat) / (n / 10)
+        print "Profile of %d regions x %d steps" % (len(conf.area), args.steps)
+        print "  check, unchanged   : %8.1f us" % (t_check * 1e6)
+        print "  save, unchanged    : %8.1f us" % (t_save * 1e6)
+        print "  edit and check     : %8.1f us" % (t_edit_check * 1e6)
+        print "  edit and save      : %8.1f us" % (t_edit_save * 1e6)
+    finally:
+        shutil.rmtree(directory)
+
+
+REGISTRY_PROBE = """
+import gc, os, time
+def rss():
+    return int(open('/proc/self/statm').read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+import AlienFX.AlienFXProperties, AlienFX.AlienFXTexts
+before = rss()
+start = time.time()
+from AlienFX.AlienFXComputers import AllComputers
+elapsed = time.time() - start
+after = rss()
+models = len([o for o in gc.get_objects() if type(o).__name__ == 'instance' and o.__class__.__name__.startswith('M1')])
+regions = AllComputers.computerIndex[(0x187c, 0x0520)].computer.regions
+print elapsed, after - before, models
+"""
+
+
+def bench_registry(args):
+    """Import time, memory and models built by the import of AlienFXComputers, each in a fresh interpreter"""
+    import subprocess
+    results = []
+    for i in range(max(args.repeat, 5)):
+        out = subprocess.check_output([sys.executable, "-c", REGISTRY_PROBE], cwd=os.path.dirname(os.path.abspath(__file__)))
+        elapsed, memory, models = out.split()
+        results.append((float(elapsed), int(memory), int(models)))
+    elapsed = sorted([r[0] for r in results])[len(results) / 2]
+    print "import AlienFX.AlienFXComputers, median of %d interpreters" % len(results)
+    print "  import time  : %8.2f ms" % (elapsed * 1000)
+    print "  RSS increase : %8d kB" % (results[0][1] / 1024)
+    print "  models built : %8d" % results[0][2]
+
+
+def footprint(root):
+    """Bytes of the objects reachable from root, each counted once, leaving out the classes, functions and integers shared with the rest of the program"""
+    import gc
+    import types
+    shared = (type, types.ClassType, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, int)
+    seen = set()
+    stack = [root]
+    size = 0
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, shared):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        stack.extend(gc.get_referents(obj))
+    return size
+
+
+def bench_memory(args):
+    """Memory of a loaded profile of 10000 entries, of its packets and of the regions of every model"""
+    import shutil
+    import tempfile
+    from AlienFX.AlienFXConfiguration import AlienFXConfiguration
+    steps = 10000
+    directory = tempfile.mkdtemp()
+    try:
+        path = profile_library(directory, 1, 0)[0]
+        conf = AlienFXConfiguration()
+        conf.Load(path)
+        name = sorted(conf.area.keys())[0]
+        for i in range(steps):
+            conf.area[name].append("morph", "%06X" % (i * 0x10101 & 0xffffff), "%06X" % (~i & 0xffffff))
+        conf.Save()
+        start = time.time()
+        conf = AlienFXConfiguration()
+        conf.Load(path)
+        t_load = time.time() - start
+        entries = list(conf.area[name])
+    finally:
+        shutil.rmtree(directory)
+    driver, controller = simulated_driver(AlienFX_Simulator())
+    request = AlienFX_Constructor(driver)
+    area = request.Area(driver.computer.regions[name].regionId)
+    start = time.time()
+    for entry in entries:
+        request.Set_Morph_Color(area, request.Color(entry.color1), request.Color2(entry.color2))
+    request.End_Loop()
+    request.End_Transfert()
+    t_build = time.time() - start
+    packets = list(request)
+    regions = [c.computer.regions for c in AllComputers.computerList.values()]
+    for name, root, count, t in [("profile entries", entries, len(entries), t_load), ("packets", packets, len(packets), t_build)]:
+        size = footprint(root)
+        print "  %-15s : %6d, %8d kB, %5.1f bytes each, built in %6.1f ms" % (name, count, size / 1024, float(size) / count, t * 1000)
+    count = sum([len(r) for r in regions])
+    size = footprint(regions)
+    print "  %-15s : %6d, %8d kB, %5.1f bytes each" % ("model regions", count, size / 1024, float(size) / count)
+
+
+def startup(command, cwd, repeat):
+    """Run command repeat times, return the (milliseconds, stderr) of the median run"""
+    import subprocess
+    runs = []
+    for i in range(repeat):
+        start = time.time()
+        p = subprocess.Popen(command, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = p.communicate()
+        if p.returncode:
+            raise AssertionError("%s failed :\n%s%s" % (" ".join(command), out, err))
+        runs.append(((time.time() - start) * 1000, err))
+    runs.sort()
+    return runs[len(runs) / 2]
+
+
+def bench_startup(args):
+    """Time to the first packet and to the end of pyAlienFX_cli.py, on a simulated controller and through a daemon,
+    then check a profile written through a daemon at the default pacing : applied once, every region shown"""
+    import shutil
+    import tempfile
+    directory = tempfile.mkdtemp()
+    cli = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "pyAlienFX_cli.py")]
+    computer = AllComputers.computerIndex[(0x187c, 0x0518)]
+    server, loop = start_daemon(args, addr=os.path.join(directory, "daemon.sock"))
+    try:
+        path = profile_library(os.path.join(directory, "Profiles"), 1, args.steps, computer.name)[0]
+        repeat = max(args.repeat, 5)
+        print "pyAlienFX_cli.py, profile of %d regions x %d steps, median of %d runs" % (len(computer.computer.regions), args.steps, repeat)
+        print "  %-16s : %8.1f ms" % ("python -c pass", startup([sys.executable, "-c", "pass"], directory, repeat)[0])
+        for name, options in [("simulated device", ["--simulate", "--pacing", "status", "--verified"]), ("daemon", ["--unix", server.addr])]:
+            elapsed, report = startup(cli + [path, "--import-times"] + options, directory, repeat)
+            times = {"first packet sent": "-"}
+            imports = []
+            for line in report.splitlines():
+                if " after " in line:
+                    event, after = line.split(" after ")
+                    times[event] = after
+                elif line.startswith("import time:") and line.endswith("| total"):
+                    total = int(line.split("|")[1])
+                elif line.startswith("import time:") and "self [us]" not in line and not line.split("|")[2].startswith("  "):
+                    imports.append(line)
+            print "  %-16s : run %8.1f ms, imports %6.1f ms, first packet after %s, applied after %s" % (name, elapsed, total / 1000.0, times["first packet sent"], times["profile applied"])
+            for line in imports:
+                print "      " + line
+        fixed, fixed_loop = start_daemon(args, addr=os.path.join(directory, "fixed.sock"), pacing="fixed", verified=False)
+        try:
+            elapsed, report = startup(cli + [path, "--unix", fixed.addr], directory, 1)
+        finally:
+            stop_daemon(fixed, fixed_loop)
+        from AlienFX.AlienFXConfiguration import AlienFXConfiguration
+        direct = AlienFX_Simulator(latency=args.latency)
+        driver, controller = simulated_driver(direct)
+        configuration = AlienFXConfiguration()
+        configuration.Load(path)
+        configuration.Apply(controller, driver.computer)
+        sim = fixed.driver.backend
+        regions = [r.regionId for r in computer.computer.regions.values() if not r.power_button]
+        assert sim.writes == direct.writes, "%d packets through the daemon, %d written directly" % (sim.writes, direct.writes)
+        assert not [r for r in regions if r not in sim.showing], "regions not shown : %s" % sim.showing.keys()
+        print "  %-16s : run %8.1f ms, %d packets like a direct write, %d regions shown" % ("daemon, fixed", elapsed, sim.writes, len(regions))
+    finally:
+        stop_daemon(server, loop)
+        shutil.rmtree(directory)
+
+
+benchmarks = {
+    "animation": bench_animation,
+    "apply": bench_apply,
+    "capture": bench_capture,
+    "daemon": bench_daemon,
+    "protocol": bench_protocol,
+    "transport": bench_transport,
+    "coalesce": bench_coalesce,
+    "colors": bench_colors,
+    "compile": bench_compile,
+    "diff": bench_diff,
+    "profiles": bench_profiles,
+    "registry": bench_registry,
+    "dirty": bench_dirty,
+    "disassemble": bench_disassemble,
+    "discovery": bench_discovery,
+    "index": bench_index,
+    "legend": bench_legend,
+    "memory": bench_memory,
+    "startup": bench_startup}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="pyAlienFX benchmarks")
+    parser.add_argument("benchmark", choices=sorted(benchmarks.keys()))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--devices", type=int, default=100, help="number of devices on the simulated bus")
+    parser.add_argument("--read-cost", type=float, default=0.0001, help="seconds per descriptor read")
+    parser.add_argument("--latency", type=float, default=0.0005, help="seconds per simulated transfer")
+    parser.add_argument("--clients", type=int, default=50, help="concurrent daemon clients")
+    parser.add_argument("--commands", type=int, default=10, help="commands sent by each daemon client")
+    parser.add_argument("--steps", type=int, default=8, help="loop entries per region of the benchmarked profiles")
+    parser.add_argument("--busy", type=float, default=0.005, help="seconds the simulated controller stays busy after an execute")
+    parser.add_argument("--profiles", type=int, default=200, help="profiles in the benchmarked library")
+    parser.add_argument("--fps", type=float, default=30, help="target frame rate of the animation benchmark")
+    parser.add_argument("--duration", type=float, default=2.0, help="seconds of animation per effect")
+    args = parser.parse_args()
+    benchmarks[args.benchmark](args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+
+# This file is part of pyAlienFX.
+#
+#    pyAlienFX is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    pyAlienFX is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with pyAlienFX.  If not, see <http://www.gnu.org/licenses/>.
+#
+#    This work is licensed under the Creative Commons Attribution-NonCommercial-ShareAlike 3.0 Unported License.
+#    To view a copy of this license, visit http://creativecommons.org/licenses/by-nc-sa/3.0/ or send a letter
+#    to Creative Commons, 444 Castro Street, Suite 900, Mountain View, California, 94041, USA.
+#
+
+# PyAlienFX command line
+# Apply a profile without the GTK interface, for the login scripts and the udev rules :
+#   pyAlienFX_cli.py [profile] [--save] [--unix [path]] [--no-daemon] [--pacing fixed|status] [--verified]
+# profile is a name listed in ./Profiles/ or a .cfg / .cfgb file, the last profile of the GUI by default.
+# The profile is sent to the daemon when one is running, written on the device otherwise.
+# Startup time is the point of this script : the AlienFX modules are imported in the functions which need them,
+# the engine and pyusb only when there is no daemon. --import-times prints the import time of every module
+# (like python3 -X importtime) and when the first packet was sent.
+
+import time
+
+START = time.time()
+
+import os
+import sys
+import argparse
+import __builtin__
+
+PROFILES = os.path.join('.', 'Profiles')
+UNIX_PATH = '/tmp/pyAlienFX.sock'  # see pyAlienFX_daemon.py
+
+
+class Import_Timer:
+    """Time the imports made while it is installed"""
+
+    def __init__(self):
+        self.original = __builtin__.__import__
+        # (depth, module, self seconds, cumulative seconds) in the order the imports finished
+        self.imports = []
+        self.children = [0.0]
+        __builtin__.__import__ = self.Import
+
+    def Import(self, name, globals=None, locals=None, fromlist=None, level=-1):
+        # name or, for the implicit relative imports of Python 2, the module of the importing package,
+        # and the submodules of the from ... import
+        names = [name]
+        if globals and globals.get("__name__"):
+            package = globals["__name__"]
+            if "__path__" not in globals:
+                package = package.rpartition(".")[0]
+            if package:
+                names.append(package + "." + name)
+        names += [n + "." + f for n in names for f in fromlist or [] if f != "*"]
+        new = [n for n in names if sys.modules.get(n) is None]
+        self.children.append(0.0)
+        start = time.time()
+        try:
+            return self.original(name, globals, locals, fromlist, level)
+        finally:
+            cumulative = time.time() - start
+            children = self.children.pop()
+            loaded = [n for n in new if sys.modules.get(n) is not None]
+            if loaded:
+                self.imports.append((len(self.children) - 1, loaded[-1], cumulative - children, cumulative))
+                self.children[-1] += cumulative
+            else:
+                self.children[-1] += children
+
+    def Remove(self):
+        __builtin__.__import__ = self.original
+
+    def Report(self, out):
+        print >> out, "import time: self [us] | cumulative | imported package"
+        for depth, name, own, cumulative in self.imports:
+            print >> out, "import time: %9d | %10d | %s%s" % (own * 1e6, cumulative * 1e6, "  " * depth, name)
+        print >> out, "import time: %9s | %10d | total" % ("", self.children[0] * 1e6)
+
+
+def Elapsed():
+    return (time.time() - START) * 1000
+
+
+def Find_Profile(profile):
+    """Path of profile : a file, a profile name of PROFILES, None for the last profile of the GUI"""
+    if profile is None:
+        try:
+            f = open(os.path.join(PROFILES, "last"), 'r')
+            profile = f.readline().strip()
+            f.close()
+        except IOError:
+            profile = "Default.cfg"
+        return os.path.join(PROFILES, profile)
+    if os.path.isfile(profile):
+        return profile
+    from AlienFX.AlienFXConfiguration import AlienFXProfileIndex
+    profiles = AlienFXProfileIndex(PROFILES).Profiles()
+    if profile in profiles:
+        return os.path.join(PROFILES, profiles[profile])
+    return None
+
+
+def Daemon(path):
+    """A Daemon_Controller connected to the daemon, None when it is not running.
+    There is no reply timeout : a profile written at the default pacing takes seconds."""
+    from AlienFX.AlienFXClient import Daemon_Controller
+    from AlienFX import AlienFXProtocol
+    daemon = Daemon_Controller(AlienFXProtocol.BINARY, path=path, timeout=None)
+    if not daemon.makeConnection():
+        return None
+    return daemon
+
+
+def Driver(args):
+    """An AlienFX_Controller on the device, or on a simulated one"""
+    from AlienFX.AlienFXEngine import AlienFX_Driver, AlienFX_Controller
+    backend = None
+    if args.simulate:
+        from AlienFX.AlienFXSimulator import AlienFX_Simulator
+        backend = AlienFX_Simulator(productId=args.product)
+    driver = AlienFX_Driver(backend)
+    driver.Set_Pacing(args.pacing)
+    controller = AlienFX_Controller(driver)
+    controller.Set_Verified(args.verified)
+    return controller
+
+
+def main():
+    timer = None
+    if "--import-times" in sys.argv:
+        timer = Import_Timer()
+    parser = argparse.ArgumentParser(description="Apply an AlienFX profile without the graphical interface")
+    parser.add_argument("profile", nargs="?", help="profile name or file, the last profile of the GUI by default")
+    parser.add_argument("--save", action="store_true", help="store the profile in the controller, it is shown at boot")
+    parser.add_argument("--unix", nargs="?", const=UNIX_PATH, help="connect to the daemon through a unix socket")
+    parser.add_argument("--no-daemon", action="store_true", help="write on the device even when the daemon is running")
+    parser.add_argument("--pacing", choices=["fixed", "status"], default="fixed", help="pacing of the packets written on the device")
+    parser.add_argument("--verified", action="store_true", help="send every request once and check the controller status instead of sending it twice")
+    parser.add_argument("--simulate", action="store_true", help="write on a simulated controller instead of the device")
+    parser.add_argument("--product", type=lambda x: int(x, 16), default=0x0518, help="product id of the simulated controller")
+    parser.add_argument("--import-times", action="store_true", help="print the import time of every module and when the first packet was sent")
+    args = parser.parse_args()
+
+    path = Find_Profile(args.profile)
+    if path is None or not os.path.isfile(path):
+        parser.error("no profile %s" % (path or args.profile))
+    from AlienFX.AlienFXConfiguration import AlienFXConfiguration
+    from AlienFX.AlienFXComputers import AllComputers
+    configuration = AlienFXConfiguration()
+    configuration.Load(path)
+
+    controller = None
+    if not args.no_daemon and not args.simulate:
+        controller = Daemon(args.unix)
+    first = []
+    if controller is not None:
+        computer = AllComputers.computerIndex[controller.Computer()].computer
+    else:
+        controller = Driver(args)
+        computer = controller.driver.computer
+        if timer is not None:
+            controller.driver.Add_Trace(lambda request: first or first.append(Elapsed()))
+    missing = [zone for zone in computer.regions if zone not in configuration.area]
+    if missing:
+        print "The profile %s (%s) has no %s for the %s" % (configuration.name, configuration.computer, ", ".join(missing), computer.name)
+        sys.exit(1)
+    print "Applying %s on %s" % (configuration.name, computer.name)
+    configuration.Apply(controller, computer, save=args.save)
+    if timer is not None:
+        timer.Remove()
+        timer.Report(sys.stderr)
+        if first:
+            print >> sys.stderr, "first packet sent after %.1f ms" % first[0]
+        print >> sys.stderr, "profile applied after %.1f ms" % Elapsed()
+    controller.Bye()
+
+if __name__ == "__main__":
+    main()
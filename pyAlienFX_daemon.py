@@ -24,20 +24,45 @@
 
 # PyALienFX Deamon
 # The deamon will load the driver and the controller
-# You can comunicate with the Deamon through TCP
+# You can comunicate with the Deamon through TCP, or a unix socket : pyAlienFX_daemon.py --unix [path]
+# The USB transfers can be recorded in a capture file : pyAlienFX_daemon.py --capture [path] (see AlienFX/AlienFXCapture.py)
+# with the text protocol (Command,arg,arg|Command,...) or the binary one (see AlienFX/AlienFXProtocol.py)
 # You can send packet so the deamon will control the AlienFX
 # That way you can create GUI, plugins, ect to play with the AlienFX !
 
 
 from AlienFX.AlienFXEngine import *
+from AlienFX import AlienFXProtocol
+from AlienFX import AlienFXCapture
 from socket import *
+import socket as socket_module
 import sys
 import os
+import time
+import asyncore
+import threading
+import struct
+import collections
+import Queue
+import platform
 
 BUFSIZ = 4096
+BACKLOG = 64
+LATENCY_SAMPLES = 10000
 HOST = 'localhost'
 PORT = 25436  # ALIEN port as if you typed ALIEN on your phone ;)
 ADDR = (HOST, PORT)
+UNIX_PATH = '/tmp/pyAlienFX.sock'
+UNIX_MODE = 0o600
+CAPTURE_PATH = '/tmp/pyAlienFX.capture'
+CAPTURE_RECORDS = 65536
+# SO_PEERCRED is not exported by the socket module of Python 2, its value depends on the architecture :
+# 17 is only used where it is known to be right, elsewhere the uid check is disabled
+PEERCRED_MACHINES = ["x86_64", "amd64", "i386", "i486", "i586", "i686", "aarch64", "armv6l", "armv7l", "armv8l", "s390x", "riscv64"]
+SO_PEERCRED = getattr(socket_module, "SO_PEERCRED", None)
+if SO_PEERCRED is None and sys.platform.startswith("linux") and platform.machine() in PEERCRED_MACHINES:
+    SO_PEERCRED = 17
+CONF_COMMANDS = ["Set_Loop_Conf", "Add_Loop_Conf", "Add_Speed_Conf", "End_Loop_Conf", "End_Transfert_Conf", "Write_Conf"]
 # LOGFILE = '/var/log/pydaemon.log'
 # PIDFILE = '/var/run/pydaemon.pid'
 
@@ -66,244 +91,678 @@ ADDR = (HOST, PORT)
 #    Daemon = ServCmd()
 
 class ServCmd:
+    """The daemon : an asyncore event loop serves any number of clients while a single Device_Owner thread
+    executes their commands one at a time, so a slow USB operation never stalls the sockets."""
 
-    def __init__(s):
+    def __init__(s, driver=None, addr=ADDR, mode=UNIX_MODE, allowed_uids=None, coalesce=True):
+        """addr is a (host, port) tuple for TCP or a path for a unix socket, created with the mode permissions.
+        A unix socket only accepts root and the allowed_uids (default : the user running the daemon).
+        With coalesce, a pending color or configuration is replaced by a newer one for the same region or block."""
         print "Initializing Driver  ..."
-        s.driver = AlienFX_Driver()
+        if driver is None:
+            driver = AlienFX_Driver()
+        s.driver = driver
         print "Initializing Controller ..."
         s.controller = AlienFX_Controller(s.driver)
         s.computer = s.driver.computer
-        s.__serv = socket(AF_INET, SOCK_STREAM)
-        s.__serv.bind((ADDR))
-        # s.__serv.settimeout(60)
-        s.__cli = None
+        s.map = {}
+        if allowed_uids is None:
+            allowed_uids = [os.getuid()]
+        s.allowed_uids = set(allowed_uids)
+        s.rejected = 0
+        s.__listener = Listener(s, addr, mode)
+        s.addr = s.__listener.getsockname()
+        s.__replies = collections.deque()
+        s.__wakeup = Wakeup(s)
+        s.coalesce = coalesce
+        s.owner = Device_Owner(s)
+        s.latencies = collections.deque(maxlen=LATENCY_SAMPLES)
+        s.commands = 0
+        s.started = time.time()
         s.__imlistening = 0
-        s.__improcessing = 0
-        s.__run()
 
-    def __run(s):
+    def run(s):
+        s.owner.start()
         s.__imlistening = 1
-        while s.__imlistening:
-            try:
-                s.__listen()
-            except KeyboardInterrupt:
-                s.__serv.close()
-                sys.exit(0)
-            s.__improcessing = 1
-            while s.__improcessing:
-                s.__procCmd()
-            s.__cli.close()
-        s.__serv.close()
-
-    def __listen(s):
-        s.__serv.listen(5)
-        print '...listening'
+        if type(s.addr) == str:
+            print '...listening on %s' % s.addr
+        else:
+            print '...listening on %s:%s' % s.addr
         try:
-            cli, addr = s.__serv.accept()
+            while s.__imlistening:
+                asyncore.loop(timeout=0.5, map=s.map, count=1)
         except KeyboardInterrupt:
             print "EXIT"
-            s.__serv.close()
-            sys.exit(0)
-        s.__cli = cli
-        print '...connected: ', addr
+        s.stop()
+
+    def stop(s):
+        s.__imlistening = 0
+        s.owner.queue.put(None)
+        for d in s.map.values():
+            d.close()
 
-    def __procCmd(s):
+    def Accept_Peer(s, sock):
+        """Check the credentials of the process connected to the unix socket"""
+        credentials = Peer_Credentials(sock)
+        if credentials is None:
+            # no SO_PEERCRED, the socket file permissions are the only check
+            return True
+        pid, uid, gid = credentials
+        if uid == 0 or uid in s.allowed_uids:
+            return True
+        print "Rejected pid %d uid %d" % (pid, uid)
+        s.rejected += 1
+        return False
+
+    def Command(s, client, cmd):
+        """Called by the event loop for every message received from a client"""
+        c = cmd.strip()
+        if c == "PING":
+            print "Received Ping => Sending PONG"
+            client.Send('PONG')
+        elif c == 'COMPUTER':
+            client.Send('%04x:%04x' % (s.driver.vendorId, s.driver.productId))
+        elif c == 'BYE':
+            client.close()
+        elif c == 'EXIT':
+            client.close()
+            s.__imlistening = 0
+        elif c == 'STATS':
+            client.Send(",".join(["%s=%s" % (k, v) for k, v in sorted(s.Stats().items())]))
+        else:
+            s.Queue(client, cmd, s.Text_Key(cmd))
+
+    def Queue(s, client, cmd, key):
+        """Queue a device command, numbered so that the client gets its replies in order"""
+        if not s.coalesce:
+            key = None
+        client.queued += 1
+        s.owner.queue.put((client, cmd, time.time(), client.queued), key)
+
+    def Text_Key(s, cmd):
+        """Coalescing key of a text message : a single Set_Color* of a region, or a whole configuration of a block,
+        None for anything else, the saves and the messages starting with TEXT_NO_MERGE"""
+        if cmd.strip().startswith(AlienFXProtocol.TEXT_NO_MERGE):
+            return None
+        commands = [c.split(',') for c in cmd.strip().split('|')]
+        first, last = commands[0], commands[-1]
         try:
-            cmd = s.__cli.recv(BUFSIZ)
-        except KeyboardInterrupt:
-            s.__cli.close()
-            s.__serv.close()
-            sys.exit(0)
+            if len(commands) == 1 and first[0] in ["Set_Color", "Set_Color_Blink"] and first[3:4] != ["True"]:
+                return ("region", int(first[1], 16))
+            if len(commands) == 1 and first[0] == "Set_Color_Morph" and first[4:5] != ["True"]:
+                return ("region", int(first[1], 16))
+            conf = not [c for c in commands if c[0] not in CONF_COMMANDS]
+            if conf and first[0] == "Set_Loop_Conf" and last[0] == "Write_Conf" and first[1:2] != ["True"]:
+                return ("block", int(first[2] or 1))
+        except (IndexError, ValueError):
+            pass
+        return None
+
+    def Frame_Key(s, frame):
+        """Coalescing key of a single binary frame"""
+        opcode, flags, request_id, payload = frame
+        if flags & AlienFXProtocol.FLAG_NO_COALESCE:
+            return None
+        if opcode in [AlienFXProtocol.OP_SET_COLOR, AlienFXProtocol.OP_SET_COLOR_BLINK, AlienFXProtocol.OP_SET_COLOR_MORPH]:
+            name, args = AlienFXProtocol.Decode_Call(opcode, payload)
+            if not args[-3]:
+                return ("region", args[0])
+        return None
+
+    def Queue_Frames(s, client, batch):
+        """Queue the device frames of a read : each Set_Color* and each whole configuration from Set_Loop_Conf to Write_Conf
+        is queued on its own with its key, the frames in between are queued together"""
+        group = []
+        conf = None
+        for frame in batch:
+            opcode, flags, request_id, payload = frame
+            if opcode == AlienFXProtocol.OP_SET_LOOP_CONF:
+                if group:
+                    s.Queue(client, group, None)
+                group = []
+                Save, block = AlienFXProtocol.Decode_Call(opcode, payload)[1]
+                conf = not Save and not flags & AlienFXProtocol.FLAG_NO_COALESCE and ("block", block) or None
+            elif conf is not None and opcode not in AlienFXProtocol.CONF_OPCODES:
+                conf = None
+            group.append(frame)
+            if opcode == AlienFXProtocol.OP_WRITE_CONF:
+                s.Queue(client, group, conf)
+                group = []
+                conf = None
+            elif conf is None:
+                key = s.Frame_Key(frame)
+                if key is not None:
+                    if group[:-1]:
+                        s.Queue(client, group[:-1], None)
+                    s.Queue(client, [frame], key)
+                    group = []
+        if group:
+            s.Queue(client, group, None)
+
+    def Frames(s, client, frames):
+        """Called by the event loop with the binary frames of a read"""
+        batch = []
+        for frame in frames:
+            opcode, flags, request_id, payload = frame
+            if opcode == AlienFXProtocol.OP_PING:
+                client.Send(AlienFXProtocol.Frame(AlienFXProtocol.OP_REPLY, request_id, 'PONG'))
+            elif opcode == AlienFXProtocol.OP_COMPUTER:
+                computer = AlienFXProtocol.COMPUTER.pack(s.driver.vendorId, s.driver.productId)
+                client.Send(AlienFXProtocol.Frame(AlienFXProtocol.OP_REPLY, request_id, computer))
+            elif opcode == AlienFXProtocol.OP_BYE:
+                client.close()
+            elif opcode == AlienFXProtocol.OP_EXIT:
+                client.close()
+                s.__imlistening = 0
+            else:
+                batch.append(frame)
+        if batch:
+            s.Queue_Frames(client, batch)
+
+    def Coalesced(s, client, cmd, received, number):
+        """Reply to a command replaced by a newer one, once the newer one is executed"""
+        if type(cmd) == list:
+            reply = "".join([AlienFXProtocol.Frame(AlienFXProtocol.OP_REPLY, frame[2], flags=AlienFXProtocol.FLAG_COALESCED) for frame in cmd])
+        else:
+            reply = 'executed'
+        s.Reply(client, reply, received, number)
+
+    def Reply(s, client, reply, received, number):
+        """Called by the Device_Owner thread once a command is executed, the reply is sent by the event loop"""
+        s.__replies.append((client, reply, received, number))
+        s.__wakeup.Wake()
+
+    def Flush_Replies(s):
+        while s.__replies:
+            client, reply, received, number = s.__replies.popleft()
+            s.latencies.append(time.time() - received)
+            s.commands += 1
+            client.Answer(number, reply)
+
+    def Stats(s):
+        """Commands executed, commands per second since the start, latency percentiles (seconds) of the last commands
+        and commands dropped because a newer one replaced them"""
+        latencies = sorted(s.latencies)
+        stats = {"commands": s.commands, "commands_per_second": s.commands / (time.time() - s.started), "p50": 0.0, "p99": 0.0,
+                 "dropped": s.owner.queue.dropped}
+        if latencies:
+            stats["p50"] = latencies[int(len(latencies) * 0.50)]
+            stats["p99"] = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        return stats
+
+    def Restart(s):
+        """Build a new driver and controller, with the pacing, verified mode, diff apply, traces and capture of the old ones.
+        Return False and keep the old ones when the device cannot be found or taken over again."""
+        print "Restarting the driver ..."
+        old_driver, old_controller = s.driver, s.controller
+        try:
+            # AlienFX_Driver exits when the device is missing, the Device_Owner thread must survive it
+            driver = AlienFX_Driver(old_driver.backend)
+        except (Exception, SystemExit), e:
+            print "Restart failed, keeping the current driver : %s" % e
+            return False
+        s.driver = driver
+        s.driver.fixed_gap = old_driver.fixed_gap
+        s.driver.Set_Pacing(old_driver.pacing, old_driver.min_gap, old_driver.deadline)
+        s.driver.debug = old_driver.debug
+        for trace in old_driver.traces:
+            s.driver.Add_Trace(trace)
+        if old_driver.capture is not None:
+            s.driver.Set_Capture(old_driver.capture)
+        s.controller = AlienFX_Controller(s.driver)
+        s.controller.Set_Verified(old_controller.verified, old_controller.max_resends, old_controller.verify_timeout)
+        s.controller.Set_Diff_Apply(old_controller.diff_apply)
+        s.computer = s.driver.computer
+        return True
+
+    def Execute(s, client, cmd):
+        """Execute a text message or a binary frame of a client, runs in the Device_Owner thread.
+        Each client records its own configuration, so pipelined *_Conf calls of several clients do not mix."""
+        s.controller.conf = client.conf
+        try:
+            if type(cmd) == list:
+                return "".join([s.Execute_Frame(frame) for frame in cmd])
+            print cmd
+            return s.Execute_Text(cmd)
+        finally:
+            client.conf = s.controller.conf
+
+    def Execute_Frame(s, frame):
+        try:
+            return s.Call_Frame(frame)
+        except Exception, e:
+            print "Error while executing frame 0x%02x : %s" % (frame[0], e)
+            return AlienFXProtocol.Frame(AlienFXProtocol.OP_REPLY, frame[2], flags=AlienFXProtocol.FLAG_ERROR)
+
+    def Call_Frame(s, frame):
+        """Call the controller method of a binary frame and build its reply"""
+        opcode, flags, request_id, payload = frame
+        if opcode == AlienFXProtocol.OP_RESTART:
+            if not s.Restart():
+                return AlienFXProtocol.Frame(AlienFXProtocol.OP_REPLY, request_id, flags=AlienFXProtocol.FLAG_ERROR)
+            return AlienFXProtocol.Frame(AlienFXProtocol.OP_REPLY, request_id)
+        name, args = AlienFXProtocol.Decode_Call(opcode, payload, s.computer.DATA_LENGTH)
+        if opcode in [AlienFXProtocol.OP_SET_LOOP, AlienFXProtocol.OP_SEND_REQUEST]:
+            request = AlienFX_Constructor(s.driver)
+            for packet in args[0]:
+                request.append(Request("Raw packet", packet))
+            args = [request]
+        result = getattr(s.controller, name)(*args)
+        if opcode in [AlienFXProtocol.OP_GET_STATE, AlienFXProtocol.OP_WAIT_FOR_OK]:
+            return AlienFXProtocol.Frame(AlienFXProtocol.OP_REPLY, request_id, chr(bool(result)))
+        return AlienFXProtocol.Frame(AlienFXProtocol.OP_REPLY, request_id)
+
+    def Execute_Text(s, cmd):
+        """Execute a message of | separated commands on the controller"""
+        if cmd.startswith(AlienFXProtocol.TEXT_NO_MERGE):
+            cmd = cmd[len(AlienFXProtocol.TEXT_NO_MERGE):]
+        if cmd.strip() == 'RESTART':
+            if not s.Restart():
+                return 'error'
+            return 'executed'
+        for c in cmd.split('|'):
+            command = c.split(',')[0]
+            arg = c.split(',')[1:]
+            if command == "Set_Loop":
+                action = arg[0]
+                s.controller.Set_Loop(action)
+            elif command == "Set_Loop_Conf":
+                if arg[0] == "True":
+                    Save = True
+                elif arg[0] == "False":
+                    Save = False
+                else:
+                    Save = None
+                if arg[1]:
+                    block = int(arg[1])
+                else:
+                    block = None
+                if Save and block:
+                    s.controller.Set_Loop_Conf(Save, block)
+                elif Save:
+                    s.controller.Set_Loop_Conf(Save=Save)
+                elif block:
+                    s.controller.Set_Loop_Conf(block=block)
+            elif command == "Add_Loop_Conf":
+                area, mode, color1, color2 = arg[0], arg[1], arg[2], arg[3]
+                if not color2:
+                    color2 = None
+                elif color2 == "None":
+                    color2 = None
+                if area and mode and color1:
+                    s.controller.Add_Loop_Conf(area, mode, color1, color2)
+            elif command == "Add_Speed_Conf":
+                if arg[0]:
+                    speed = int(arg[0])
+                    s.controller.Add_Speed_Conf(speed)
+                else:
+                    s.controller.Add_Speed_Conf()
+            elif command == "End_Loop_Conf":
+                s.controller.End_Loop_Conf()
+            elif command == "End_Transfert_Conf":
+                s.controller.End_Transfert_Conf()
+            elif command == "Write_Conf":
+                s.controller.Write_Conf()
+            elif command == "Set_Color":
+                Area, Color = arg[0], arg[1]
+                if arg[2]:
+                    if arg[2] == "False":
+                        Save = False
+                    elif arg[2] == "True":
+                        Save = True
+                    else:
+                        Save = None
+                else:
+                    Save = None
+                if arg[3]:
+                    if arg[3] == "False":
+                        Apply = False
+                    elif arg[3] == "True":
+                        Apply = True
+                    else:
+                        Apply = None
+                else:
+                    Apply = None
+                if arg[4]:
+                    block = int(arg[4])
+                else:
+                    block = None
+                if Save and Apply and block:
+                    s.controller.Set_Color(Area, Color, Save=Save, Apply=Apply, block=block)
+                elif Save and Apply:
+                    s.controller.Set_Color(Area, Color, Save=Save, Apply=Apply)
+                elif Save and block:
+                    s.controller.Set_Color(Area, Color, Save=Save, block=block)
+                elif Apply and block:
+                    s.controller.Set_Color(Area, Color, Apply=Apply, block=block)
+                elif Save:
+                    s.controller.Set_Color(Area, Color, Save=Save)
+                elif Apply:
+                    s.controller.Set_Color(Area, Color, Apply=Apply)
+                elif block:
+                    s.controller.Set_Color(Area, Color, block=block)
+            elif command == "Set_Color_Blink":
+                Area, Color = arg[0], arg[1]
+                if arg[2]:
+                    if arg[2] == "False":
+                        Save = False
+                    elif arg[2] == "True":
+                        Save = True
+                    else:
+                        Save = None
+                else:
+                    Save = None
+                if arg[3]:
+                    if arg[3] == "False":
+                        Apply = False
+                    elif arg[3] == "True":
+                        Apply = True
+                    else:
+                        Apply = None
+                else:
+                    Apply = None
+                if arg[4]:
+                    block = int(arg[4])
+                else:
+                    block = None
+                if Save and Apply and block:
+                    s.controller.Set_Color_Blink(Area, Color, Save=Save, Apply=Apply, block=block)
+                elif Save and Apply:
+                    s.controller.Set_Color_Blink(Area, Color, Save=Save, Apply=Apply)
+                elif Save and block:
+                    s.controller.Set_Color_Blink(Area, Color, Save=Save, block=block)
+                elif Apply and block:
+                    s.controller.Set_Color_Blink(Area, Color, Apply=Apply, block=block)
+                elif Save:
+                    s.controller.Set_Color_Blink(Area, Color, Save=Save)
+                elif Apply:
+                    s.controller.Set_Color_Blink(Area, Color, Apply=Apply)
+                elif block:
+                    s.controller.Set_Color_Blink(Area, Color, block=block)
+            elif command == "Set_Color_Morph":
+                Area, Color1, Color2 = arg[0], arg[1], arg[2]
+                if arg[3]:
+                    if arg[3] == "False":
+                        Save = False
+                    elif arg[3] == "True":
+                        Save = True
+                    else:
+                        Save = None
+                else:
+                    Save = None
+                if arg[4]:
+                    if arg[4] == "False":
+                        Apply = False
+                    elif arg[4] == "True":
+                        Apply = True
+                    else:
+                        Apply = None
+                else:
+                    Apply = None
+                if arg[5]:
+                    block = int(arg[5])
+                else:
+                    block = None
+                if Save and Apply and block:
+                    s.controller.Set_Color_Morph(Area, Color1, Color2, Save=Save, Apply=Apply, block=block)
+                elif Save and Apply:
+                    s.controller.Set_Color_Morph(Area, Color1, Color2, Save=Save, Apply=Apply)
+                elif Save and block:
+                    s.controller.Set_Color_Morph(Area, Color1, Color2, Save=Save, block=block)
+                elif Apply and block:
+                    s.controller.Set_Color_Morph(Area, Color1, Color2, Apply=Apply, block=block)
+                elif Save:
+                    s.controller.Set_Color_Morph(Area, Color1, Color2, Save=Save)
+                elif Apply:
+                    s.controller.Set_Color_Morph(Area, Color1, Color2, Apply=Apply)
+                elif block:
+                    s.controller.Set_Color_Morph(Area, Color1, Color2, block=block)
+            elif command == "WaitForOk":
+                s.controller.WaitForOk()
+            elif command == "Get_State":
+                s.controller.Get_State()
+            elif command == "Reset":
+                res_cmd = int(arg[0], 16)
+                s.controller.Reset(res_cmd)
+        return 'executed'
+
+
+class Coalescing_Queue:
+    """Queue of the device commands where the newest command for a key replaces the pending one (latest wins).
+    A command takes the place of the pending one with the same key, unless a command queued in between touches
+    the same state : a command without key, a configuration, or a color of an overlapping region.
+    get returns the command and the list of the commands it replaced."""
+
+    def __init__(self):
+        self.slots = collections.deque()
+        self.index = {}
+        self.dropped = 0
+        self.condition = threading.Condition()
+
+    def Conflict(self, key, other):
+        if other is None:
+            return True
+        if key[0] == "region" and other[0] == "region":
+            return key != other and key[1] & other[1] != 0
+        return key != other
+
+    def put(self, item, key=None):
+        with self.condition:
+            slot = key is not None and self.index.get(key)
+            if slot:
+                slots = list(self.slots)
+                after = slots[[i for i, other in enumerate(slots) if other is slot][0] + 1:]
+                if not [other for other in after if self.Conflict(key, other[0])]:
+                    slot[2].append(slot[1])
+                    slot[1] = item
+                    self.dropped += 1
+                    return
+            slot = [key, item, []]
+            self.slots.append(slot)
+            if key is not None:
+                self.index[key] = slot
+            self.condition.notify()
+
+    def get(self):
+        with self.condition:
+            while not self.slots:
+                self.condition.wait()
+            slot = self.slots.popleft()
+            if slot[0] is not None and self.index.get(slot[0]) is slot:
+                del self.index[slot[0]]
+            return slot[1], slot[2]
+
+
+class Device_Owner(threading.Thread):
+    """The only thread touching the USB device, it executes the queued commands in order"""
+
+    def __init__(self, server):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.server = server
+        self.queue = Coalescing_Queue()
+
+    def run(self):
+        while True:
+            item, replaced = self.queue.get()
+            if item is None:
+                break
+            client, cmd, received, number = item
+            try:
+                reply = self.server.Execute(client, cmd)
+            except (Exception, SystemExit), e:
+                print "Error while executing %s : %s" % (cmd, e)
+                reply = 'error'
+            # the replaced commands were sent first, they are answered first
+            for other in replaced:
+                self.server.Coalesced(*other)
+            self.server.Reply(client, reply, received, number)
+
+
+def Peer_Credentials(sock):
+    """(pid, uid, gid) of the process at the other end of a unix socket, None where SO_PEERCRED is not available"""
+    if SO_PEERCRED is None or not sys.platform.startswith("linux"):
+        return None
+    return struct.unpack("3i", sock.getsockopt(SOL_SOCKET, SO_PEERCRED, struct.calcsize("3i")))
+
+
+class Listener(asyncore.dispatcher):
+
+    def __init__(self, server, addr, mode=UNIX_MODE):
+        asyncore.dispatcher.__init__(self, map=server.map)
+        self.server = server
+        self.path = None
+        if type(addr) == str:
+            self.Remove_Stale(addr)
+            self.create_socket(AF_UNIX, SOCK_STREAM)
+            # the socket file is created with the right permissions, there is no window before a chmod
+            umask = os.umask(0o777 & ~mode)
+            try:
+                self.bind(addr)
+            finally:
+                os.umask(umask)
+            self.path = addr
+        else:
+            self.create_socket(AF_INET, SOCK_STREAM)
+            self.set_reuse_addr()
+            self.bind(addr)
+        self.listen(BACKLOG)
+
+    def Remove_Stale(self, path):
+        """Remove the socket file left by a daemon that is not running anymore"""
+        if not os.path.exists(path):
+            return
+        sock = socket(AF_UNIX, SOCK_STREAM)
+        try:
+            sock.connect(path)
+        except error:
+            os.unlink(path)
+            return
+        finally:
+            sock.close()
+        raise error("A daemon is already listening on %s" % path)
+
+    def handle_accept(self):
+        pair = self.accept()
+        if pair is not None:
+            cli, addr = pair
+            if self.path is not None:
+                if not self.server.Accept_Peer(cli):
+                    cli.close()
+                    return
+                print '...connected: ', self.path
+            else:
+                print '...connected: ', addr
+                cli.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+            Client(cli, self.server)
+
+    def close(self):
+        asyncore.dispatcher.close(self)
+        if self.path is not None and os.path.exists(self.path):
+            os.unlink(self.path)
+            self.path = None
+
+
+class Client(asyncore.dispatcher):
+
+    def __init__(self, sock, server):
+        asyncore.dispatcher.__init__(self, sock, map=server.map)
+        self.server = server
+        self.out = ""
+        self.conf = []
+        self.decoder = None
+        self.text = False
+        # device commands queued and answered, the replies executed out of turn wait in ready
+        self.queued = 0
+        self.answered = 0
+        self.ready = {}
+
+    def handle_read(self):
+        cmd = self.recv(BUFSIZ)
         if not cmd:
             return
-        print cmd
-        s.__servCmd(cmd)
-        if s.__improcessing:
-            if cmd != "PING":
-                for c in cmd.split('|'):
-                    command = c.split(',')[0]
-                    arg = c.split(',')[1:]
-                    if command == "Set_Loop":
-                        action = arg[0]
-                        s.controller.Set_Loop(action)
-                    elif command == "Set_Loop_Conf":
-                        if arg[0] == "True":
-                            Save = True
-                        elif arg[0] == "False":
-                            Save = False
-                        else:
-                            Save = None
-                        if arg[1]:
-                            block = int(arg[1])
-                        else:
-                            block = None
-                        if Save and block:
-                            s.controller.Set_Loop_Conf(Save, block)
-                        elif Save:
-                            s.controller.Set_Loop_Conf(Save=Save)
-                        elif block:
-                            s.controller.Set_Loop_Conf(block=block)
-                    elif command == "Add_Loop_Conf":
-                        area, mode, color1, color2 = arg[0], arg[1], arg[2], arg[3]
-                        if not color2:
-                            color2 = None
-                        elif color2 == "None":
-                            color2 = None
-                        if area and mode and color1:
-                            s.controller.Add_Loop_Conf(area, mode, color1, color2)
-                    elif command == "Add_Speed_Conf":
-                        if arg[0]:
-                            speed = int(arg[0])
-                            s.controller.Add_Speed_Conf(speed)
-                        else:
-                            s.controller.Add_Speed_Conf()
-                    elif command == "End_Loop_Conf":
-                        s.controller.End_Loop_Conf()
-                    elif command == "End_Transfert_Conf":
-                        s.controller.End_Transfert_Conf()
-                    elif command == "Write_Conf":
-                        s.controller.Write_Conf()
-                    elif command == "Set_Color":
-                        Area, Color = arg[0], arg[1]
-                        if arg[2]:
-                            if arg[2] == "False":
-                                Save = False
-                            elif arg[2] == "True":
-                                Save = True
-                            else:
-                                Save = None
-                        else:
-                            Save = None
-                        if arg[3]:
-                            if arg[3] == "False":
-                                Apply = False
-                            elif arg[3] == "True":
-                                Apply = True
-                            else:
-                                Apply = None
-                        else:
-                            Apply = None
-                        if arg[4]:
-                            block = int(arg[4])
-                        else:
-                            block = None
-                        if Save and Apply and block:
-                            s.controller.Set_Color(Area, Color, Save=Save, Apply=Apply, block=block)
-                        elif Save and Apply:
-                            s.controller.Set_Color(Area, Color, Save=Save, Apply=Apply)
-                        elif Save and block:
-                            s.controller.Set_Color(Area, Color, Save=Save, block=block)
-                        elif Apply and block:
-                            s.controller.Set_Color(Area, Color, Apply=Apply, block=block)
-                        elif Save:
-                            s.controller.Set_Color(Area, Color, Save=Save)
-                        elif Apply:
-                            s.controller.Set_Color(Area, Color, Apply=Apply)
-                        elif block:
-                            s.controller.Set_Color(Area, Color, block=block)
-                    elif command == "Set_Color_Blink":
-                        Area, Color = arg[0], arg[1]
-                        if arg[2]:
-                            if arg[2] == "False":
-                                Save = False
-                            elif arg[2] == "True":
-                                Save = True
-                            else:
-                                Save = None
-                        else:
-                            Save = None
-                        if arg[3]:
-                            if arg[3] == "False":
-                                Apply = False
-                            elif arg[3] == "True":
-                                Apply = True
-                            else:
-                                Apply = None
-                        else:
-                            Apply = None
-                        if arg[4]:
-                            block = int(arg[4])
-                        else:
-                            block = None
-                        if Save and Apply and block:
-                            s.controller.Set_Color_Blink(Area, Color, Save=Save, Apply=Apply, block=block)
-                        elif Save and Apply:
-                            s.controller.Set_Color_Blink(Area, Color, Save=Save, Apply=Apply)
-                        elif Save and block:
-                            s.controller.Set_Color_Blink(Area, Color, Save=Save, block=block)
-                        elif Apply and block:
-                            s.controller.Set_Color_Blink(Area, Color, Apply=Apply, block=block)
-                        elif Save:
-                            s.controller.Set_Color_Blink(Area, Color, Save=Save)
-                        elif Apply:
-                            s.controller.Set_Color_Blink(Area, Color, Apply=Apply)
-                        elif block:
-                            s.controller.Set_Color_Blink(Area, Color, block=block)
-                    elif command == "Set_Color_Morph":
-                        Area, Color1, Color2 = arg[0], arg[1], arg[2]
-                        if arg[3]:
-                            if arg[3] == "False":
-                                Save = False
-                            elif arg[3] == "True":
-                                Save = True
-                            else:
-                                Save = None
-                        else:
-                            Save = None
-                        if arg[4]:
-                            if arg[4] == "False":
-                                Apply = False
-                            elif arg[4] == "True":
-                                Apply = True
-                            else:
-                                Apply = None
-                        else:
-                            Apply = None
-                        if arg[5]:
-                            block = int(arg[5])
-                        else:
-                            block = None
-                        if Save and Apply and block:
-                            s.controller.Set_Color_Morph(Area, Color1, Color2, Save=Save, Apply=Apply, block=block)
-                        elif Save and Apply:
-                            s.controller.Set_Color_Morph(Area, Color1, Color2, Save=Save, Apply=Apply)
-                        elif Save and block:
-                            s.controller.Set_Color_Morph(Area, Color1, Color2, Save=Save, block=block)
-                        elif Apply and block:
-                            s.controller.Set_Color_Morph(Area, Color1, Color2, Apply=Apply, block=block)
-                        elif Save:
-                            s.controller.Set_Color_Morph(Area, Color1, Color2, Save=Save)
-                        elif Apply:
-                            s.controller.Set_Color_Morph(Area, Color1, Color2, Apply=Apply)
-                        elif block:
-                            s.controller.Set_Color_Morph(Area, Color1, Color2, block=block)
-                    elif command == "WaitForOk":
-                        s.controller.WaitForOk()
-                    elif command == "Get_State":
-                        s.controller.Get_State()
-                    elif command == "Reset":
-                        res_cmd = int(arg[0], 16)
-                        s.controller.Reset(res_cmd)
-                s.__cli.send('executed')
-            elif cmd == "PING":
-                print "Received Ping => Sending PONG"
-                s.__cli.send('PONG')
-                print "sent"
-
-    def __servCmd(s, cmd):
-        cmd = cmd.strip()
-        if cmd == 'BYE':
-            s.__improcessing = 0
-        elif cmd == 'EXIT':
-            s.__improcessing = 0
-            s.__imlistening = 0
-        elif cmd == 'RESTART':
-            s.__improcessing = 0
-            s.__imlistening = 0
-            s.__init__()
+        if not self.text and self.decoder is None:
+            # The first byte of the connection tells its protocol
+            if ord(cmd[0]) == AlienFXProtocol.MAGIC:
+                self.decoder = AlienFXProtocol.Decoder()
+            else:
+                self.text = True
+        if self.text:
+            self.server.Command(self, cmd)
+            return
+        try:
+            frames = self.decoder.Feed(cmd)
+        except AlienFXProtocol.ProtocolError, e:
+            print "Closing the connection : %s" % e
+            self.close()
+            return
+        self.server.Frames(self, frames)
+
+    def Send(self, data):
+        self.out += data
+
+    def Answer(self, number, reply):
+        """Send the reply of the device command number once the replies of the commands queued before it are sent"""
+        self.ready[number] = reply
+        while self.answered + 1 in self.ready:
+            self.answered += 1
+            reply = self.ready.pop(self.answered)
+            if self.connected:
+                self.Send(reply)
+
+    def writable(self):
+        return len(self.out) > 0
+
+    def handle_write(self):
+        sent = self.send(self.out)
+        self.out = self.out[sent:]
+
+    def handle_close(self):
+        self.close()
+
+
+class Wakeup(asyncore.dispatcher):
+    """Socket pair used by the Device_Owner thread to wake the event loop up when replies are ready"""
+
+    def __init__(self, server):
+        self.__sender, receiver = socketpair()
+        asyncore.dispatcher.__init__(self, receiver, map=server.map)
+        self.server = server
+
+    def Wake(self):
+        try:
+            self.__sender.send('x')
+        except error:
+            pass
+
+    def writable(self):
+        return False
+
+    def handle_read(self):
+        self.recv(BUFSIZ)
+        self.server.Flush_Replies()
+
+    def handle_close(self):
+        self.__sender.close()
+        self.close()
+
+def Option_Value(option, default):
+    """Value following option on the command line, default when it is missing"""
+    i = sys.argv.index(option)
+    value = sys.argv[i + 1:i + 2]
+    if not value or value[0].startswith("--"):
+        return default
+    return value[0]
+
 
 if __name__ == "__main__":
-    Daemon = ServCmd()
+    if "--unix" in sys.argv:
+        Daemon = ServCmd(addr=Option_Value("--unix", UNIX_PATH))
+    else:
+        Daemon = ServCmd()
+    if "--capture" in sys.argv:
+        Daemon.driver.Set_Capture(AlienFXCapture.AlienFX_Capture(CAPTURE_RECORDS, Option_Value("--capture", CAPTURE_PATH)))
+    Daemon.run()
 
 # if __name__ == "__main__":
 #    # do the UNIX double-fork magic, see Stevens' "Advanced
@@ -0,0 +1,219 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+
+# This file is part of pyAlienFX.
+#
+#    pyAlienFX is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    pyAlienFX is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with pyAlienFX.  If not, see <http://www.gnu.org/licenses/>.
+#
+#    This work is licensed under the Creative Commons Attribution-NonCommercial-ShareAlike 3.0 Unported License.
+#    To view a copy of this license, visit http://creativecommons.org/licenses/by-nc-sa/3.0/ or send a letter
+#    to Creative Commons, 444 Castro Street, Suite 900, Mountain View, California, 94041, USA.
+#
+
+
+# PyAlienFX packet replay
+# Send a recorded session again to the AlienFX controller, or to a simulated one, and report the latency of every
+# transfer and the status reports which differ from the recorded ones.
+# The session is a capture file (see AlienFX/AlienFXCapture.py), a usbmon text capture or the output of usbmonparser.py.
+# Usage : pyAlienFX_replay.py session [--speed N | --max] [--simulate] [--pacing fixed|status]
+
+import sys
+import time
+import argparse
+from collections import namedtuple
+
+from AlienFX.AlienFXEngine import *
+from AlienFX.AlienFXSimulator import AlienFX_Simulator
+from AlienFX import AlienFXCapture
+import usbmonparser
+
+# time is None when the session has no timestamps, result and latency when they were not recorded
+Replay_Entry = namedtuple("Replay_Entry", "time direction packet result latency")
+
+
+def Read_Capture(path):
+    for record in AlienFXCapture.Open(path).Records():
+        yield Replay_Entry(record.time, record.direction, [ord(b) for b in record.payload], record.result, record.latency)
+
+
+def Read_Usbmon(path, start_byte=0x02, send_request_type=0x21):
+    """usbmon text capture, or usbmonparser.py output with one packet per line in hex.
+    In a usbmon capture the commands are the control submissions of send_request_type and the status reports the data of
+    the control IN callbacks, the latency is the time between the submission and its callback.
+    The usbmonparser.py output has no direction : the packets starting with start_byte are commands, the others status reports."""
+    submitted = {}
+    for record in usbmonparser.Records(path):
+        if record.event is None:
+            if not record.data:
+                continue
+            packet = [ord(b) for b in record.data]
+            if packet[0] == start_byte:
+                yield Replay_Entry(None, AlienFXCapture.OUT, packet, None, None)
+            else:
+                yield Replay_Entry(None, AlienFXCapture.IN, packet, None, None)
+        elif record.xfer_type != "C":
+            continue
+        elif record.event == "S":
+            if record.direction == usbmonparser.IN or (record.setup[0] == send_request_type and record.data):
+                submitted[record.tag] = record
+        else:
+            submission = submitted.pop(record.tag, None)
+            if submission is None:
+                continue
+            result = record.status < 0 and AlienFXCapture.RESULT_ERROR or record.length
+            if record.direction == usbmonparser.OUT:
+                yield Replay_Entry(submission.time, AlienFXCapture.OUT, [ord(b) for b in submission.data], result, record.time - submission.time)
+            elif record.data:
+                yield Replay_Entry(submission.time, AlienFXCapture.IN, [ord(b) for b in record.data], result, record.time - submission.time)
+
+
+def Read_Session(path):
+    f = open(path, "rb")
+    magic = f.read(len(AlienFXCapture.MAGIC))
+    f.close()
+    if magic == AlienFXCapture.MAGIC:
+        return Read_Capture(path)
+    return Read_Usbmon(path)
+
+
+def Percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+class AlienFX_Replay:
+    """Send the entries of a session through driver.
+    speed scales the recorded delays (2 : twice as fast), None sends as fast as possible.
+    gap is the delay between the entries without timestamps. The pacing of the driver applies on top of the recorded delays."""
+
+    def __init__(self, driver, speed=1.0, gap=0.02):
+        self.driver = driver
+        self.speed = speed
+        self.gap = gap
+        self.latencies = []
+        self.recorded_latencies = []
+        self.divergences = []
+        self.errors = 0
+        self.skipped = 0
+        self.sent = 0
+        self.reads = 0
+        self.late = 0
+
+    def Wait(self, start, first, entry, previous):
+        """Sleep until the time of entry, on the replay clock"""
+        if self.speed is None:
+            return
+        if entry.time is None or first is None:
+            if previous is not None:
+                time.sleep(self.gap / self.speed)
+            return
+        delay = start + (entry.time - first) / self.speed - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        elif delay < -self.gap:
+            self.late += 1
+
+    def Send(self, n, entry):
+        d = self.driver
+        if len(entry.packet) != d.computer.DATA_LENGTH:
+            # WriteDevice only sends packets of DATA_LENGTH bytes
+            self.skipped += 1
+            self.divergences.append((n, entry, "skipped : %d bytes instead of %d" % (len(entry.packet), d.computer.DATA_LENGTH)))
+            return
+        before = d.send_time
+        try:
+            d.WriteDevice([Request(None, entry.packet)])
+        except usb.core.USBError, e:
+            self.errors += 1
+            if entry.result != AlienFXCapture.RESULT_ERROR:
+                self.divergences.append((n, entry, "error : %s" % e))
+            return
+        self.latencies.append(d.send_time - before)
+        self.sent += 1
+
+    def Read(self, n, entry):
+        d = self.driver
+        start = time.time()
+        try:
+            report = d.session.ctrl_transfer(d.READ_REQUEST_TYPE, d.READ_REQUEST, d.READ_VALUE, d.READ_INDEX, len(entry.packet) or d.computer.DATA_LENGTH)
+        except usb.core.USBError, e:
+            self.errors += 1
+            if entry.result != AlienFXCapture.RESULT_ERROR:
+                self.divergences.append((n, entry, "error : %s" % e))
+            return
+        self.latencies.append(time.time() - start)
+        self.reads += 1
+        if entry.packet and report[0] != entry.packet[0]:
+            self.divergences.append((n, entry, "status 0x%02x instead of 0x%02x" % (report[0], entry.packet[0])))
+
+    def Run(self, entries):
+        start = time.time()
+        first = None
+        previous = None
+        for n, entry in enumerate(entries):
+            if first is None:
+                first = entry.time
+            self.Wait(start, first, entry, previous)
+            if entry.latency is not None:
+                self.recorded_latencies.append(entry.latency)
+            if entry.direction == AlienFXCapture.OUT:
+                self.Send(n, entry)
+            else:
+                self.Read(n, entry)
+            previous = entry
+        self.elapsed = time.time() - start
+
+    def Report(self, max_divergences=20):
+        print "%d packets sent, %d status reads in %.3f s, %d errors, %d packets skipped, %d entries late" % (
+            self.sent, self.reads, self.elapsed, self.errors, self.skipped, self.late)
+        for name, values in [("replay", self.latencies), ("recorded", self.recorded_latencies)]:
+            if values:
+                print "  %-8s latency : p50 %8.1f us, p99 %8.1f us, max %8.1f us" % (
+                    name, Percentile(values, 0.5) * 1e6, Percentile(values, 0.99) * 1e6, max(values) * 1e6)
+        print "%d status divergences" % len(self.divergences)
+        for n, entry, divergence in self.divergences[:max_divergences]:
+            print "  #%-6d %-3s %s : %s" % (n, AlienFXCapture.DIRECTIONS[entry.direction], " ".join(["%02x" % b for b in entry.packet]), divergence)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded AlienFX session")
+    parser.add_argument("session", help="capture file, usbmon text capture or usbmonparser.py output")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed, 1 keeps the recorded timing")
+    parser.add_argument("--max", action="store_true", help="send as fast as possible")
+    parser.add_argument("--gap", type=float, default=0.02, help="seconds between the packets without timestamps")
+    parser.add_argument("--pacing", choices=["none", "fixed", "status"], default="none", help="pacing of the driver on top of the recorded timing")
+    parser.add_argument("--simulate", action="store_true", help="replay on a simulated controller")
+    parser.add_argument("--product", type=lambda x: int(x, 16), default=0x0518, help="product id of the simulated controller")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per simulated transfer")
+    parser.add_argument("--busy", type=float, default=0.0, help="seconds the simulated controller stays busy after an execute")
+    args = parser.parse_args()
+    sim = None
+    if args.simulate:
+        sim = AlienFX_Simulator(productId=args.product, latency=args.latency, execute_time=args.busy)
+    driver = AlienFX_Driver(backend=sim)
+    if args.pacing == "none":
+        driver.Set_Pacing(driver.PACING_FIXED)
+        driver.fixed_gap = 0
+    else:
+        driver.Set_Pacing(args.pacing)
+    replay = AlienFX_Replay(driver, not args.max and args.speed or None, args.gap)
+    replay.Run(Read_Session(args.session))
+    replay.Report()
+    if sim is not None:
+        print "simulator : %s" % sim.Stats()
+
+if __name__ == "__main__":
+    main()
@@ -1,60 +1,190 @@
 #!/usr/bin/python
 
+# Streaming parser of usbmon text captures (see Documentation/usb/usbmon.txt in the kernel sources) :
+#   cat /sys/kernel/debug/usb/usbmon/1u > capture.txt
+#   usbmonparser.py capture.txt --device 2 --request-type 0x21
+# The capture is read one line at a time, from a memory mapped file, stdin (-) or a growing file (--follow),
+# so the memory used does not depend on its size.
+# The lines made only of hex bytes (the output of this script) are read too, as records without address ; the default
+# output only keeps the indented ones ("    " in the line), like the first version of this script did.
+
 import sys
+import mmap
+import time
+import argparse
+from collections import namedtuple
+
+OUT = 0
+IN = 1
+
+# time in seconds, event S (submission), C (callback) or E (error), xfer_type C (control), Z (isochronous), I (interrupt) or B (bulk)
+# setup is (bmRequestType, bRequest, wValue, wIndex, wLength) for the control submissions, None otherwise
+# data is a string of bytes, empty when the data was not captured
+# text is the hex digits of a line made only of hex bytes, None for the usbmon events
+Usbmon_Record = namedtuple("Usbmon_Record", "tag time event xfer_type direction bus device endpoint setup status length data text")
+
+def Parse_Line(line, indented=False):
+    """Return the Usbmon_Record of a line, None if it is not a usbmon event nor a line of hex bytes.
+    With indented, a line of hex bytes is only read if it holds "    "."""
+    words = line.split()
+    if len(words) < 5 or ":" not in words[3]:
+        if indented and "    " not in line:
+            return None
+        text = line.strip().replace(" ", "")
+        try:
+            int(text, 16)
+        except ValueError:
+            return None
+        try:
+            data = text.decode("hex")
+        except TypeError:
+            # odd number of digits
+            data = ""
+        return Usbmon_Record(None, None, None, None, None, None, None, None, None, None, len(data), data, text)
+    address = words[3].split(":")
+    if len(address) == 4:
+        kind, bus, device, endpoint = address
+    elif len(address) == 3:
+        # format of the kernels before 2.6.21, without the bus number
+        kind, device, endpoint = address
+        bus = None
+    else:
+        return None
+    try:
+        if bus is not None:
+            bus = int(bus)
+        device = int(device)
+        endpoint = int(endpoint)
+        if words[4] == "s":
+            setup = (int(words[5], 16), int(words[6], 16), int(words[7], 16), int(words[8], 16), int(words[9], 16))
+            status = None
+            i = 10
+        else:
+            setup = None
+            status = int(words[4].split(":")[0])
+            i = 5
+        length = len(words) > i and int(words[i]) or 0
+        data = ""
+        if len(words) > i + 1 and words[i + 1] == "=":
+            data = "".join(words[i + 2:]).decode("hex")
+    except (ValueError, IndexError, TypeError):
+        return None
+    direction = kind[1:2] == "i" and IN or OUT
+    return Usbmon_Record(words[0], int(words[1]) * 1e-6, words[2], kind[0], direction, bus, device, endpoint, setup, status, length, data, None)
+
+
+def Lines(path, follow=False, interval=0.2):
+    """Yield the lines of path, a memory mapped file, stdin when path is - ; with follow, wait for the lines appended to the file"""
+    if path == "-":
+        for line in iter(sys.stdin.readline, ""):
+            yield line
+        return
+    f = open(path, "rb")
+    try:
+        if follow:
+            pending = ""
+            while True:
+                line = f.readline()
+                if not line:
+                    time.sleep(interval)
+                    continue
+                pending += line
+                if pending.endswith("\n"):
+                    yield pending
+                    pending = ""
+        try:
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty file
+            return
+        try:
+            for line in iter(m.readline, ""):
+                yield line
+        finally:
+            m.close()
+    finally:
+        f.close()
+
+
+def Parse(lines, bus=None, device=None, endpoint=None, request_type=None, indented=False):
+    """Yield the records of lines matching the filters.
+    The callback of a control transfer is matched with its submission to filter it by request_type,
+    only the submissions still waiting for their callback are kept in memory."""
+    pending = {}
+    for line in lines:
+        record = Parse_Line(line, indented)
+        if record is None:
+            continue
+        if record.event is None:
+            if bus is None and device is None and endpoint is None and request_type is None:
+                yield record
+            continue
+        if bus is not None and record.bus != bus:
+            continue
+        if device is not None and record.device != device:
+            continue
+        if endpoint is not None and record.endpoint != endpoint:
+            continue
+        if request_type is not None:
+            if record.event == "S":
+                if record.setup is None or record.setup[0] != request_type:
+                    continue
+                pending[record.tag] = True
+            elif pending.pop(record.tag, None) is None:
+                continue
+        yield record
+
+
+def Records(path, follow=False, **filters):
+    return Parse(Lines(path, follow), **filters)
+
+
+def Hex_Bytes(text):
+    """'020300' => '02 03 00 ', the output of the first version of this script"""
+    pairs = [text[i:i + 2] for i in xrange(0, len(text), 2)]
+    return "".join([len(pair) == 2 and pair + " " or pair for pair in pairs])
+
+
+def Format(record, verbose=False):
+    if record.text is not None:
+        return Hex_Bytes(record.text)
+    data = Hex_Bytes(record.data.encode("hex"))
+    if not verbose:
+        return data
+    data = data.rstrip()
+    if record.setup is not None:
+        status = "s %02x %02x %04x %04x %04x" % record.setup
+    else:
+        status = str(record.status)
+    return "%14.6f %s %s%s:%s:%03d:%d %-28s %4d %s" % (
+        record.time, record.event, record.xfer_type, record.direction == IN and "i" or "o",
+        record.bus, record.device, record.endpoint, status, record.length, data)
 
 
 class parser:
+    """Print the data of every packet of the capture in path, one packet per line"""
 
     def __init__(self, path):
-        f = open(path)
-        self.string = f.readlines()
-        self.clean()
-        self.Strip()
-        self.Print()
-
-    def clean(self):
-        tmp = []
-        for l in xrange(len(self.string)):
-            if "    " in self.string[l]:
-                tmp.append(self.string[l])
-        self.string = tmp
-
-    def Strip(self):
-        for l in range(len(self.string)):
-            self.string[l] = self.string[l].strip()
-        for l in range(len(self.string)):
-            tmp = ""
-            for i in self.string[l]:
-                if i != " ":
-                    tmp += i
-            self.string[l] = tmp
-        tmp = []
-        for l in self.string:
-            try:
-                int(l, 16)
-                tmp.append(l)
-            except:
-                pass
-        self.string = tmp
-
-    def Print(self):
-        for l in range(len(self.string)):
-            n = 0
-            tmp = ""
-            for i in self.string[l]:
-                if n == 1:
-                    n = 0
-                    tmp += "%s " % i
-                else:
-                    tmp += i
-                    n += 1
-            self.string[l] = tmp
-
-        for l in self.string:
-            print l
+        for record in Records(path, indented=True):
+            if record.data or record.text is not None:
+                print Format(record)
+
+
+def main():
+    options = argparse.ArgumentParser(description="Parse a usbmon text capture")
+    options.add_argument("file", help="capture file, - for stdin")
+    options.add_argument("--bus", type=int)
+    options.add_argument("--device", type=int)
+    options.add_argument("--endpoint", type=int)
+    options.add_argument("--request-type", type=lambda x: int(x, 16), help="bmRequestType of the control transfers, in hex (0x21 : AlienFX commands, 0xa1 : status reads)")
+    options.add_argument("--follow", action="store_true", help="wait for the lines appended to the file")
+    options.add_argument("--verbose", action="store_true", help="print the time, address and setup of every event, not only the data")
+    args = options.parse_args()
+    for record in Records(args.file, args.follow, bus=args.bus, device=args.device, endpoint=args.endpoint, request_type=args.request_type, indented=True):
+        if record.data or record.text is not None or args.verbose:
+            print Format(record, args.verbose)
+            if args.follow:
+                sys.stdout.flush()
 
 if __name__ == "__main__":
-    if len(sys.argv) == 2:
-        pa = parser(sys.argv[1])
-    else:
-        print "Usage : usbmonparser.py [File]"
+    main()